@@ -0,0 +1,148 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-process caches of the lookups runners do for every queue file.
+
+For messages with a sender, a runner needs the sender's preferred language,
+which takes a membership query.  Runners can cache it for `[runner.*]
+cache_ttl`.  The mailing lists themselves are not cached, since a list object
+belongs to a database session, and the list must be fetched again in every
+transaction anyway.  The cache is invalidated when lists are deleted and
+memberships change in this process; changes made in other processes are
+picked up when the entries expire.
+"""
+
+__all__ = [
+    'TTLCache',
+    'clear',
+    'handle_ListDeletingEvent',
+    'handle_MembershipChangeEvent',
+    'sender_language',
+    ]
+
+
+import time
+
+from mailman.interfaces.languages import ILanguageManager
+from mailman.interfaces.listmanager import ListDeletingEvent
+from mailman.interfaces.member import MembershipChangeEvent
+from zope.component import getUtility
+
+
+# Caches holding more entries than this, e.g. because of many one-off
+# senders, are emptied.
+MAX_ENTRIES = 10000
+
+
+
+class TTLCache:
+    """A mapping whose entries expire."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self._entries = {}
+        self._max_entries = max_entries
+
+    def get(self, key, ttl):
+        """Return the value of a key, or None.
+
+        :param key: The key.
+        :param ttl: The number of seconds after which entries are expired.
+        :type ttl: float
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, added = entry
+        if time.time() - added > ttl:
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value):
+        """Set the value of a key."""
+        if len(self._entries) >= self._max_entries:
+            self._entries.clear()
+        self._entries[key] = (value, time.time())
+
+    def discard(self, key):
+        """Remove a key, if it is cached."""
+        self._entries.pop(key, None)
+
+    def discard_matching(self, predicate):
+        """Remove all the keys for which the predicate is true."""
+        for key in list(self._entries):
+            if predicate(key):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all the keys."""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# (list id, sender) to the code of the language to use.
+_languages = TTLCache()
+
+
+
+def clear():
+    """Empty all the caches."""
+    _languages.clear()
+
+
+def sender_language(mlist, sender, ttl):
+    """The language to use for a message from a sender to a mailing list.
+
+    This is the member's preferred language if the sender is a member of the
+    list, otherwise the list's preferred language.
+
+    :param mlist: The mailing list.
+    :type mlist: `IMailingList`
+    :param sender: The sender's email address.
+    :type sender: str
+    :param ttl: How long the language is cached, in seconds.
+    :type ttl: float
+    :return: The language.
+    :rtype: `ILanguage`
+    """
+    key = (mlist.list_id, sender.lower())
+    code = _languages.get(key, ttl)
+    if code is not None:
+        return getUtility(ILanguageManager)[code]
+    member = mlist.members.get_member(sender)
+    language = (member.preferred_language
+                if member is not None
+                else mlist.preferred_language)
+    _languages.set(key, language.code)
+    return language
+
+
+
+def handle_ListDeletingEvent(event):
+    if not isinstance(event, ListDeletingEvent):
+        return
+    list_id = event.mailing_list.list_id
+    _languages.discard_matching(lambda key: key[0] == list_id)
+
+
+def handle_MembershipChangeEvent(event):
+    if not isinstance(event, MembershipChangeEvent):
+        return
+    list_id = event.mlist.list_id
+    _languages.discard_matching(lambda key: key[0] == list_id)
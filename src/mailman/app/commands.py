@@ -24,17 +24,21 @@ __all__ = [
 
 from mailman.config import config
 from mailman.interfaces.command import IEmailCommand
-from mailman.utilities.modules import find_components
 from zope.interface.verify import verifyObject
 
 
 
+def _make_command(command_class):
+    command = command_class()
+    verifyObject(IEmailCommand, command)
+    return command
+
+
 def initialize():
-    """Initialize the email commands."""
-    for command_class in find_components('mailman.commands', IEmailCommand):
-        command = command_class()
-        verifyObject(IEmailCommand, command)
-        assert command_class.name not in config.commands, (
-            'Duplicate email command "{0}" found in {1}'.format(
-                command_class.name, command_class.__module__))
-        config.commands[command_class.name] = command_class()
+    """Initialize the email commands.
+
+    The commands' modules are only imported when the commands are first
+    used.
+    """
+    config.commands.add_package(
+        'mailman.commands', IEmailCommand, _make_command)
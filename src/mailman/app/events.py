@@ -23,8 +23,8 @@ __all__ = [
 
 
 from mailman.app import (
-    domain, membership, moderator, registrar, subscriptions)
-from mailman.core import i18n, switchboard
+    cache, domain, membership, moderator, registrar, subscriptions)
+from mailman.core import i18n, metrics, switchboard
 from mailman.languages import manager as language_manager
 from mailman.styles import manager as style_manager
 from mailman.utilities import passwords
@@ -35,10 +35,13 @@ from zope import event
 def initialize():
     """Initialize global event subscribers."""
     event.subscribers.extend([
+        cache.handle_ListDeletingEvent,
+        cache.handle_MembershipChangeEvent,
         domain.handle_DomainDeletingEvent,
         i18n.handle_ConfigurationUpdatedEvent,
         language_manager.handle_ConfigurationUpdatedEvent,
         membership.handle_SubscriptionEvent,
+        metrics.handle_ConfigurationUpdatedEvent,
         moderator.handle_ListDeletingEvent,
         passwords.handle_ConfigurationUpdatedEvent,
         registrar.handle_ConfirmationNeededEvent,
@@ -0,0 +1,115 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the runners' lookup caches."""
+
+__all__ = [
+    'TestCaches',
+    'TestTTLCache',
+    ]
+
+
+import unittest
+
+from mailman.app import cache
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.languages import ILanguageManager
+from mailman.interfaces.listmanager import IListManager
+from mailman.interfaces.member import SubscriptionEvent
+from mailman.testing.layers import ConfigLayer
+from sqlalchemy import event
+from unittest.mock import Mock, patch
+from zope.component import getUtility
+from zope.event import notify
+
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_expiry(self):
+        ttl_cache = cache.TTLCache()
+        with patch('mailman.app.cache.time.time', return_value=1000):
+            ttl_cache.set('ant', 1)
+        with patch('mailman.app.cache.time.time', return_value=1010):
+            self.assertEqual(ttl_cache.get('ant', 10), 1)
+        with patch('mailman.app.cache.time.time', return_value=1011):
+            self.assertIsNone(ttl_cache.get('ant', 10))
+        self.assertEqual(len(ttl_cache), 0)
+
+    def test_max_entries(self):
+        # A full cache is emptied.
+        ttl_cache = cache.TTLCache(max_entries=2)
+        ttl_cache.set('ant', 1)
+        ttl_cache.set('bee', 2)
+        ttl_cache.set('cat', 3)
+        self.assertEqual(len(ttl_cache), 1)
+        self.assertEqual(ttl_cache.get('cat', 10), 3)
+
+    def test_discard_matching(self):
+        ttl_cache = cache.TTLCache()
+        ttl_cache.set(('ant', 1), 1)
+        ttl_cache.set(('ant', 2), 2)
+        ttl_cache.set(('bee', 1), 3)
+        ttl_cache.discard_matching(lambda key: key[0] == 'ant')
+        self.assertEqual(len(ttl_cache), 1)
+        self.assertEqual(ttl_cache.get(('bee', 1), 10), 3)
+
+
+
+class TestCaches(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('ant@example.com')
+        config.db.commit()
+
+    def test_sender_language(self):
+        # The language for a sender is cached until the list's memberships
+        # change.
+        self._mlist.preferred_language = 'fr'
+        language = cache.sender_language(
+            self._mlist, 'anne@example.com', 60)
+        self.assertEqual(language.code, 'fr')
+        self._mlist.preferred_language = 'en'
+        language = cache.sender_language(
+            self._mlist, 'Anne@example.com', 60)
+        self.assertEqual(language.code, 'fr')
+        notify(SubscriptionEvent(self._mlist, Mock()))
+        language = cache.sender_language(
+            self._mlist, 'anne@example.com', 60)
+        self.assertEqual(language.code, 'en')
+        self.assertIs(language, getUtility(ILanguageManager)['en'])
+
+    def test_sender_language_queries(self):
+        # Once the language for a sender is cached, finding it again in a
+        # later transaction takes no database queries.
+        statements = []
+        def count(*args):
+            statements.append(args)
+        event.listen(config.db.engine, 'before_cursor_execute', count)
+        self.addCleanup(event.remove, config.db.engine,
+                        'before_cursor_execute', count)
+        counts = []
+        for i in range(3):
+            config.db.commit()
+            mlist = getUtility(IListManager).get_by_list_id('ant.example.com')
+            del statements[:]
+            language = cache.sender_language(mlist, 'anne@example.com', 60)
+            self.assertEqual(language.code, 'en')
+            counts.append(len(statements))
+        self.assertGreater(counts[0], 0)
+        self.assertEqual(counts[1:], [0, 0])
@@ -29,7 +29,7 @@ from functools import cmp_to_key
 from mailman.core.i18n import _
 from mailman.core.initialize import initialize
 from mailman.interfaces.command import ICLISubCommand
-from mailman.utilities.modules import find_components
+from mailman.utilities.modules import component_manifest, find_name
 from mailman.version import MAILMAN_VERSION_FULL
 from zope.interface.verify import verifyObject
 
@@ -55,17 +55,17 @@ def main():
         Configuration file to use.  If not given, the environment variable
         MAILMAN_CONFIG_FILE is consulted and used if set.  If neither are
         given, a default configuration file is loaded."""))
-    # Look at all modules in the mailman.bin package and if they are prepared
-    # to add a subcommand, let them do so.  I'm still undecided as to whether
-    # this should be pluggable or not.  If so, then we'll probably have to
-    # partially parse the arguments now, then initialize the system, then find
-    # the plugins.  Punt on this for now.
+    # Look at all modules in the mailman.commands package and if they are
+    # prepared to add a subcommand, let them do so.  I'm still undecided as to
+    # whether this should be pluggable or not.  If so, then we'll probably
+    # have to partially parse the arguments now, then initialize the system,
+    # then find the plugins.  Punt on this for now.
+    #
+    # The subcommands' names and help texts come from the component manifest,
+    # so only the module of the subcommand being run is imported.  Its
+    # options are added once the arguments show which one it is.
     subparser = parser.add_subparsers(title='Commands')
-    subcommands = []
-    for command_class in find_components('mailman.commands', ICLISubCommand):
-        command = command_class()
-        verifyObject(ICLISubCommand, command)
-        subcommands.append(command)
+    subcommands = component_manifest('mailman.commands', ICLISubCommand)
     # --help should display the subcommands by alphabetical order, except that
     # 'mailman help' should be first.
     def sort_function(command, other):
@@ -82,9 +82,21 @@ def main():
             assert command.name > other.name
             return 1
     subcommands.sort(key=cmp_to_key(sort_function))
-    for command in subcommands:
+    command_parsers = {}
+    for info in subcommands:
         command_parser = subparser.add_parser(
-            command.name, help=_(command.__doc__))
+            info.name, help=_(info.doc), add_help=False)
+        command_parser.set_defaults(subcommand=info)
+        command_parsers[info.name] = command_parser
+    args, extras = parser.parse_known_args()
+    info = getattr(args, 'subcommand', None)
+    if info is not None:
+        command = find_name('{0}.{1}'.format(info.module, info.attribute))()
+        verifyObject(ICLISubCommand, command)
+        command_parser = command_parsers[info.name]
+        command_parser.add_argument(
+            '-h', '--help', action='help',
+            help=_('show this help message and exit'))
         command.add(parser, command_parser)
         command_parser.set_defaults(func=command.process)
     args = parser.parse_args()
@@ -23,8 +23,10 @@ __all__ = [
     ]
 
 
+import gc
 import os
 import sys
+import time
 import errno
 import signal
 import socket
@@ -33,10 +35,13 @@ import logging
 from datetime import timedelta
 from enum import Enum
 from flufl.lock import Lock, NotLockedError, TimeOutError
-from lazr.config import as_boolean
+from lazr.config import as_boolean, as_timedelta
 from mailman.config import config
+from mailman.core import metrics
 from mailman.core.i18n import _
-from mailman.core.logging import reopen
+from mailman.core.logging import reconfigure, reopen
+from mailman.core.switchboard import scale_file
+from mailman.utilities.modules import find_name
 from mailman.utilities.options import Options
 
 
@@ -44,6 +49,8 @@ DOT = '.'
 LOCK_LIFETIME = timedelta(days=1, hours=6)
 SECONDS_IN_A_DAY = 86400
 SUBPROC_START_WAIT = timedelta(seconds=20)
+# How often the master checks on its children when it autoscales runners.
+AUTOSCALE_POLL = 1
 
 # Environment variables to forward into subprocesses.
 PRESERVE_ENVS = (
@@ -71,11 +78,17 @@ and SIGUSR1 all cause a runner to exit cleanly.  The master will restart
 runners that have exited due to a SIGUSR1 or some kind of other exit condition
 (say because of an uncaught exception).  SIGHUP causes the master and the
 runners to close their log files, and reopen then upon the next printed
-message.
+message.  It also makes them reload the configuration file; each runner
+does so once it is done with the messages it is processing.  Settings which
+determine the runners and their queues, such as the number of instances,
+still take effect upon restart.  SIGUSR2 starts profiling a runner, and a
+second SIGUSR2 stops it and dumps the profile to the `profiles` subdirectory
+of the log directory.
 
 The master also responds to SIGINT, SIGTERM, SIGUSR1 and SIGHUP, which it
 simply passes on to the runners.  Note that the master will close and reopen
-its own log files on receipt of a SIGHUP.  The master also leaves its own
+its own log files, and reload the configuration, on receipt of a SIGHUP.  The
+master also leaves its own
 process id in the file `data/master.pid` but you normally don't need to use
 this pid directly.""")
 
@@ -231,6 +244,34 @@ Exiting.""")
         config.options.parser.error(message)
 
 
+
+def autoscale(section, count, depth, age):
+    """Calculate the number of instances an autoscaled runner should have.
+
+    :param section: The runner's configuration section.
+    :param count: The runner's current number of instances.
+    :type count: int
+    :param depth: The number of files in the runner's queue.
+    :type depth: int
+    :param age: The number of seconds the oldest file in the queue has been
+        waiting.
+    :type age: float
+    :return: The new number of instances, which is `count` when it should
+        not change.
+    :rtype: int
+    """
+    minimum = int(section.instances)
+    maximum = int(section.max_instances)
+    up_age = as_timedelta(section.scale_up_age).total_seconds()
+    if (depth > count * int(section.scale_up_depth) or age > up_age):
+        if count * 2 <= maximum:
+            return count * 2
+    elif depth < count * int(section.scale_down_depth):
+        if count // 2 >= minimum:
+            return count // 2
+    return count
+
+
 
 class PIDWatcher:
     """A class which safely manages child process ids."""
@@ -275,6 +316,29 @@ class PIDWatcher:
         """
         return self._pids.pop(pid)
 
+    def by_runner(self, name):
+        """Return the process ids of a runner's instances.
+
+        :param name: The runner name.
+        :type name: string
+        :return: The process ids.
+        :rtype: list of ints
+        """
+        return [pid for pid, info in list(self._pids.items())
+                if info[0] == name]
+
+    def get(self, pid):
+        """Return existing process information.
+
+        :param pid: The process id.
+        :type pid: int
+        :return: The process information, or None if the process id is not
+            being tracked.
+        :rtype: 4-tuple consisting of
+            (runner-name, slice-number, slice-count, restart-count)
+        """
+        return self._pids.get(pid)
+
     def drop(self, pid):
         """Remove and return existing process information.
 
@@ -300,6 +364,14 @@ class Loop:
         self._restartable = restartable
         self._config_file = config_file
         self._kids = PIDWatcher()
+        # The current number of instances of the autoscaled runners, and the
+        # time they were last checked, by runner name.
+        self._autoscaled = {}
+        self._checked = {}
+        # The new number of instances of the runners being rescaled, until
+        # the running instances have taken up their new slices.
+        self._rescaling = {}
+        self._stopping = False
 
     def install_signal_handlers(self):
         """Install various signals handlers for control from the master."""
@@ -312,15 +384,25 @@ class Loop:
             signal.alarm(SECONDS_IN_A_DAY)
         signal.signal(signal.SIGALRM, sigalrm_handler)
         signal.alarm(SECONDS_IN_A_DAY)
-        # SIGHUP tells the runners to close and reopen their log files.
+        # SIGHUP tells the runners to close and reopen their log files, and
+        # to reload the configuration.
         def sighup_handler(signum, frame):
             reopen()
+            try:
+                config.reload()
+            except Exception:
+                log.exception('Master watcher cannot reload the '
+                              'configuration')
+            else:
+                reconfigure()
             for pid in self._kids:
                 os.kill(pid, signal.SIGHUP)
-            log.info('Master watcher caught SIGHUP.  Re-opening log files.')
+            log.info('Master watcher caught SIGHUP.  Re-opening log files '
+                     'and reloading the configuration.')
         signal.signal(signal.SIGHUP, sighup_handler)
         # SIGUSR1 is used by 'mailman restart'.
         def sigusr1_handler(signum, frame):
+            self._stopping = True
             for pid in self._kids:
                 os.kill(pid, signal.SIGUSR1)
             log.info('Master watcher caught SIGUSR1.  Exiting.')
@@ -328,12 +410,14 @@ class Loop:
         # SIGTERM is what init will kill this process with when changing run
         # levels.  It's also the signal 'mailman stop' uses.
         def sigterm_handler(signum, frame):
+            self._stopping = True
             for pid in self._kids:
                 os.kill(pid, signal.SIGTERM)
             log.info('Master watcher caught SIGTERM.  Exiting.')
         signal.signal(signal.SIGTERM, sigterm_handler)
         # SIGINT is what control-C gives.
         def sigint_handler(signum, frame):
+            self._stopping = True
             for pid in self._kids:
                 os.kill(pid, signal.SIGINT)
             log.info('Master watcher caught SIGINT.  Restarting.')
@@ -350,6 +434,9 @@ class Loop:
         :return: The process id of the child runner.
         :rtype: int
         """
+        name = spec.split(':')[0]
+        if as_boolean(getattr(config, 'runner.' + name).prefork):
+            return self._fork_runner(spec)
         pid = os.fork()
         if pid:
             # Parent.
@@ -389,6 +476,67 @@ class Loop:
         # We should never get here.
         raise RuntimeError('os.execle() failed')
 
+    def _fork_runner(self, spec):
+        """Start a runner in a forked copy of this process.
+
+        Unlike `_start_runner()`, the child does not exec a new runner
+        process, which would have to initialize the whole system again.
+        It runs the runner right away, sharing the already initialized
+        system with the master and its other children, and only resets the
+        state which must not be shared: the database connections, the log
+        files and the signal handlers.
+
+        :param spec: A runner spec, e.g. name:slice:count
+        :type spec: string
+        :return: The process id of the child runner.
+        :rtype: int
+        """
+        # Import here to avoid circular imports.
+        from mailman.bin.runner import make_runner
+        name, slice_number, count = spec.split(':')
+        # Import the runner's module in the master, so that all its children
+        # share it.
+        try:
+            find_name(getattr(config, 'runner.' + name)['class'])
+        except ImportError:
+            # make_runner() reports this in the child.
+            pass
+        # Open database connections must not be shared with the child.
+        config.db.dispose()
+        # Objects which survived this far will most likely live as long as
+        # the master does.  Keep the garbage collector from touching them, so
+        # that the memory pages they're on stay shared with the children.
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        pid = os.fork()
+        if pid:
+            # Parent.
+            return pid
+        # Child.  Never return to the master's code, and in particular never
+        # run its clean up.
+        status = 1
+        try:
+            os.environ['MAILMAN_UNDER_MASTER_CONTROL'] = '1'
+            for signum in (signal.SIGALRM, signal.SIGHUP, signal.SIGUSR1,
+                           signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            reopen()
+            log = logging.getLogger('mailman.runner')
+            runner = make_runner(name, int(slice_number), int(count))
+            runner.set_signals()
+            log.info('%s runner started.', runner.name)
+            runner.run()
+            log.info('%s runner exiting.', runner.name)
+            status = runner.status
+        except SystemExit as error:
+            status = (0 if error.code is None else error.code)
+        except BaseException:
+            logging.getLogger('mailman.runner').exception(
+                'Forked runner failed: %s', spec)
+        finally:
+            logging.shutdown()
+            os._exit(status)
+
     def start_runners(self, runner_names=None):
         """Start all the configured runners.
 
@@ -418,14 +566,170 @@ class Loop:
             count = int(runner_config.instances)
             assert (count & (count - 1)) == 0, (
                 'Runner "{0}", not a power of 2: {1}'.format(name, count))
-            for slice_number in range(count):
-                # runner name, slice #, # of slices, restart count
-                info = (name, slice_number, count, 0)
-                spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
-                pid = self._start_runner(spec)
-                log = logging.getLogger('mailman.runner')
-                log.debug('[{0:d}] {1}'.format(pid, spec))
-                self._kids.add(pid, info)
+            if runner_config.path and (
+                    int(runner_config.max_instances) > count):
+                maximum = int(runner_config.max_instances)
+                assert (maximum & (maximum - 1)) == 0, (
+                    'Runner "{0}", not a power of 2: {1}'.format(
+                        name, maximum))
+                self._autoscaled[name] = count
+                self._checked[name] = time.time()
+                # The instances of a previous master were rescaled.
+                try:
+                    os.remove(scale_file(
+                        config.switchboards[name].queue_directory))
+                except FileNotFoundError:
+                    pass
+            self._start_instances(name, count)
+
+    def _start_instances(self, name, count, slices=None):
+        """Start the instances of a runner.
+
+        :param name: The runner name.
+        :type name: string
+        :param count: The number of instances.
+        :type count: int
+        :param slices: The slice numbers of the instances to start, or None
+            to start all of them.
+        :type slices: sequence of ints
+        """
+        for slice_number in (range(count) if slices is None else slices):
+            # runner name, slice #, # of slices, restart count
+            info = (name, slice_number, count, 0)
+            spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
+            pid = self._start_runner(spec)
+            log = logging.getLogger('mailman.runner')
+            log.debug('[{0:d}] {1}'.format(pid, spec))
+            self._kids.add(pid, info)
+
+    def _autoscale(self):
+        """Check the queues of the autoscaled runners, and rescale them."""
+        log = logging.getLogger('mailman.runner')
+        now = time.time()
+        for name, count in list(self._autoscaled.items()):
+            if self._stopping:
+                break
+            if name in self._rescaling:
+                if self._rescaling[name] > count:
+                    self._check_rescaled(name)
+                continue
+            section = getattr(config, 'runner.' + name)
+            interval = as_timedelta(section.scale_interval).total_seconds()
+            if now < self._checked[name] + interval:
+                continue
+            self._checked[name] = now
+            switchboard = config.switchboards[name]
+            files = switchboard.files
+            # The times in the file names are moved back by the files'
+            # priorities, so they don't say how long the files have waited.
+            age = (switchboard.get_age() if len(files) > 0 else 0)
+            new_count = autoscale(section, count, len(files), age)
+            if new_count == count:
+                continue
+            log.info('Rescaling runner %s from %d to %d instances '
+                     '(queue depth: %d, oldest file: %ds)',
+                     name, count, new_count, len(files), age)
+            # Only the difference is started or stopped, and no two
+            # instances ever share a slice of the queue.  When scaling up,
+            # the running instances first narrow their slices, and the new
+            # instances are started once they all have.  When scaling down,
+            # the instances which are no longer needed are stopped, each
+            # finishing the files it's working on, and once they've all
+            # exited, the others take over their slices.
+            self._rescaling[name] = new_count
+            if new_count > count:
+                self._reslice(name, new_count)
+                continue
+            ratio = count // new_count
+            for pid in self._kids.by_runner(name):
+                if self._kids.get(pid)[1] % ratio == 0:
+                    continue
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def _reslice(self, name, count):
+        """Tell the running instances of a runner to take up new slices.
+
+        :param name: The runner name.
+        :type name: string
+        :param count: The new number of instances.
+        :type count: int
+        """
+        queue_directory = config.switchboards[name].queue_directory
+        for pid in self._kids.by_runner(name):
+            # Forget the acknowledgments of earlier rescales.
+            try:
+                os.remove(scale_file(queue_directory, pid))
+            except FileNotFoundError:
+                pass
+        with open(scale_file(queue_directory), 'w') as fp:
+            fp.write(str(count))
+        for pid in self._kids.by_runner(name):
+            # Restarted instances get their new slices right away.
+            rname, slice_number, old_count, restarts = self._kids.pop(pid)
+            self._kids.add(pid, (rname, slice_number * count // old_count,
+                                 count, restarts))
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def _stopped_all(self, name, count):
+        """Return whether a runner has no instances left beyond `count`.
+
+        :param name: The runner name.
+        :type name: string
+        :param count: The new number of instances.
+        :type count: int
+        """
+        ratio = self._autoscaled[name] // count
+        return all(self._kids.get(pid)[1] % ratio == 0
+                   for pid in self._kids.by_runner(name))
+
+    def _check_rescaled(self, name):
+        """Start the new instances of a runner being scaled up.
+
+        They are only started once all the running instances have
+        acknowledged narrowing their slices.
+
+        :param name: The runner name.
+        :type name: string
+        """
+        count = self._rescaling[name]
+        queue_directory = config.switchboards[name].queue_directory
+        pids = self._kids.by_runner(name)
+        for pid in pids:
+            try:
+                with open(scale_file(queue_directory, pid)) as fp:
+                    if int(fp.read()) != count:
+                        return
+            except (FileNotFoundError, ValueError):
+                return
+        del self._rescaling[name]
+        self._autoscaled[name] = count
+        running = set(self._kids.get(pid)[1] for pid in pids)
+        self._start_instances(name, count, [
+            slice_number for slice_number in range(count)
+            if slice_number not in running])
+
+    def _wait(self):
+        """Wait for a runner subprocess to exit.
+
+        When runners are autoscaled, their queues are checked while waiting.
+
+        :return: The process id and exit status.
+        :rtype: 2-tuple
+        """
+        if len(self._autoscaled) == 0:
+            return os.wait()
+        while True:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid != 0:
+                return pid, status
+            self._autoscale()
+            time.sleep(AUTOSCALE_POLL)
 
     def _pause(self):
         """Sleep until a signal is received."""
@@ -442,10 +746,14 @@ class Loop:
         """
         log = logging.getLogger('mailman.runner')
         log.info('Master started')
-        self._pause()
+        # The metrics of runners from before we started are final.
+        metrics.retire()
+        # Autoscaled runners must be watched from the start.
+        if len(self._autoscaled) == 0:
+            self._pause()
         while True:
             try:
-                pid, status = os.wait()
+                pid, status = self._wait()
             except OSError as error:
                 # No children?  We're done.
                 if error.errno == errno.ECHILD:
@@ -468,6 +776,7 @@ class Loop:
             # command line switch was not given.  This lets us better handle
             # runaway restarts (e.g.  if the subprocess had a syntax error!)
             rname, slice_number, count, restarts = self._kids.pop(pid)
+            metrics.retire(pid)
             config_name = 'runner.' + rname
             restart = False
             if why == signal.SIGUSR1 and self._restartable:
@@ -495,6 +804,22 @@ Runner {0} reached maximum restart limit of {1:d}, not restarting.""",
                 new_pid = self._start_runner(spec)
                 new_info = (rname, slice_number, count, restarts)
                 self._kids.add(new_pid, new_info)
+            if rname in self._autoscaled:
+                try:
+                    os.remove(scale_file(
+                        config.switchboards[rname].queue_directory, pid))
+                except FileNotFoundError:
+                    pass
+            # Once the instances stopped by scaling a runner down have all
+            # exited, the others take over their slices.
+            new_count = self._rescaling.get(rname)
+            if (new_count is not None and
+                    new_count < self._autoscaled[rname] and
+                    self._stopped_all(rname, new_count)):
+                del self._rescaling[rname]
+                if not self._stopping:
+                    self._reslice(rname, new_count)
+                    self._autoscaled[rname] = new_count
         log.info('Master stopped')
 
     def cleanup(self):
@@ -514,6 +839,7 @@ Runner {0} reached maximum restart limit of {1:d}, not restarting.""",
             try:
                 pid, status = os.wait()
                 self._kids.drop(pid)
+                metrics.retire(pid)
             except OSError as error:
                 if error.errno == errno.ECHILD:
                     break
@@ -537,6 +863,7 @@ def main():
             print(os.getpid(), file=fp)
         loop = Loop(lock, options.options.restartable, options.options.config)
         loop.install_signal_handlers()
+        metrics.start()
         try:
             loop.start_runners(options.options.runners)
             loop.loop()
@@ -30,6 +30,7 @@ import argparse
 import traceback
 
 from mailman.config import config
+from mailman.core import metrics
 from mailman.core.i18n import _
 from mailman.core.initialize import initialize
 from mailman.utilities.modules import find_name
@@ -79,6 +80,11 @@ def make_runner(name, slice, range, once=False):
         class_path = 'mailman.runners' + name
     else:
         class_path = name
+    if runner_config is not None and range != int(runner_config.instances):
+        # The master started a different number of instances than the
+        # configuration says, e.g. because it autoscales this runner.
+        config.push('instances', '[{0}]\ninstances: {1:d}\n'.format(
+            runner_config.name, range))
     try:
         runner_class = find_name(class_path)
     except ImportError:
@@ -198,6 +204,7 @@ def main():
 
     runner = make_runner(*args.runner, once=args.once)
     runner.set_signals()
+    metrics.start()
     # Now start up the main loop
     log.info('%s runner started.', runner.name)
     runner.run()
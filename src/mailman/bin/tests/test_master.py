@@ -18,17 +18,29 @@
 """Test master watcher utilities."""
 
 __all__ = [
+    'TestAutoscale',
     'TestMasterLock',
+    'TestPrefork',
     ]
 
 
 import os
 import errno
+import signal
 import tempfile
 import unittest
 
 from flufl.lock import Lock
+from mailman.app.lifecycle import create_list
 from mailman.bin import master
+from mailman.config import config
+from mailman.core.runner import Runner
+from mailman.core.switchboard import scale_file
+from mailman.testing.helpers import (
+    configuration, get_queue_messages,
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
 
 
 
@@ -68,3 +80,195 @@ class TestMasterLock(unittest.TestCase):
             my_lock.unlock()
         self.assertEqual(state, master.WatcherState.conflict)
         # XXX test stale_lock and host_mismatch states.
+
+
+
+class OnceRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        msgdata['pid'] = os.getpid()
+        msgdata['sighup'] = (signal.getsignal(signal.SIGHUP) ==
+                             self.signal_handler)
+        config.switchboards['out'].enqueue(msg, msgdata)
+
+    def _do_periodic(self):
+        self.stop()
+
+
+
+class TestPrefork(unittest.TestCase):
+    layer = ConfigLayer
+
+    @configuration('runner.virgin', prefork='yes',
+                   **{'class': 'mailman.bin.tests.test_master.OnceRunner'})
+    def test_fork_runner(self):
+        # With prefork, the master forks a child which runs the runner
+        # without starting a new process.
+        create_list('test@example.com')
+        config.db.commit()
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['virgin'].enqueue(msg, listid='test.example.com')
+        loop = master.Loop()
+        pid = loop._start_runner('virgin:0:1')
+        self.assertNotEqual(pid, os.getpid())
+        waited, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertEqual(len(get_queue_messages('virgin')), 0)
+        messages = get_queue_messages('out')
+        self.assertEqual(len(messages), 1)
+        # The message was processed in the child, which installed its own
+        # signal handlers.
+        self.assertEqual(messages[0].msgdata['pid'], pid)
+        self.assertTrue(messages[0].msgdata['sighup'])
+
+
+
+class FakeLoop(master.Loop):
+    """A master which only pretends to start runners."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = []
+
+    def _start_runner(self, spec):
+        self.started.append(spec)
+        return 1000 + len(self.started)
+
+
+
+class TestAutoscale(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    @configuration('runner.out', instances=1, max_instances=4,
+                   scale_up_depth=10, scale_up_age='5m', scale_down_depth=2)
+    def test_autoscale(self):
+        section = getattr(config, 'runner.out')
+        # A backed up queue doubles the number of instances, up to the
+        # maximum.
+        self.assertEqual(master.autoscale(section, 1, 11, 0), 2)
+        self.assertEqual(master.autoscale(section, 2, 41, 0), 4)
+        self.assertEqual(master.autoscale(section, 4, 1000, 0), 4)
+        # So does an old file.
+        self.assertEqual(master.autoscale(section, 1, 5, 301), 2)
+        # A drained queue halves it, down to the minimum.
+        self.assertEqual(master.autoscale(section, 4, 7, 0), 2)
+        self.assertEqual(master.autoscale(section, 1, 0, 0), 1)
+        # Otherwise nothing changes.
+        self.assertEqual(master.autoscale(section, 2, 10, 0), 2)
+
+    @configuration('runner.out', instances=1, max_instances=4,
+                   scale_up_depth=10, scale_interval='0s')
+    def test_rescale(self):
+        # When the queue backs up, the running instances are told to narrow
+        # their slices, and the new instances are only started once they've
+        # all acknowledged that.
+        loop = FakeLoop()
+        loop.start_runners(['out'])
+        self.assertEqual(loop.started, ['out:0:1'])
+        queue_directory = config.switchboards['out'].queue_directory
+        self.addCleanup(os.remove, scale_file(queue_directory))
+        for i in range(30):
+            config.switchboards['out'].enqueue(self._msg)
+        with patch('mailman.bin.master.os.kill') as kill:
+            loop._autoscale()
+            kill.assert_called_once_with(1001, signal.SIGHUP)
+            with open(scale_file(queue_directory)) as fp:
+                self.assertEqual(fp.read(), '2')
+            self.assertEqual(loop._kids.get(1001), ('out', 0, 2, 0))
+            loop._autoscale()
+            self.assertEqual(loop.started, ['out:0:1'])
+            # The runner acknowledges its new slice, and the new instance is
+            # started.
+            with open(scale_file(queue_directory, 1001), 'w') as fp:
+                fp.write('2')
+            loop._autoscale()
+        self.assertEqual(kill.call_count, 1)
+        self.assertEqual(loop.started, ['out:0:1', 'out:1:2'])
+        self.assertEqual(loop._autoscaled, dict(out=2))
+        self.assertEqual(loop._rescaling, {})
+        os.remove(scale_file(queue_directory, 1001))
+        get_queue_messages('out')
+
+    @configuration('runner.out', instances=1, max_instances=4,
+                   scale_down_depth=2, scale_interval='0s')
+    def test_rescale_down(self):
+        # When the queue drains, only the instances which are no longer
+        # needed are stopped.  Once they've exited, the others take over
+        # their slices.
+        loop = FakeLoop()
+        loop.start_runners(['out'])
+        loop._kids.drop(1001)
+        loop._start_instances('out', 4)
+        loop._autoscaled['out'] = 4
+        queue_directory = config.switchboards['out'].queue_directory
+        self.addCleanup(os.remove, scale_file(queue_directory))
+        with patch('mailman.bin.master.os.kill') as kill:
+            loop._autoscale()
+            self.assertEqual(sorted(kill.call_args_list), [
+                ((1003, signal.SIGTERM),), ((1005, signal.SIGTERM),)])
+            kill.reset_mock()
+            exits = [(1003, signal.SIGTERM << 8),
+                     (1005, signal.SIGTERM << 8),
+                     OSError(errno.ECHILD, 'No child processes')]
+            with patch.object(loop, '_wait', side_effect=exits):
+                loop.loop()
+        self.assertEqual(sorted(kill.call_args_list), [
+            ((1002, signal.SIGHUP),), ((1004, signal.SIGHUP),)])
+        with open(scale_file(queue_directory)) as fp:
+            self.assertEqual(fp.read(), '2')
+        self.assertEqual(loop._kids.get(1002), ('out', 0, 2, 0))
+        self.assertEqual(loop._kids.get(1004), ('out', 1, 2, 0))
+        self.assertEqual(loop._autoscaled, dict(out=2))
+        self.assertEqual(loop._rescaling, {})
+        self.assertEqual(len(loop.started), 5)
+
+    @configuration('runner.out', instances=1, max_instances=4,
+                   scale_up_age='5m', scale_interval='0s')
+    @configuration('priorities', weight='1h')
+    def test_priority_is_not_age(self):
+        # A prioritized file's time is moved back, but it's only as old as
+        # it's been waiting.
+        loop = FakeLoop()
+        loop.start_runners(['out'])
+        config.switchboards['out'].configure()
+        config.switchboards['out'].enqueue(self._msg, priority=2)
+        with patch('mailman.bin.master.os.kill') as kill:
+            loop._autoscale()
+        self.assertFalse(kill.called)
+        self.assertEqual(loop._rescaling, {})
+        get_queue_messages('out')
+
+    def test_runner_instances(self):
+        # Runners started by the master use its number of instances, which
+        # can differ from the configuration.
+        from mailman.bin.runner import make_runner
+        runner = make_runner('out', 1, 2)
+        self.addCleanup(config.pop, 'instances')
+        self.assertEqual(int(getattr(config, 'runner.out').instances), 2)
+        self.assertEqual(runner.switchboard._directories, [
+            os.path.join(runner.queue_directory, '{0:x}'.format(bucket))
+            for bucket in range(8, 16)])
+
+    @configuration('runner.out', instances=1, max_instances=2)
+    def test_autoscaled_queue_is_sliced(self):
+        # Files in an autoscaled queue are always in the subdirectories, so
+        # they are found no matter how many runners there are.
+        switchboard = config.switchboards['out']
+        filebase = switchboard.enqueue(self._msg)
+        self.assertTrue(os.path.exists(os.path.join(
+            switchboard.queue_directory, filebase.split('+')[1][0],
+            filebase + '.pck')))
+        get_queue_messages('out')
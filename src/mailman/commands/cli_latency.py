@@ -0,0 +1,124 @@
+# Copyright (C) 2010-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The `mailman latency` subcommand."""
+
+__all__ = [
+    'Latency',
+    'percentile',
+    ]
+
+
+import os
+import json
+import math
+
+from collections import defaultdict
+from mailman.config import config
+from mailman.core.i18n import _
+from mailman.interfaces.command import ICLISubCommand
+from zope.interface import implementer
+
+
+PERCENTS = (50, 95, 99)
+
+
+
+def percentile(values, percent):
+    """Return a percentile of some values, using the nearest rank.
+
+    :param values: The values, in ascending order.
+    :type values: sequence of numbers
+    :param percent: The percentile, between 0 and 100.
+    :type percent: number
+    :return: The smallest value which at least `percent` percent of the
+        values are less than or equal to.
+    """
+    rank = max(1, math.ceil(len(values) * percent / 100))
+    return values[rank - 1]
+
+
+
+@implementer(ICLISubCommand)
+class Latency:
+    """Report the latencies of messages."""
+
+    name = 'latency'
+
+    def add(self, parser, command_parser):
+        """See `ICLISubCommand`."""
+        self.parser = parser
+        command_parser.add_argument(
+            '-f', '--file',
+            default=None, help=_("""\
+            The timing log to read.  The default is the timing log in the log
+            directory."""))
+        command_parser.add_argument(
+            '-r', '--runner',
+            default='out', help=_("""\
+            The runner delivering the messages.  The total time from when the
+            messages were first enqueued until this runner was done with them
+            is reported.  The default is the outgoing runner."""))
+        command_parser.add_argument(
+            '-s', '--stages',
+            default=False, action='store_true',
+            help=_("""\
+            Also report how long the messages waited in each queue and how
+            long each runner took to process them, for every mailing
+            list."""))
+
+    def process(self, args):
+        """See `ICLISubCommand`."""
+        path = args.file
+        if path is None:
+            path = os.path.join(config.LOG_DIR, config.logging.timing.path)
+        # Collect the latencies per mailing list, and per runner.
+        totals = defaultdict(list)
+        stages = defaultdict(list)
+        try:
+            fp = open(path)
+        except FileNotFoundError:
+            self.parser.error(_('No such timing log: $path'))
+        with fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                listid = record.get('listid') or '-'
+                if record['runner'] == args.runner:
+                    totals[listid].append(record['total'])
+                stages[listid, record['runner'], 'wait'].append(
+                    record['wait'])
+                stages[listid, record['runner'], 'processing'].append(
+                    record['processing'])
+        headings = ['p{0}'.format(percent) for percent in PERCENTS]
+        print('{0:40} {1:>7} {2:>9} {3:>9} {4:>9}'.format(
+            _('List'), _('Count'), *headings))
+        for listid in sorted(totals):
+            self._report(listid, totals[listid])
+        if args.stages:
+            print()
+            for listid, runner, kind in sorted(stages):
+                label = '{0} {1} {2}'.format(listid, runner, kind)
+                self._report(label, stages[listid, runner, kind])
+
+    def _report(self, label, latencies):
+        latencies.sort()
+        print('{0:40} {1:7} {2:9.3f} {3:9.3f} {4:9.3f}'.format(
+            label, len(latencies),
+            *(percentile(latencies, percent) for percent in PERCENTS)))
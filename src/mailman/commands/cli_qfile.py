@@ -25,6 +25,7 @@ __all__ = [
 import pickle
 
 from mailman.core.i18n import _
+from mailman.core.switchboard import _read_message
 from mailman.interfaces.command import ICLISubCommand
 from mailman.utilities.interact import interact
 from pprint import PrettyPrinter
@@ -68,7 +69,12 @@ class QFile:
         """See `ICLISubCommand`."""
         printer = PrettyPrinter(indent=4)
         assert len(args.qfile) == 1, 'Wrong number of positional arguments'
+        del m[:]
         with open(args.qfile[0], 'rb') as fp:
+            # The message may be stored in either the pickle or the raw queue
+            # file format; the metadata is always pickled.
+            msg, reference = _read_message(fp)
+            m.append(msg)
             while True:
                 try:
                     m.append(pickle.load(fp))
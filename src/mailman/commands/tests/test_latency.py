@@ -0,0 +1,99 @@
+# Copyright (C) 2013-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the latency subcommand."""
+
+__all__ = [
+    'TestLatency',
+    ]
+
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from io import StringIO
+from mailman.commands.cli_latency import Latency, percentile
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+
+class FakeArgs:
+    file = None
+    runner = 'out'
+    stages = False
+
+
+
+class TestLatency(unittest.TestCase):
+    """Test the latency subcommand."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+        self.command = Latency()
+        self.args = FakeArgs()
+        self.args.file = os.path.join(self._tmpdir, 'timing.log')
+        with open(self.args.file, 'w') as fp:
+            for index in range(100):
+                for runner in ('pipeline', 'out'):
+                    print(json.dumps(dict(
+                        runner=runner, queue=runner,
+                        listid=('ant.example.com' if index % 2 == 0
+                                else 'bee.example.com'),
+                        message_id='<{0}>'.format(index),
+                        wait=1.0, processing=2.0, total=index)), file=fp)
+            print('garbage', file=fp)
+
+    def _run(self):
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.command.process(self.args)
+        return stdout.getvalue().splitlines()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_end_to_end_per_list(self):
+        lines = self._run()
+        self.assertEqual(lines[0].split(),
+                         ['List', 'Count', 'p50', 'p95', 'p99'])
+        self.assertEqual(lines[1].split(), [
+            'ant.example.com', '50', '48.000', '94.000', '98.000'])
+        self.assertEqual(lines[2].split(), [
+            'bee.example.com', '50', '49.000', '95.000', '99.000'])
+        self.assertEqual(len(lines), 3)
+
+    def test_stages(self):
+        self.args.stages = True
+        lines = self._run()
+        self.assertIn(
+            ['ant.example.com', 'pipeline', 'wait',
+             '50', '1.000', '1.000', '1.000'],
+            [line.split() for line in lines])
+        self.assertIn(
+            ['bee.example.com', 'out', 'processing',
+             '50', '2.000', '2.000', '2.000'],
+            [line.split() for line in lines])
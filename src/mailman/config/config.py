@@ -36,7 +36,7 @@ from mailman.interfaces.configuration import (
     ConfigurationUpdatedEvent, IConfiguration, MissingConfigurationFileError)
 from mailman.interfaces.languages import ILanguageManager
 from mailman.utilities.filesystem import makedirs
-from mailman.utilities.modules import call_name, expand_path
+from mailman.utilities.modules import LazyComponents, call_name, expand_path
 from pkg_resources import resource_filename, resource_string as resource_bytes
 from string import Template
 from zope.component import getUtility
@@ -74,15 +74,19 @@ class Configuration:
         self.QFILE_SCHEMA_VERSION = version.QFILE_SCHEMA_VERSION
         self._config = None
         self.filename = None
+        # The names and contents of the configurations pushed on top of the
+        # configuration file, bottom first, so that they can be pushed again
+        # when the configuration is reloaded.
+        self._pushed = []
         # Whether to create run-time paths or not.  This is for the test
         # suite, which will set this to False until the test layer is set up.
         self.create_paths = True
         # Create various registries.
-        self.chains = {}
-        self.rules = {}
-        self.handlers = {}
+        self.chains = LazyComponents()
+        self.rules = LazyComponents()
+        self.handlers = LazyComponents()
         self.pipelines = {}
-        self.commands = {}
+        self.commands = LazyComponents()
         self.password_context = None
 
     def _clear(self):
@@ -112,17 +116,50 @@ class Configuration:
             self.filename = filename
             with open(filename, 'r', encoding='utf-8') as user_config:
                 self.push(filename, user_config.read())
+        # The configuration file is read again when reloading.
+        self._pushed = []
+
+    def reload(self):
+        """Re-read the configuration files.
+
+        The schema and the configuration files are read again, and the new
+        configuration replaces the current one.  Everything pushed on top of
+        the configuration file since `load()` is pushed again, in the same
+        order.  If reading the configuration file fails, the current
+        configuration stays in effect.
+        """
+        schema_file = resource_filename('mailman.config', 'schema.cfg')
+        schema = ConfigSchema(schema_file)
+        config_file = resource_filename('mailman.config', 'mailman.cfg')
+        new_config = schema.load(config_file)
+        if self.filename is not None:
+            with open(self.filename, 'r', encoding='utf-8') as user_config:
+                new_config.push(self.filename, user_config.read())
+        for config_name, config_string in self._pushed:
+            new_config.push(config_name, config_string)
+        self._clear()
+        self._config = new_config
+        self._post_process()
 
     def push(self, config_name, config_string):
         """Push a new configuration onto the stack."""
         self._clear()
         self._config.push(config_name, config_string)
+        self._pushed.append((config_name, config_string))
         self._post_process()
 
     def pop(self, config_name):
         """Pop a configuration from the stack."""
         self._clear()
         self._config.pop(config_name)
+        # Like the configuration stack, forget everything pushed after it.
+        names = [name for name, string in self._pushed]
+        if config_name in names:
+            index = len(names) - 1 - names[::-1].index(config_name)
+            del self._pushed[index:]
+        else:
+            # The configuration file was popped.
+            del self._pushed[:]
         self._post_process()
 
     def _post_process(self):
@@ -29,7 +29,9 @@ import mock
 import tempfile
 import unittest
 
+from configparser import ParsingError
 from contextlib import ExitStack
+from mailman.config import config
 from mailman.config.config import (
     Configuration, external_configuration, load_external)
 from mailman.interfaces.configuration import (
@@ -58,6 +60,65 @@ class TestConfiguration(unittest.TestCase):
                     pass
                 self.assertEqual(events, ['first', 'second', 'first'])
 
+    def _write_config(self, text):
+        # Write a copy of the testing configuration file with some additional
+        # text, and make it the configuration file to reload.
+        with open(config.filename, 'r', encoding='utf-8') as fp:
+            test_config = fp.read()
+        fd, filename = tempfile.mkstemp(suffix='.cfg')
+        self.addCleanup(os.remove, filename)
+        with open(fd, 'w', encoding='utf-8') as fp:
+            fp.write(test_config)
+            fp.write(text)
+        saved = config._config, config.filename
+        def restore():
+            config._clear()
+            config._config, config.filename = saved
+            config._post_process()
+        self.addCleanup(restore)
+        config.filename = filename
+
+    def test_reload(self):
+        # Reloading reads the configuration file again, and triggers a
+        # post-processing event.
+        self._write_config('[mta]\nmax_recipients: 17\n')
+        events = []
+        def on_event(event):
+            if isinstance(event, ConfigurationUpdatedEvent):
+                events.append(event.config.mta.max_recipients)
+        with event_subscribers(on_event):
+            config.reload()
+        self.assertEqual(events, ['17'])
+        self.assertEqual(config.mta.max_recipients, '17')
+        # The switchboards were recreated.
+        self.assertIn('in', config.switchboards)
+
+    def test_reload_keeps_pushed(self):
+        # Configurations pushed on top of the configuration file, such as a
+        # runner's number of instances, are pushed again when reloading.
+        self._write_config('[mta]\nmax_recipients: 17\n')
+        config.push('first', '[mta]\nmax_recipients: 18\n')
+        self.addCleanup(config.pop, 'first')
+        config.push('second', '[mta]\nmax_autoresponses_per_day: 19\n')
+        config.reload()
+        self.assertEqual(config.mta.max_recipients, '18')
+        self.assertEqual(config.mta.max_autoresponses_per_day, '19')
+        # Popped configurations are gone for good.
+        config.pop('second')
+        config.reload()
+        self.assertEqual(config.mta.max_recipients, '18')
+        self.assertNotEqual(config.mta.max_autoresponses_per_day, '19')
+
+    def test_reload_broken_file(self):
+        # When the configuration file cannot be read, the current
+        # configuration stays in effect.
+        max_recipients = config.mta.max_recipients
+        switchboard = config.switchboards['in']
+        self._write_config('this is not a configuration file\n')
+        self.assertRaises(ParsingError, config.reload)
+        self.assertEqual(config.mta.max_recipients, max_recipients)
+        self.assertIs(config.switchboards['in'], switchboard)
+
 
 
 class TestExternal(unittest.TestCase):
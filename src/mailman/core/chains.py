@@ -26,7 +26,6 @@ __all__ = [
 from mailman.chains.base import Chain, TerminalChainBase
 from mailman.config import config
 from mailman.interfaces.chain import LinkAction, IChain
-from mailman.utilities.modules import find_components
 from zope.interface.verify import verifyObject
 
 
@@ -94,21 +93,24 @@ def process(mlist, msg, msgdata, start_chain='default-posting-chain'):
 
 
 
+def _make_chain(chain_class):
+    # FIXME 2010-12-28 barry: We need a generic way to disable automatic
+    # instantiation of discovered classes.  This is useful not just for
+    # chains, but also for rules, handlers, etc.  Ideally it should be part
+    # of find_components().  For now, hard code the ones we do not want to
+    # instantiate.
+    if chain_class in (Chain, TerminalChainBase):
+        return None
+    chain = chain_class()
+    verifyObject(IChain, chain)
+    return chain
+
+
 def initialize():
-    """Set up chains, both built-in and from the database."""
-    for chain_class in find_components('mailman.chains', IChain):
-        # FIXME 2010-12-28 barry: We need a generic way to disable automatic
-        # instantiation of discovered classes.  This is useful not just for
-        # chains, but also for rules, handlers, etc.  Ideally it should be
-        # part of find_components().  For now, hard code the ones we do not
-        # want to instantiate.
-        if chain_class in (Chain, TerminalChainBase):
-            continue
-        chain = chain_class()
-        verifyObject(IChain, chain)
-        assert chain.name not in config.chains, (
-            'Duplicate chain "{0}" found in {1} (previously: {2}'.format(
-                chain.name, chain_class, config.chains[chain.name]))
-        config.chains[chain.name] = chain
+    """Set up chains, both built-in and from the database.
+
+    The chains' modules are only imported when the chains are first used.
+    """
+    config.chains.add_package('mailman.chains', IChain, _make_chain)
     # XXX Read chains from the database and initialize them.
     pass
@@ -25,6 +25,7 @@ __all__ = [
 
 
 import time
+import threading
 import mailman.messages
 
 from flufl.i18n import PackageStrategy, registry
@@ -34,6 +35,40 @@ from mailman.interfaces.configuration import ConfigurationUpdatedEvent
 _ = None
 
 
+
+class _ThreadLocalStack:
+    """A translation context stack with separate contents in every thread.
+
+    flufl.i18n keeps one stack of translation contexts per application.
+    This stands in for it, so that threads processing different messages at
+    the same time, e.g. the workers of a runner, each have their own
+    language context.
+    """
+
+    def __init__(self, items=()):
+        self._local = threading.local()
+        self._local.items = list(items)
+
+    @property
+    def _items(self):
+        items = getattr(self._local, 'items', None)
+        if items is None:
+            items = self._local.items = []
+        return items
+
+    def append(self, item):
+        self._items.append(item)
+
+    def pop(self):
+        return self._items.pop()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+
 
 def initialize(application=None):
     """Initialize the i18n subsystem.
@@ -47,6 +82,8 @@ def initialize(application=None):
     if application is None:
         strategy = PackageStrategy('mailman', mailman.messages)
         application = registry.register(strategy)
+    if not isinstance(application._stack, _ThreadLocalStack):
+        application._stack = _ThreadLocalStack(application._stack)
     _ = application._
 
 
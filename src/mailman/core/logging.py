@@ -19,6 +19,7 @@
 
 __all__ = [
     'initialize',
+    'reconfigure',
     'reopen',
     ]
 
@@ -165,6 +166,28 @@ def reopen():
         handler.reopen()
 
 
+def reconfigure():
+    """Apply the current configuration's log formats and levels.
+
+    This is used after the configuration is reloaded.  Changes to the log
+    file paths and to propagation take effect when the process restarts.
+    """
+    for logger_config in config.logger_configs:
+        sub_name = logger_config.name.split('.')[-1]
+        handler = _handlers.get(sub_name)
+        if handler is None:
+            continue
+        handler.setFormatter(logging.Formatter(
+            fmt=logger_config.format, datefmt=logger_config.datefmt))
+        if sub_name == 'database':
+            logger_names = ('sqlalchemy', 'alembic')
+        else:
+            logger_names = ('mailman.' + sub_name,)
+        for logger_name in logger_names:
+            logging.getLogger(logger_name).setLevel(
+                as_log_level(logger_config.level))
+
+
 
 def get_handler(sub_name):
     """Return the handler associated with a named logger.
@@ -0,0 +1,445 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Counters, gauges and histograms shared by all of Mailman's processes.
+
+Every process keeps its metrics in memory.  The long running ones, i.e. the
+master and the runners, call `start()`, and from then on write them out at
+most every `[metrics] flush_interval`, and when the runner stops, to a file in
+the metrics directory named after the process's id and start time.
+`collect()` adds up the files of all the processes.  When a process is gone,
+the master folds its file into the retired totals, so that counters never go
+backwards when runners are restarted; its gauges are dropped.  Retiring and
+collecting hold the same lock, so a file is never counted both on its own
+and in the retired totals.  `render()` formats the metrics in the Prometheus
+text exposition format.
+"""
+
+__all__ = [
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'collect',
+    'counter',
+    'flush',
+    'gauge',
+    'handle_ConfigurationUpdatedEvent',
+    'histogram',
+    'render',
+    'retire',
+    'start',
+    ]
+
+
+import os
+import json
+import time
+import logging
+import threading
+
+from flufl.lock import Lock
+from lazr.config import as_boolean, as_timedelta
+from mailman.config import config
+from mailman.interfaces.configuration import ConfigurationUpdatedEvent
+from mailman.utilities.filesystem import makedirs
+from mailman.utilities.string import expand
+
+
+# The upper bounds of the default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# The file holding the totals of the processes which are gone.
+RETIRED = 'retired'
+
+elog = logging.getLogger('mailman.error')
+
+_lock = threading.Lock()
+_metrics = {}
+# The process the metrics were collected in, since forked children start
+# their own, and when it started.
+_pid = os.getpid()
+_started = time.time()
+# Once the process has started writing its metrics, the flush interval in
+# seconds, and when they were last flushed.
+_interval = None
+_flushed = 0
+
+
+
+class _Metric:
+    """The samples of a metric, one for each combination of labels."""
+
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.samples = {}
+
+    def _sample(self, labels):
+        global _pid, _started
+        if _pid != os.getpid():
+            # This is a forked child, which must not count its parent's
+            # samples as its own.
+            for metric in _metrics.values():
+                metric.samples.clear()
+            _pid = os.getpid()
+            _started = time.time()
+        key = tuple(sorted(labels.items()))
+        sample = self.samples.get(key)
+        if sample is None:
+            sample = self.samples[key] = self._new_sample()
+        return key, sample
+
+    def as_dict(self):
+        return dict(kind=self.kind, help=self.help,
+                    samples=[[dict(key), sample]
+                             for key, sample in self.samples.items()])
+
+
+class Counter(_Metric):
+    """A count which only goes up."""
+
+    kind = 'counter'
+
+    def _new_sample(self):
+        return 0
+
+    def inc(self, amount=1, **labels):
+        """Add to the count with the given labels."""
+        with _lock:
+            key, sample = self._sample(labels)
+            self.samples[key] = sample + amount
+        _maybe_flush()
+
+
+class Gauge(_Metric):
+    """A current value, which goes up and down."""
+
+    kind = 'gauge'
+
+    def _new_sample(self):
+        return 0
+
+    def set(self, value, **labels):
+        """Set the value with the given labels."""
+        with _lock:
+            key, sample = self._sample(labels)
+            self.samples[key] = value
+        _maybe_flush()
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, e.g. durations."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = list(buckets)
+
+    def _new_sample(self):
+        return dict(buckets=[0] * len(self.buckets), sum=0, count=0)
+
+    def observe(self, value, **labels):
+        """Record an observed value with the given labels."""
+        with _lock:
+            key, sample = self._sample(labels)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['buckets'][index] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+        _maybe_flush()
+
+    def as_dict(self):
+        data = super().as_dict()
+        data['buckets'] = self.buckets
+        return data
+
+
+
+def counter(name, help):
+    """Return the named counter, creating it if necessary."""
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Counter(name, help)
+    return metric
+
+
+def gauge(name, help):
+    """Return the named gauge, creating it if necessary."""
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Gauge(name, help)
+    return metric
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    """Return the named histogram, creating it if necessary."""
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = Histogram(name, help, buckets)
+    return metric
+
+
+def _directory():
+    return expand(config.metrics.path, config.paths)
+
+
+def _file_lock():
+    return Lock(os.path.join(config.LOCK_DIR, 'metrics.lck'))
+
+
+def _write(path, data):
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as fp:
+        json.dump(data, fp)
+    os.rename(tmpfile, path)
+
+
+def _read(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except ValueError as error:
+        elog.error('Ignoring corrupt metrics file %s: %s', path, error)
+        return {}
+
+
+def _filename(pid, started):
+    # The start time keeps a process which reuses the id of a process which
+    # is gone from overwriting its file.
+    return '{0}-{1}.json'.format(pid, int(started * 1000))
+
+
+def _pid_of(name):
+    """Return the process id a metrics file is named after, or None."""
+    base, ext = os.path.splitext(name)
+    pid = base.split('-', 1)[0]
+    if ext != '.json' or not pid.isdigit():
+        return None
+    return int(pid)
+
+
+def start():
+    """Start writing this process's metrics to the metrics directory.
+
+    They are first written once the flush interval has passed, or when the
+    runner stops.
+    """
+    global _interval, _flushed
+    _interval = as_timedelta(config.metrics.flush_interval).total_seconds()
+    _flushed = time.time()
+
+
+def handle_ConfigurationUpdatedEvent(event):
+    """Read the flush interval again."""
+    global _interval
+    if isinstance(event, ConfigurationUpdatedEvent) and _interval is not None:
+        _interval = as_timedelta(
+            event.config.metrics.flush_interval).total_seconds()
+
+
+def _maybe_flush():
+    if _interval is not None and time.time() >= _flushed + _interval:
+        flush()
+
+
+def flush():
+    """Write this process's metrics to its file in the metrics directory.
+
+    Nothing is written before `start()` is called.
+    """
+    global _flushed
+    if _interval is None:
+        return
+    _flushed = time.time()
+    if not as_boolean(config.metrics.enabled):
+        return
+    with _lock:
+        if _pid != os.getpid():
+            # Nothing has been counted in this forked child yet.
+            return
+        data = dict((name, metric.as_dict())
+                    for name, metric in _metrics.items()
+                    if metric.samples)
+        filename = _filename(_pid, _started)
+    if len(data) == 0:
+        return
+    directory = _directory()
+    try:
+        makedirs(directory)
+        _write(os.path.join(directory, filename), data)
+    except EnvironmentError as error:
+        elog.error('Cannot write metrics to %s: %s', directory, error)
+
+
+def _add(kind, old, new):
+    if kind == 'histogram':
+        return dict(
+            buckets=[a + b for a, b in zip(old['buckets'], new['buckets'])],
+            sum=old['sum'] + new['sum'],
+            count=old['count'] + new['count'])
+    return old + new
+
+
+def _merge(totals, data):
+    """Add the metrics in `data` to `totals`."""
+    for name, metric in data.items():
+        total = totals.setdefault(name, dict(metric, samples=[]))
+        if metric.get('buckets') != total.get('buckets'):
+            # The buckets were changed, so the samples can't be added up.
+            continue
+        positions = dict(
+            (json.dumps(labels, sort_keys=True), position)
+            for position, (labels, sample) in enumerate(total['samples']))
+        for labels, sample in metric['samples']:
+            key = json.dumps(labels, sort_keys=True)
+            position = positions.get(key)
+            if position is None:
+                positions[key] = len(total['samples'])
+                total['samples'].append([labels, sample])
+            else:
+                entry = total['samples'][position]
+                entry[1] = _add(metric['kind'], entry[1], sample)
+    return totals
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def retire(pid=None):
+    """Fold the metrics of processes which are gone into the retired totals.
+
+    :param pid: The process id of the process which is gone.  If None, the
+        files of all the processes which no longer exist are retired.
+    :type pid: int
+    """
+    directory = _directory()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    retiring = []
+    for name in names:
+        name_pid = _pid_of(name)
+        if name_pid is None:
+            continue
+        if pid is None:
+            gone = not _alive(name_pid)
+        else:
+            gone = (name_pid == pid)
+        if gone:
+            retiring.append(name)
+    if len(retiring) == 0:
+        return
+    retired_path = os.path.join(directory, RETIRED + '.json')
+    with _file_lock():
+        for name in retiring:
+            path = os.path.join(directory, name)
+            data = _read(path)
+            if len(data) == 0:
+                continue
+            # The gauges of a process which is gone no longer apply.
+            data = dict((name, metric) for name, metric in data.items()
+                        if metric['kind'] != 'gauge')
+            try:
+                if len(data) > 0:
+                    _write(retired_path, _merge(_read(retired_path), data))
+                os.unlink(path)
+            except EnvironmentError as error:
+                elog.error('Cannot retire metrics file %s: %s', path, error)
+
+
+def collect():
+    """Add up the metrics of all the processes.
+
+    :return: The metrics by name, each a dictionary with the metric's kind,
+        help text, buckets for histograms, and its samples as a list of
+        (labels, value) pairs.
+    :rtype: dict
+    """
+    totals = {}
+    directory = _directory()
+    with _file_lock():
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return totals
+        for name in names:
+            if name.endswith('.json'):
+                _merge(totals, _read(os.path.join(directory, name)))
+    return totals
+
+
+
+def _format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if len(labels) == 0:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for key, value in sorted(labels.items())))
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(metrics):
+    """Format metrics in the Prometheus text exposition format.
+
+    :param metrics: The metrics, as returned by `collect()`.  More gauges can
+        be added with the 'gauge' kind and plain values as their samples.
+    :type metrics: dict
+    :return: The text exposition.
+    :rtype: str
+    """
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append('# HELP {0} {1}'.format(name, metric['help']))
+        lines.append('# TYPE {0} {1}'.format(name, metric['kind']))
+        samples = sorted(metric['samples'],
+                         key=lambda sample: sorted(sample[0].items()))
+        for labels, sample in samples:
+            if metric['kind'] != 'histogram':
+                lines.append('{0}{1} {2}'.format(
+                    name, _format_labels(labels), _format_value(sample)))
+                continue
+            # The bucket counts are cumulative.
+            for bound, count in zip(metric['buckets'], sample['buckets']):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _format_labels(labels, le=_format_value(bound)),
+                    count))
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _format_labels(labels, le='+Inf'), sample['count']))
+            lines.append('{0}_sum{1} {2}'.format(
+                name, _format_labels(labels), _format_value(sample['sum'])))
+            lines.append('{0}_count{1} {2}'.format(
+                name, _format_labels(labels), sample['count']))
+    return '\n'.join(lines) + '\n'
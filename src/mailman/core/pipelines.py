@@ -35,7 +35,6 @@ from mailman.core import errors
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
 from mailman.interfaces.pipeline import IPipeline
-from mailman.utilities.modules import find_components
 from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
@@ -79,12 +78,15 @@ class BasePipeline:
     _default_handlers = ()
 
     def __init__(self):
-        self._handlers = []
-        for handler_name in self._default_handlers:
-            self._handlers.append(config.handlers[handler_name])
+        # The handlers are looked up when the pipeline is first used, so
+        # that their modules are only imported then.
+        self._handlers = None
 
     def __iter__(self):
         """See `IPipeline`."""
+        if self._handlers is None:
+            self._handlers = [config.handlers[handler_name]
+                              for handler_name in self._default_handlers]
         for handler in self._handlers:
             yield handler
 
@@ -142,16 +144,19 @@ class VirginPipeline(BasePipeline):
 
 
 
+def _make_handler(handler_class):
+    handler = handler_class()
+    verifyObject(IHandler, handler)
+    return handler
+
+
 def initialize():
-    """Initialize the pipelines."""
+    """Initialize the pipelines.
+
+    The handlers' modules are only imported when the handlers are first used.
+    """
     # Find all handlers in the registered plugins.
-    for handler_class in find_components('mailman.handlers', IHandler):
-        handler = handler_class()
-        verifyObject(IHandler, handler)
-        assert handler.name not in config.handlers, (
-            'Duplicate handler "{0}" found in {1}'.format(
-                handler.name, handler_class))
-        config.handlers[handler.name] = handler
+    config.handlers.add_package('mailman.handlers', IHandler, _make_handler)
     # Set up some pipelines.
     for pipeline_class in (OwnerPipeline, PostingPipeline, VirginPipeline):
         pipeline = pipeline_class()
@@ -24,18 +24,19 @@ __all__ = [
 
 from mailman.config import config
 from mailman.interfaces.rules import IRule
-from mailman.utilities.modules import find_components
 from zope.interface.verify import verifyObject
 
 
 
+def _make_rule(rule_class):
+    rule = rule_class()
+    verifyObject(IRule, rule)
+    return rule
+
+
 def initialize():
-    """Find and register all rules in all plugins."""
-    # Find rules in plugins.
-    for rule_class in find_components('mailman.rules', IRule):
-        rule = rule_class()
-        verifyObject(IRule, rule)
-        assert rule.name not in config.rules, (
-            'Duplicate rule "{0}" found in {1}'.format(
-                rule.name, rule_class))
-        config.rules[rule.name] = rule
+    """Find and register all rules in all plugins.
+
+    The rules' modules are only imported when the rules are first used.
+    """
+    config.rules.add_package('mailman.rules', IRule, _make_rule)
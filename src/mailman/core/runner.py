@@ -22,20 +22,33 @@ __all__ = [
     ]
 
 
+import os
+import json
 import time
+import pstats
 import signal
+import cProfile
 import logging
+import threading
 import traceback
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
 from io import StringIO
 from lazr.config import as_boolean, as_timedelta
+from mailman.app import cache
 from mailman.config import config
+from mailman.core import metrics
 from mailman.core.i18n import _
-from mailman.core.logging import reopen
-from mailman.core.switchboard import Switchboard
+from mailman.core.logging import reconfigure, reopen
+from mailman.core.switchboard import (
+    FILES_PER_PASS, RECOVERY_BATCH_SIZE, STAGE_TIMES, group_commit,
+    is_sliced, scale_file)
 from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.runner import IRunner, RunnerCrashEvent
+from mailman.utilities.filesystem import makedirs
+from mailman.utilities.modules import call_name
 from mailman.utilities.string import expand
 from zope.component import getUtility
 from zope.event import notify
@@ -45,12 +58,31 @@ from zope.interface import implementer
 dlog = logging.getLogger('mailman.debug')
 elog = logging.getLogger('mailman.error')
 rlog = logging.getLogger('mailman.runner')
+tlog = logging.getLogger('mailman.timing')
+
+messages_processed = metrics.counter(
+    'mailman_runner_messages_total',
+    'The number of queue files processed by each runner.')
+messages_shunted = metrics.counter(
+    'mailman_runner_shunts_total',
+    'The number of messages each runner shunted.')
+poll_interval = metrics.gauge(
+    'mailman_runner_poll_interval_seconds',
+    'How long each runner sleeps when it finds nothing to do.')
+processing_time = metrics.histogram(
+    'mailman_runner_processing_seconds',
+    'The time each runner took to process a queue file.')
 
 
 
 @implementer(IRunner)
 class Runner:
     is_queue_runner = True
+    # Whether everything this runner does for a queue file is undone by
+    # rolling back the database transaction and discarding the group commit.
+    # Only such runners can process queue files in batches, since a failed
+    # batch is processed again one file at a time.
+    transactional = True
 
     def __init__(self, name, slice=None):
         """Create a runner.
@@ -62,28 +94,88 @@ class Runner:
         """
         # Grab the configuration section.
         self.name = name
+        self.slice = slice
         section = getattr(config, 'runner.' + name)
         substitutions = config.paths
         substitutions['name'] = name
-        numslices = int(section.instances)
+        self.numslices = int(section.instances)
         # Check whether the runner is queue runner or not; non-queue runner
         # should not have queue_directory or switchboard instance.
         if self.is_queue_runner:
             self.queue_directory = expand(section.path, substitutions)
-            self.switchboard = Switchboard(
-                name, self.queue_directory, slice, numslices, True)
+            self.switchboard = self._make_switchboard()
         else:
             self.queue_directory = None
             self.switchboard= None
+        # The backup files left behind by a crash are recovered a batch at a
+        # time between passes over the queue, so that new messages don't
+        # wait for all of them to be recovered.
+        self._recovering = self.is_queue_runner
+        # The pool of worker threads is started on first use.
+        self._executor = None
+        self._configure()
+        # SIGUSR2 toggles profiling.  The statistics are collected in
+        # _profile, which is None when the runner is not profiling.
+        self._profile_requested = False
+        self._profile = None
+        self._profiled_files = 0
+        self._profile_lock = threading.Lock()
+        # SIGHUP reloads the configuration, once the files being processed
+        # are done.
+        self._reload_requested = False
+        self._stop = False
+        self.status = 0
+
+    def _make_switchboard(self):
+        """Return the switchboard for this runner's slice of its queue."""
+        section = getattr(config, 'runner.' + self.name)
+        return call_name(
+            section.switchboard,
+            self.name, self.queue_directory, self.slice, self.numslices,
+            False, notify=(section.wakeup == 'inotify'),
+            qfile_format=section.qfile_format, sliced=is_sliced(section))
+
+    def _configure(self):
+        """Read the runner's settings from its configuration section.
+
+        This is done when the runner is created, and again when the
+        configuration is reloaded.  The settings which determine the queue,
+        such as its path and number of slices, only change on restart.
+        """
+        section = getattr(config, 'runner.' + self.name)
         self.sleep_time = as_timedelta(section.sleep_time)
         # sleep_time is a timedelta; turn it into a float for time.sleep().
         self.sleep_float = (86400 * self.sleep_time.days +
                             self.sleep_time.seconds +
                             self.sleep_time.microseconds / 1.0e6)
+        # The longest the runner sleeps when it's idle, and how much longer
+        # it sleeps after every pass over the queue that found nothing.
+        self.max_sleep_float = max(
+            self.sleep_float,
+            as_timedelta(section.max_sleep_time).total_seconds())
+        self.backoff_factor = float(section.backoff_factor)
+        self.poll_interval = self.sleep_float
+        self._idle_interval = self.sleep_float
+        self._set_poll_interval_metric()
         self.max_restarts = int(section.max_restarts)
         self.start = as_boolean(section.start)
-        self._stop = False
-        self.status = 0
+        self.group_commit = as_boolean(section.group_commit)
+        self.shared_bodies = as_boolean(section.shared_bodies)
+        self.batch_size = int(section.batch_size)
+        if self.batch_size > 1 and not self.transactional:
+            elog.error('%s runner has side effects outside the database and '
+                       'cannot process files in batches; ignoring batch_size',
+                       self.name)
+            self.batch_size = 1
+        self.batch_time = as_timedelta(section.batch_time).total_seconds()
+        self.workers = int(section.workers)
+        self.cache_ttl = as_timedelta(section.cache_ttl).total_seconds()
+        self.profile_count = int(section.profile_count)
+        if self._executor is not None:
+            # The number of workers may have changed, so start a new pool on
+            # next use.
+            self._executor.shutdown()
+            self._executor = None
 
     def __repr__(self):
         return '<{0} at {1:#x}>'.format(self.__class__.__name__, id(self))
@@ -93,6 +185,7 @@ class Runner:
             signal.SIGTERM: 'SIGTERM',
             signal.SIGINT: 'SIGINT',
             signal.SIGUSR1: 'SIGUSR1',
+            signal.SIGUSR2: 'SIGUSR2',
             }.get(signum, signum)
         if signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
             self.stop()
@@ -100,7 +193,17 @@ class Runner:
             rlog.info('%s runner caught %s.  Stopping.', self.name, signame)
         elif signum == signal.SIGHUP:
             reopen()
-            rlog.info('%s runner caught SIGHUP.  Reopening logs.', self.name)
+            # The configuration is reloaded by the main loop, once the files
+            # being processed are done.
+            self._reload_requested = True
+            rlog.info('%s runner caught SIGHUP.  Reopening logs and '
+                      'reloading the configuration.', self.name)
+        elif signum == signal.SIGUSR2:
+            # The profiler is started or stopped by the main loop, once the
+            # files being processed are done.
+            self._profile_requested = not self._profile_requested
+            rlog.info('%s runner caught SIGUSR2.  %s profiling.', self.name,
+                      ('Starting' if self._profile_requested else 'Stopping'))
 
     def set_signals(self):
         """See `IRunner`."""
@@ -108,6 +211,7 @@ class Runner:
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
         signal.signal(signal.SIGUSR1, self.signal_handler)
+        signal.signal(signal.SIGUSR2, self.signal_handler)
 
     def stop(self):
         """See `IRunner`."""
@@ -117,9 +221,14 @@ class Runner:
         """See `IRunner`."""
         # Start the main loop for this runner.
         try:
+            # An instance restarted while the runner is rescaled acknowledges
+            # its slice too.
+            self._rescale()
             while True:
                 # Once through the loop that processes all the files in the
                 # queue directory.
+                self._check_signals()
+                self._recover_some()
                 filecnt = self._one_iteration()
                 # Do the periodic work for the subclass.
                 self._do_periodic()
@@ -134,70 +243,50 @@ class Runner:
             pass
         finally:
             self._clean_up()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            if self._profile is not None:
+                self._dump_profile()
+            metrics.flush()
+
+    def _recover_some(self):
+        """Recover the next batch of backup files, if any are left."""
+        if not self._recovering:
+            return
+        left = self.switchboard.recover_backup_files(RECOVERY_BATCH_SIZE)
+        if left == 0:
+            self._recovering = False
+            dlog.debug('[%s] recovered backup files', self.name)
 
     def _one_iteration(self):
         """See `IRunner`."""
         me = self.__class__.__name__
         dlog.debug('[%s] starting oneloop', me)
-        # List all the files in our queue directory.  The switchboard is
+        # List the oldest files in our queue directory.  The switchboard is
         # guaranteed to hand us the files in FIFO order.
-        files = self.switchboard.files
+        files = self.switchboard.get_files(count=FILES_PER_PASS)
+        if self.workers > 1:
+            self._process_concurrently(files)
+            dlog.debug('[%s] ending oneloop: %s', me, len(files))
+            return len(files)
+        if self.batch_size > 1:
+            # Process the files in batches, with one database commit per
+            # batch, until they are all done or we're told to stop.
+            remaining = iter(files)
+            while not self._process_batch(remaining):
+                self._check_signals()
+            dlog.debug('[%s] ending oneloop: %s', me, len(files))
+            return len(files)
         for filebase in files:
-            dlog.debug('[%s] processing filebase: %s', me, filebase)
-            try:
-                # Ask the switchboard for the message and metadata objects
-                # associated with this queue file.
-                msg, msgdata = self.switchboard.dequeue(filebase)
-            except Exception as error:
-                # This used to just catch email.Errors.MessageParseError, but
-                # other problems can occur in message parsing, e.g.
-                # ValueError, and exceptions can occur in unpickling too.  We
-                # don't want the runner to die, so we just log and skip this
-                # entry, but preserve it for analysis.
-                self._log(error)
-                elog.error('Skipping and preserving unparseable message: %s',
-                           filebase)
-                self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
-                continue
-            try:
-                dlog.debug('[%s] processing onefile', me)
-                self._process_one_file(msg, msgdata)
-                dlog.debug('[%s] finishing filebase: %s', me, filebase)
-                self.switchboard.finish(filebase)
-            except Exception as error:
-                # All runners that implement _dispose() must guarantee that
-                # exceptions are caught and dealt with properly.  Still, there
-                # may be a bug in the infrastructure, and we do not want those
-                # to cause messages to be lost.  Any uncaught exceptions will
-                # cause the message to be stored in the shunt queue for human
-                # intervention.
-                self._log(error)
-                # Put a marker in the metadata for unshunting.
-                msgdata['whichq'] = self.switchboard.name
-                # It is possible that shunting can throw an exception, e.g. a
-                # permissions problem or a MemoryError due to a really large
-                # message.  Try to be graceful.
-                try:
-                    shunt = config.switchboards['shunt']
-                    new_filebase = shunt.enqueue(msg, msgdata)
-                    elog.error('SHUNTING: %s', new_filebase)
-                    self.switchboard.finish(filebase)
-                except Exception as error:
-                    # The message wasn't successfully shunted.  Log the
-                    # exception and try to preserve the original queue entry
-                    # for possible analysis.
-                    self._log(error)
-                    elog.error(
-                        'SHUNTING FAILED, preserving original entry: %s',
-                        filebase)
-                    self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
+            self._process_file(filebase)
             # Other work we want to do each time through the loop.
             dlog.debug('[%s] doing periodic', me)
             self._do_periodic()
             dlog.debug('[%s] committing transaction', me)
             config.db.commit()
+            # The file is only done once its transaction is committed.
+            self._check_signals()
             dlog.debug('[%s] checking short circuit', me)
             if self._short_circuit():
                 dlog.debug('[%s] short circuiting', me)
@@ -205,6 +294,199 @@ class Runner:
         dlog.debug('[%s] ending oneloop: %s', me, len(files))
         return len(files)
 
+    def _process_file(self, filebase):
+        """Dequeue, process and finish one queue file.
+
+        The caller is responsible for committing the transaction.
+        """
+        entry = self._dequeue(filebase)
+        if entry is not None:
+            self._process_dequeued(filebase, *entry)
+
+    def _dequeue(self, filebase):
+        """Dequeue one queue file.
+
+        :return: The message and metadata, or None if the file could not be
+            read, in which case it is preserved.
+        """
+        me = self.__class__.__name__
+        dlog.debug('[%s] processing filebase: %s', me, filebase)
+        try:
+            # Ask the switchboard for the message and metadata objects
+            # associated with this queue file.
+            return self.switchboard.dequeue(filebase)
+        except Exception as error:
+            # This used to just catch email.Errors.MessageParseError, but
+            # other problems can occur in message parsing, e.g.
+            # ValueError, and exceptions can occur in unpickling too.  We
+            # don't want the runner to die, so we just log and skip this
+            # entry, but preserve it for analysis.
+            self._log(error)
+            elog.error('Skipping and preserving unparseable message: %s',
+                       filebase)
+            self.switchboard.finish(filebase, preserve=True)
+            config.db.abort()
+            return None
+
+    def _process_dequeued(self, filebase, msg, msgdata):
+        """Process and finish a dequeued file, or shunt it."""
+        me = self.__class__.__name__
+        try:
+            dlog.debug('[%s] processing onefile', me)
+            # In a group commit, everything enqueued while processing
+            # this file must be durable before the file is finished.
+            with ExitStack() as resources:
+                if self.group_commit:
+                    resources.enter_context(group_commit())
+                self._process_message(msg, msgdata)
+            dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            self.switchboard.finish(filebase)
+            messages_processed.inc(runner=self.name)
+        except Exception as error:
+            # All runners that implement _dispose() must guarantee that
+            # exceptions are caught and dealt with properly.  Still, there
+            # may be a bug in the infrastructure, and we do not want those
+            # to cause messages to be lost.  Any uncaught exceptions will
+            # cause the message to be stored in the shunt queue for human
+            # intervention.
+            self._log(error)
+            # Put a marker in the metadata for unshunting.
+            msgdata['whichq'] = self.switchboard.name
+            # It is possible that shunting can throw an exception, e.g. a
+            # permissions problem or a MemoryError due to a really large
+            # message.  Try to be graceful.
+            try:
+                shunt = config.switchboards['shunt']
+                new_filebase = shunt.enqueue(msg, msgdata)
+                elog.error('SHUNTING: %s', new_filebase)
+                self.switchboard.finish(filebase)
+                messages_shunted.inc(runner=self.name)
+            except Exception as error:
+                # The message wasn't successfully shunted.  Log the
+                # exception and try to preserve the original queue entry
+                # for possible analysis.
+                self._log(error)
+                elog.error(
+                    'SHUNTING FAILED, preserving original entry: %s',
+                    filebase)
+                self.switchboard.finish(filebase, preserve=True)
+            config.db.abort()
+
+    def _process_concurrently(self, files):
+        """Process the queue files in a pool of worker threads.
+
+        Up to `workers` files are dequeued and processed at the same time.
+        Each file is finished or shunted on its own, and each worker commits
+        its own transaction after every file, just as when the files are
+        processed one at a time.
+
+        :param files: The queue files to process, in FIFO order.
+        :type files: list of strings
+        """
+        me = self.__class__.__name__
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        pending = set()
+        for filebase in files:
+            if len(pending) >= self.workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                dlog.debug('[%s] doing periodic', me)
+                self._do_periodic()
+                config.db.commit()
+                if self._short_circuit():
+                    dlog.debug('[%s] short circuiting', me)
+                    break
+            entry = self._dequeue(filebase)
+            if entry is not None:
+                pending.add(self._executor.submit(
+                    self._process_in_worker, filebase, *entry))
+        wait(pending)
+        self._do_periodic()
+        config.db.commit()
+
+    def _process_in_worker(self, filebase, msg, msgdata):
+        """Process a dequeued file in a worker thread."""
+        try:
+            self._process_dequeued(filebase, msg, msgdata)
+            config.db.commit()
+        except Exception as error:
+            # E.g. the commit failed.  There is nothing left to be done with
+            # the file, but the worker must carry on.
+            self._log(error)
+            config.db.abort()
+
+    def _process_batch(self, files):
+        """Process a batch of queue files in a single transaction.
+
+        Files are taken from the `files` iterator until there are
+        `batch_size` of them, `batch_time` has passed, or we're told to stop.
+        Everything they enqueue is written as one group commit, and the
+        files are only finished once the transaction is committed.  If any
+        of them fails, the transaction is rolled back, the group commit is
+        discarded, and the files are put back in the queue and processed one
+        at a time, so that a bad file is shunted on its own.  This is only
+        safe for `transactional` runners, since the other files are processed
+        again.
+
+        :param files: The queue files still to be processed.
+        :type files: iterator of strings
+        :return: True when there are no more files to process, or the runner
+            should stop processing them.
+        :rtype: bool
+        """
+        me = self.__class__.__name__
+        processed = []
+        done = True
+        deadline = time.time() + self.batch_time
+        try:
+            with group_commit():
+                for filebase in files:
+                    dlog.debug('[%s] processing filebase: %s', me, filebase)
+                    try:
+                        msg, msgdata = self.switchboard.dequeue(filebase)
+                    except Exception as error:
+                        # See _process_file().  Nothing has been done for
+                        # this file yet, so the batch can go on.
+                        self._log(error)
+                        elog.error(
+                            'Skipping and preserving unparseable message: %s',
+                            filebase)
+                        self.switchboard.finish(filebase, preserve=True)
+                        continue
+                    processed.append(filebase)
+                    self._process_message(msg, msgdata)
+                    dlog.debug('[%s] doing periodic', me)
+                    self._do_periodic()
+                    if self._short_circuit():
+                        dlog.debug('[%s] short circuiting', me)
+                        break
+                    if (len(processed) >= self.batch_size or
+                            time.time() >= deadline):
+                        done = False
+                        break
+                # The files enqueued by the batch are only written once the
+                # transaction is committed, and not at all if that fails.
+                dlog.debug('[%s] committing transaction: %s files',
+                           me, len(processed))
+                config.db.commit()
+        except Exception as error:
+            self._log(error)
+            config.db.abort()
+            elog.error('%s runner falling back to one file at a time for a '
+                       'failed batch of %s files', self.name, len(processed))
+            for filebase in processed:
+                self.switchboard.restore(filebase)
+            for filebase in processed:
+                self._process_file(filebase)
+                self._do_periodic()
+                config.db.commit()
+            return done
+        for filebase in processed:
+            dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            self.switchboard.finish(filebase)
+        messages_processed.inc(len(processed), runner=self.name)
+        return done
+
     def _process_one_file(self, msg, msgdata):
         """See `IRunner`."""
         # Do some common sanity checking on the message metadata.  It's got to
@@ -235,6 +517,7 @@ class Runner:
                 '%s runner "%s" shunting message for missing list: %s',
                 msg['message-id'], self.name, identifier)
             config.switchboards['shunt'].enqueue(msg, msgdata)
+            messages_shunted.inc(runner=self.name)
             return
         # Now process this message.  We also want to set up the language
         # context for this message.  The context will be the preferred
@@ -245,6 +528,9 @@ class Runner:
         if mlist is None:
             language_manager = getUtility(ILanguageManager)
             language = language_manager[config.mailman.default_language]
+        elif msg.sender and self.cache_ttl > 0:
+            language = cache.sender_language(
+                mlist, msg.sender, self.cache_ttl)
         elif msg.sender:
             member = mlist.members.get_member(msg.sender)
             language = (member.preferred_language
@@ -263,12 +549,168 @@ class Runner:
         if keepqueued:
             self.switchboard.enqueue(msg, msgdata)
 
+    def _process_message(self, msg, msgdata):
+        """Process one dequeued message, profiling and timing it."""
+        start = time.time()
+        try:
+            self._profiled(self._process_one_file, msg, msgdata)
+        finally:
+            processing_time.observe(time.time() - start, runner=self.name)
+            self._record_stage(msg, msgdata)
+
+    def _record_stage(self, msg, msgdata):
+        """Record that the message is done with, and log its latencies.
+
+        The record gives the time the message waited in the queue and the
+        time it took to process it, and the total time since it was first
+        enqueued.
+        """
+        stages = msgdata.get(STAGE_TIMES)
+        if not stages:
+            return
+        stage = stages[-1]
+        if stage['queue'] != self.switchboard.name or 'dequeued' not in stage:
+            return
+        stage['done'] = done = time.time()
+        tlog.info('%s', json.dumps(dict(
+            runner=self.name,
+            queue=stage['queue'],
+            listid=msgdata.get('listid'),
+            message_id=msg.get('message-id'),
+            wait=stage['dequeued'] - stage['enqueued'],
+            processing=done - stage['dequeued'],
+            total=done - stages[0]['enqueued'],
+            ), sort_keys=True))
+
     def _log(self, exc):
         elog.error('Uncaught runner exception: %s', exc)
         s = StringIO()
         traceback.print_exc(file=s)
         elog.error('%s', s.getvalue())
 
+    def _profiled(self, function, *args):
+        """Call the function, profiling it if the runner is profiling.
+
+        Every call gets its own profiler, so that worker threads can be
+        profiled at the same time.  Its statistics are added to the
+        runner's when it returns.
+        """
+        if self._profile is None:
+            return function(*args)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some versions of Python only allow one active profiler at a
+            # time, in which case the other worker threads go unprofiled.
+            return function(*args)
+        try:
+            return function(*args)
+        finally:
+            profiler.disable()
+            with self._profile_lock:
+                if self._profile is not None:
+                    self._profile.add(profiler)
+                    self._profiled_files += 1
+
+    def _check_signals(self):
+        """Act on the signals which wait for the files to be processed.
+
+        This must only be called while no files are being processed.
+        """
+        self._check_reload()
+        self._check_profile()
+
+    def _check_reload(self):
+        """Reload the configuration, as requested by SIGHUP.
+
+        The new configuration is in effect for the files processed next.
+        If it cannot be loaded, the runner carries on with the old one.
+        """
+        if not self._reload_requested:
+            return
+        self._reload_requested = False
+        self._rescale()
+        try:
+            config.reload()
+        except Exception:
+            elog.exception('%s runner cannot reload the configuration',
+                           self.name)
+            return
+        reconfigure()
+        self._configure()
+        if self.switchboard is not None:
+            self.switchboard.configure()
+        rlog.info('%s runner reloaded the configuration', self.name)
+
+    def _rescale(self):
+        """Take up a new slice of the queue, if the master rescaled us.
+
+        The master changes the number of instances of an autoscaled runner
+        by powers of 2, so each instance's new slice is either part of its
+        old one, or the old slices of the instances the master stopped.
+        This must only be called while no files are being processed, so
+        that once it is acknowledged, no other instance can find one of our
+        files in its slice.
+        """
+        if self.switchboard is None or self.slice is None:
+            return
+        try:
+            with open(scale_file(self.queue_directory)) as fp:
+                numslices = int(fp.read())
+        except (FileNotFoundError, ValueError):
+            return
+        if numslices != self.numslices:
+            self.slice = self.slice * numslices // self.numslices
+            self.numslices = numslices
+            self.switchboard = self._make_switchboard()
+            # The backup files left behind in a slice we took over are ours
+            # to recover now.
+            self._recovering = True
+            rlog.info('%s runner rescaled to slice %d of %d', self.name,
+                      self.slice + 1, self.numslices)
+        with open(scale_file(self.queue_directory, os.getpid()), 'w') as fp:
+            fp.write(str(self.numslices))
+
+    def _check_profile(self):
+        """Start or stop profiling, as requested by SIGUSR2.
+
+        The profile is dumped when profiling is stopped, or when
+        `profile_count` files have been profiled.  This must only be called
+        while no files are being processed.
+        """
+        if self._profile is None:
+            if self._profile_requested:
+                self._profile = pstats.Stats()
+                self._profiled_files = 0
+                rlog.info('%s runner started profiling', self.name)
+        elif (not self._profile_requested or
+              0 < self.profile_count <= self._profiled_files):
+            self._dump_profile()
+
+    @property
+    def profile_path(self):
+        """The file this runner dumps its profile to."""
+        return os.path.join(
+            config.LOG_DIR, 'profiles', '{0}-{1}-{2}.prof'.format(
+                self.name, (0 if self.slice is None else self.slice),
+                os.getpid()))
+
+    def _dump_profile(self):
+        """Dump the profile and stop profiling."""
+        profile, self._profile = self._profile, None
+        self._profile_requested = False
+        path = self.profile_path
+        try:
+            makedirs(os.path.dirname(path))
+            profile.dump_stats(path)
+        except EnvironmentError as error:
+            elog.error('%s runner cannot dump its profile to %s: %s',
+                       self.name, path, error)
+        else:
+            rlog.info('%s runner dumped the profile of %s files to %s',
+                      self.name, self._profiled_files, path)
+
     def _clean_up(self):
         """See `IRunner`."""
         pass
@@ -281,11 +723,42 @@ class Runner:
         """See `IRunner`."""
         pass
 
+    def _backoff(self, filecnt):
+        """Calculate the poll interval after a pass over the queue.
+
+        When the pass found files, the interval is reset to `sleep_time`.
+        Otherwise it is the current idle interval, which is then multiplied
+        by `backoff_factor` for the next idle pass, up to `max_sleep_time`.
+
+        :param filecnt: The number of files the pass found.
+        :type filecnt: int
+        :return: The number of seconds to sleep.
+        :rtype: float
+        """
+        if filecnt:
+            interval = self._idle_interval = self.sleep_float
+        else:
+            interval = self._idle_interval
+            self._idle_interval = min(
+                self._idle_interval * self.backoff_factor,
+                self.max_sleep_float)
+        if interval != self.poll_interval:
+            rlog.debug('%s runner poll interval: %.3fs',
+                       self.name, interval)
+            self.poll_interval = interval
+            self._set_poll_interval_metric()
+        return interval
+
+    def _set_poll_interval_metric(self):
+        poll_interval.set(self.poll_interval, runner=self.name,
+                          slice=(0 if self.slice is None else self.slice))
+
     def _snooze(self, filecnt):
         """See `IRunner`."""
-        if filecnt or self.sleep_float <= 0:
+        interval = self._backoff(filecnt)
+        if filecnt or interval <= 0:
             return
-        time.sleep(self.sleep_float)
+        self.switchboard.wait(interval)
 
     def _short_circuit(self):
         """See `IRunner`."""
@@ -0,0 +1,386 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A switchboard storing its queue in a SQLite database.
+
+Instead of one file per message, the queue entries are rows in a SQLite
+database in write-ahead logging mode, kept in the queue directory.  Each
+entry still has a file base name, which is used in the same way as the file
+based switchboard's, and which determines both its FIFO position and its
+slice.
+
+Dequeuing an entry leases it to the dequeuing process, which is the
+equivalent of the file based switchboard's .bak files: leased entries are
+returned to the queue by `recover_backup_files()` when the runner restarts,
+and are removed by `finish()`.  Entries preserved by `finish()` are written
+to the bad queue as .psv files, in the same format as the file based
+switchboard's.
+"""
+
+__all__ = [
+    'SQLiteSwitchboard',
+    ]
+
+
+import os
+import time
+import errno
+import pickle
+import logging
+import sqlite3
+import threading
+
+from lazr.config import as_timedelta
+from mailman.config import config
+from mailman.core.switchboard import (
+    BUCKETS, MAX_BAK_COUNT, _body_store, _current_batch, _load_message,
+    _loads_message, _pickle_entry, _read_message, _stamp_dequeued,
+    get_priority)
+from mailman.interfaces.switchboard import ISwitchboard
+from mailman.utilities.filesystem import makedirs
+from zope.interface import implementer
+
+
+# The name of the database file in the queue directory.
+DATABASE = 'queue.sqlite'
+# Slices partition the first 32 bits of the entries' digests.
+SLICE_BITS = 32
+# The states of a queue entry.
+QUEUED = 0
+LEASED = 1
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS entry (
+    filebase TEXT PRIMARY KEY,
+    received REAL NOT NULL,
+    enqueued REAL NOT NULL,
+    hash INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    message BLOB NOT NULL,
+    metadata BLOB NOT NULL
+    );
+CREATE INDEX IF NOT EXISTS entry_fifo ON entry (state, received, filebase);
+"""
+
+elog = logging.getLogger('mailman.error')
+
+
+
+@implementer(ISwitchboard)
+class SQLiteSwitchboard:
+    """See `ISwitchboard`."""
+
+    def __init__(self, name, queue_directory,
+                 slice=None, numslices=1, recover=False, notify=False,
+                 qfile_format='pickle', sliced=None):
+        """Create a switchboard object.
+
+        The arguments are the same as for the file based `Switchboard`.
+        `notify` is ignored, since there are no files to watch; `wait()`
+        always sleeps.  `sliced` is ignored too, since all the slices share
+        the database.
+        """
+        assert (numslices & (numslices - 1)) == 0, (
+            'Not a power of 2: {0}'.format(numslices))
+        assert qfile_format in ('pickle', 'raw'), (
+            'Bad queue file format: {0}'.format(qfile_format))
+        self.name = name
+        self.queue_directory = queue_directory
+        self._raw = (qfile_format == 'raw')
+        if config.create_paths:
+            makedirs(self.queue_directory, 0o770)
+        self._database = os.path.join(queue_directory, DATABASE)
+        if slice is None or numslices == 1:
+            self._lower = None
+            self._upper = None
+        else:
+            self._lower = (2 ** SLICE_BITS * slice) // numslices
+            self._upper = (2 ** SLICE_BITS * (slice + 1)) // numslices - 1
+        # The connections are opened lazily, since every process has a
+        # switchboard for every queue but most never touch most of them.
+        # Each thread gets its own connection so that their transactions,
+        # e.g. group commits, stay separate.  SQLite connections must not be
+        # shared across fork(), so the owning process is remembered too.
+        self._local = threading.local()
+        # The leased entries still to be recovered, when they are recovered a
+        # batch at a time.
+        self._migrated = False
+        self._backups = None
+        self.configure()
+        if recover:
+            self.recover_backup_files()
+
+    def configure(self):
+        """See `ISwitchboard`."""
+        self._default_priority = get_priority('post')
+        self._weight = as_timedelta(config.priorities.weight).total_seconds()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._database, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _slice_clause(self):
+        if self._lower is None:
+            return '', ()
+        return ' AND hash BETWEEN ? AND ?', (self._lower, self._upper)
+
+    def enqueue(self, _msg, _metadata=None, **_kws):
+        """See `ISwitchboard`."""
+        filebase, msgsave, datasave = _pickle_entry(
+            _msg, _metadata, _kws, self._raw, self.name,
+            self._default_priority, self._weight)
+        when, digest = filebase.split('+', 1)
+        connection = self._connection
+        connection.execute(
+            'INSERT INTO entry VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (filebase, float(when), time.time(),
+             int(digest[:SLICE_BITS // 4], 16), QUEUED, msgsave, datasave))
+        # In a group commit, the transaction is committed along with all the
+        # other entries in the batch.
+        batch = _current_batch()
+        if batch is None:
+            connection.commit()
+        elif connection not in batch.transactions:
+            batch.transactions.append(connection)
+        return filebase
+
+    def dequeue(self, filebase):
+        """See `ISwitchboard`."""
+        connection = self._connection
+        with connection:
+            row = connection.execute(
+                'SELECT message, metadata FROM entry '
+                'WHERE filebase = ? AND state = ?',
+                (filebase, QUEUED)).fetchone()
+            if row is None:
+                raise FileNotFoundError(
+                    errno.ENOENT, 'No such queue entry', filebase)
+            # Lease the entry for processing.  If this process crashes
+            # uncleanly, recover_backup_files() returns it to the queue.
+            connection.execute(
+                'UPDATE entry SET state = ? WHERE filebase = ?',
+                (LEASED, filebase))
+        msg = _loads_message(row[0])
+        data = pickle.loads(row[1])
+        _stamp_dequeued(data, self.name)
+        return _load_message(msg, data), data
+
+    def finish(self, filebase, preserve=False):
+        """See `ISwitchboard`."""
+        connection = self._connection
+        try:
+            with connection:
+                if preserve:
+                    row = connection.execute(
+                        'SELECT message, metadata FROM entry '
+                        'WHERE filebase = ? AND state = ?',
+                        (filebase, LEASED)).fetchone()
+                    if row is None:
+                        raise FileNotFoundError(
+                            errno.ENOENT, 'No such queue entry', filebase)
+                    self._preserve(filebase, row[0], row[1])
+                connection.execute(
+                    'DELETE FROM entry WHERE filebase = ? AND state = ?',
+                    (filebase, LEASED))
+        except (EnvironmentError, sqlite3.Error):
+            elog.exception(
+                'Failed to remove/preserve queue entry: %s', filebase)
+
+    def restore(self, filebase):
+        """See `ISwitchboard`."""
+        connection = self._connection
+        with connection:
+            cursor = connection.execute(
+                'UPDATE entry SET state = ? WHERE filebase = ? AND state = ?',
+                (QUEUED, filebase, LEASED))
+            if cursor.rowcount == 0:
+                raise FileNotFoundError(
+                    errno.ENOENT, 'No such queue entry', filebase)
+
+    def _preserve(self, filebase, msgsave, datasave):
+        """Write the entry to the bad queue as a .psv file."""
+        bad_dir = config.switchboards['bad'].queue_directory
+        psvfile = os.path.join(bad_dir, filebase + '.psv')
+        tmpfile = psvfile + '.tmp'
+        with open(tmpfile, 'wb') as fp:
+            fp.write(msgsave)
+            fp.write(datasave)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmpfile, psvfile)
+
+    @property
+    def files(self):
+        """See `ISwitchboard`."""
+        return self.get_files()
+
+    def get_files(self, extension='.pck', count=None):
+        """See `ISwitchboard`.
+
+        Queued entries are the equivalent of .pck files and leased entries
+        of .bak files.  There are no entries with any other extension.
+        """
+        state = {'.pck': QUEUED, '.bak': LEASED}.get(extension)
+        if state is None:
+            return []
+        clause, parameters = self._slice_clause()
+        query = ('SELECT filebase FROM entry WHERE state = ?' + clause +
+                 ' ORDER BY received, filebase')
+        if count is not None:
+            query += ' LIMIT ?'
+            parameters += (count,)
+        rows = self._connection.execute(query, (state,) + parameters)
+        return [filebase for (filebase,) in rows]
+
+    def get_age(self):
+        """See `ISwitchboard`."""
+        clause, parameters = self._slice_clause()
+        row = self._connection.execute(
+            'SELECT MIN(enqueued) FROM entry WHERE state = ?' + clause,
+            (QUEUED,) + parameters).fetchone()
+        if row[0] is None:
+            return 0
+        return max(0, time.time() - row[0])
+
+    def wait(self, timeout):
+        """See `ISwitchboard`."""
+        time.sleep(timeout)
+
+    def recover_backup_files(self, count=None):
+        """See `ISwitchboard`."""
+        # Queue files left behind by the file based switchboard are inserted
+        # first, so that their backups get recovered too.
+        if not self._migrated:
+            self._migrate()
+            self._migrated = True
+        if count is None:
+            self._backups = None
+            self._recover(self.get_files('.bak'))
+            return None
+        if self._backups is None:
+            self._backups = self.get_files('.bak')
+        filebases = self._backups[:count]
+        del self._backups[:count]
+        self._recover(filebases)
+        return len(self._backups)
+
+    def _recover(self, filebases):
+        """Return leased entries in our slice to the queue.
+
+        We keep count in _bak_count in the metadata of the number of times we
+        recover an entry.  When the count reaches MAX_BAK_COUNT, the entry is
+        preserved in the bad queue.  Only the metadata is read, unless the
+        entry is preserved, and the entries are all updated in one
+        transaction.
+        """
+        connection = self._connection
+        with connection:
+            for filebase in filebases:
+                row = connection.execute(
+                    'SELECT metadata FROM entry '
+                    'WHERE filebase = ? AND state = ?',
+                    (filebase, LEASED)).fetchone()
+                if row is None:
+                    continue
+                datasave = row[0]
+                try:
+                    data = pickle.loads(datasave)
+                except Exception as error:
+                    elog.error('Unpickling .bak exception: %s\n'
+                               'Preserving file: %s', error, filebase)
+                    bak_count = MAX_BAK_COUNT
+                else:
+                    data['_bak_count'] = data.get('_bak_count', 0) + 1
+                    bak_count = data['_bak_count']
+                    protocol = (0 if data.get('_parsemsg') else 1)
+                    datasave = pickle.dumps(data, protocol)
+                if bak_count >= MAX_BAK_COUNT:
+                    elog.error('.bak file max count, preserving file: %s',
+                               filebase)
+                    msgsave = connection.execute(
+                        'SELECT message FROM entry WHERE filebase = ?',
+                        (filebase,)).fetchone()[0]
+                    self._preserve(filebase, msgsave, datasave)
+                    connection.execute(
+                        'DELETE FROM entry WHERE filebase = ?', (filebase,))
+                else:
+                    connection.execute(
+                        'UPDATE entry SET state = ?, metadata = ? '
+                        'WHERE filebase = ?', (QUEUED, datasave, filebase))
+
+    def _migrate(self):
+        """Move queue files left behind by the file based switchboard.
+
+        The .pck and .bak files in our slice, whether in the queue directory
+        or in its hash prefix subdirectories, are inserted into the database
+        in their original state, and then removed.
+        """
+        directories = [self.queue_directory]
+        directories.extend(
+            os.path.join(self.queue_directory, '{0:x}'.format(bucket))
+            for bucket in range(BUCKETS))
+        connection = self._connection
+        for directory in directories:
+            try:
+                names = os.listdir(directory)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for name in names:
+                filebase, ext = os.path.splitext(name)
+                if ext not in ('.pck', '.bak') or '+' not in filebase:
+                    continue
+                when, digest = filebase.split('+', 1)
+                prefix = int(digest[:SLICE_BITS // 4], 16)
+                if (self._lower is not None and
+                        not self._lower <= prefix <= self._upper):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    enqueued = os.path.getmtime(path)
+                    with open(path, 'rb') as fp:
+                        msg, reference = _read_message(fp)
+                        data_pos = fp.tell()
+                        pickle.load(fp)
+                        fp.seek(0)
+                        msgsave = fp.read(data_pos)
+                        datasave = fp.read()
+                    if reference is not None:
+                        # Take the message out of the shared store.
+                        with _body_store().open(reference) as body_fp:
+                            msgsave = body_fp.read()
+                except Exception as error:
+                    elog.error('Cannot migrate queue file %s: %s',
+                               path, error)
+                    continue
+                state = (QUEUED if ext == '.pck' else LEASED)
+                with connection:
+                    connection.execute(
+                        'INSERT OR IGNORE INTO entry VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?)',
+                        (filebase, float(when), enqueued, prefix, state,
+                         msgsave, datasave))
+                os.unlink(path)
+                if reference is not None:
+                    _body_store().release(reference)
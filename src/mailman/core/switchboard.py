@@ -22,26 +22,45 @@ subclass).  Metadata is represented as a Python dictionary.  For every
 message/metadata pair in a queue, a single file containing two pickles is
 written.  First, the message is written to the pickle, then the metadata
 dictionary is written.
+
+In the raw queue file format, the message is written in its wire format
+instead, after a short header giving the format version and the length of the
+message, and is followed by the metadata pickle.  Such messages are only
+parsed when they are first used.  Both formats can always be read.
 """
 
 __all__ = [
+    'STAGE_TIMES',
     'Switchboard',
+    'get_priority',
+    'group_commit',
+    'is_sliced',
     'handle_ConfigurationUpdatedEvent',
+    'scale_file',
     ]
 
 
+import io
 import os
 import time
 import email
+import heapq
 import pickle
+import struct
 import hashlib
 import logging
+import threading
 
+from contextlib import contextmanager
+from lazr.config import as_boolean, as_timedelta
 from mailman.config import config
-from mailman.email.message import Message
+from mailman.email.message import LazyMessage, Message
 from mailman.interfaces.configuration import ConfigurationUpdatedEvent
 from mailman.interfaces.switchboard import ISwitchboard
-from mailman.utilities.filesystem import makedirs
+from mailman.utilities.filesystem import fsync_directory, makedirs, sync_files
+from mailman.utilities.inotify import (
+    DirectoryWatcher, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO)
+from mailman.utilities.modules import call_name
 from mailman.utilities.string import expand
 from zope.interface import implementer
 
@@ -49,15 +68,584 @@ from zope.interface import implementer
 # 20 bytes of all bits set, maximum hashlib.sha.digest() value.  We do it this
 # way for Python 2/3 compatibility.
 shamax = int('0xffffffffffffffffffffffffffffffffffffffff', 16)
+# When a queue is split into slices, its files live in subdirectories named
+# after the first hex digit of their digest.  Each slice only lists the
+# subdirectories it owns.
+BUCKETS = 16
 # Small increment to add to time in case two entries have the same time.  This
 # prevents skipping one of two entries with the same time until the next pass.
 DELTA = .0001
+# The reserved metadata key under which the stage times are recorded.  This is
+# a list with an entry for every queue the message went through, each a
+# dictionary with the queue's name and the times the message was enqueued,
+# dequeued and done with there.
+STAGE_TIMES = 'stage_times'
 # We count the number of times a file has been moved to .bak and recovered.
 # In order to prevent loops and a message flood, when the count reaches this
 # value, we move the file to the bad queue as a .psv.
 MAX_BAK_COUNT = 3
+# Runners recover their backup files this many at a time, between passes over
+# the queue, so that new messages don't wait for all of them.
+RECOVERY_BATCH_SIZE = 100
+# Runners take at most this many of the oldest queue files in one pass, so
+# that a pass doesn't sort the whole queue, and newly queued files with a
+# higher priority are not stuck behind a long pass.
+FILES_PER_PASS = 1000
+# The kinds of messages which are given a priority in the `[priorities]`
+# configuration section.
+PRIORITY_KINDS = ('notification', 'probe', 'digest', 'post')
+# Queue files in the raw format start with this header: a magic string, which
+# can't start a pickle, the format version and the length of what follows.
+# That is the message's bytes, or in the reference format, the reference to a
+# message in the store of shared message bodies.
+RAW_MAGIC = b'MMQF'
+RAW_HEADER = struct.Struct('>4sBQ')
+RAW_VERSION = 1
+REFERENCE_VERSION = 2
+# The index's heap is compacted when it holds more than this many entries for
+# files which are no longer in the queue.
+MAX_STALE_ENTRIES = 1000
 
 elog = logging.getLogger('mailman.error')
+rlog = logging.getLogger('mailman.runner')
+
+# The group commit batch in progress in the current thread, if any.
+_local = threading.local()
+
+
+
+class _Batch:
+    """Queue files written in a group commit, waiting to be published."""
+
+    def __init__(self):
+        # 2-tuples of (tmpfile, filename).
+        self.pending = []
+        # Shared message bodies which are already in place, but still need to
+        # be synced, and the directories they were linked into.
+        self.unsynced = []
+        self.directories = set()
+        # 2-tuples of (tmpfile, reference) for the shared message bodies
+        # referenced by the pending queue files.
+        self.references = []
+        # Database connections with uncommitted enqueues, for switchboards
+        # which are not file based.
+        self.transactions = []
+
+    def flush(self):
+        """Make all the pending files durable, then publish them."""
+        pending = self.pending
+        self.pending = []
+        try:
+            if len(pending) > 0 or len(self.unsynced) > 0:
+                sync_files([tmpfile for tmpfile, filename in pending] +
+                           self.unsynced)
+                # The shared bodies must be in place before any queue file
+                # referencing them is published.
+                for directory in self.directories:
+                    fsync_directory(directory)
+                directories = set()
+                for tmpfile, filename in pending:
+                    os.rename(tmpfile, filename)
+                    directories.add(os.path.dirname(filename))
+                for directory in directories:
+                    fsync_directory(directory)
+            self.unsynced = []
+            self.directories = set()
+            self.references = []
+            while len(self.transactions) > 0:
+                self.transactions[0].commit()
+                del self.transactions[0]
+        except:
+            self.pending = pending
+            self.discard()
+            raise
+
+    def discard(self):
+        """Throw away all the pending files."""
+        for tmpfile, reference in self.references:
+            if os.path.exists(tmpfile):
+                _body_store().release(reference)
+        for tmpfile, filename in self.pending:
+            try:
+                os.unlink(tmpfile)
+            except FileNotFoundError:
+                # Already published.
+                pass
+        self.pending = []
+        self.unsynced = []
+        self.directories = set()
+        self.references = []
+        for connection in self.transactions:
+            connection.rollback()
+        self.transactions = []
+
+
+
+class _BodyStore:
+    """Serialized messages shared by several queue files.
+
+    A message which is enqueued several times, e.g. once for every recipient
+    of an LMTP transaction, is only written once.  It is stored under the
+    digest of its contents, and every queue file referencing it gets its own
+    hard link to it.  The link count is the reference count: when the last
+    reference is released, the message is removed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def add(self, msgsave, filebase):
+        """Store the serialized message and return a new reference to it."""
+        digest = hashlib.sha1(msgsave).hexdigest()
+        canonical = os.path.join(self.directory, digest)
+        reference = digest + '+' + filebase
+        path = os.path.join(self.directory, reference)
+        batch = _current_batch()
+        try:
+            os.link(canonical, path)
+        except FileNotFoundError:
+            # This is the first reference, or the last reference was just
+            # released by some other process.
+            makedirs(self.directory, 0o770)
+            tmpfile = path + '.tmp'
+            with open(tmpfile, 'wb') as fp:
+                fp.write(msgsave)
+                fp.flush()
+                if batch is None:
+                    os.fsync(fp.fileno())
+            os.rename(tmpfile, path)
+            try:
+                os.link(path, canonical)
+            except FileExistsError:
+                # Another process stored the same message in the meantime.
+                pass
+            if batch is not None:
+                batch.unsynced.append(path)
+        if batch is None:
+            fsync_directory(self.directory)
+        else:
+            batch.directories.add(self.directory)
+        return reference
+
+    def open(self, reference):
+        """Open a referenced message for reading."""
+        return open(os.path.join(self.directory, reference), 'rb')
+
+    def release(self, reference):
+        """Release a reference, removing the message with the last one."""
+        path = os.path.join(self.directory, reference)
+        canonical = os.path.join(self.directory, reference.split('+', 1)[0])
+        try:
+            os.unlink(path)
+            if os.stat(canonical).st_nlink == 1:
+                # A new reference may be linked to the message in the
+                # meantime, but that keeps the message's contents alive.
+                os.unlink(canonical)
+        except FileNotFoundError:
+            pass
+
+
+def _body_store():
+    """The store of shared message bodies."""
+    return _BodyStore(os.path.join(config.QUEUE_DIR, 'bodies'))
+
+
+
+@contextmanager
+def group_commit():
+    """Context manager for batching the durable writes of queue files.
+
+    Inside the with statement, `Switchboard.enqueue()` writes its queue files
+    without syncing them to disk.  When the with statement exits cleanly, all
+    the files are flushed to disk together and then renamed into their queue
+    directories, so a burst of enqueues costs a single sync instead of one
+    fsync(2) per file.  No file is visible to the runners before it is
+    durable.  When the with statement exits with an exception, none of the
+    files are published.
+
+    Nested group commits are part of the outermost one.
+    """
+    if getattr(_local, 'batch', None) is not None:
+        yield
+        return
+    batch = _local.batch = _Batch()
+    try:
+        yield
+    except:
+        _local.batch = None
+        batch.discard()
+        raise
+    else:
+        _local.batch = None
+        batch.flush()
+
+
+
+class _QueueIndex:
+    """An in-process FIFO index of the .pck files in a queue directory.
+
+    Every queue file name is only parsed once, when it is first added to the
+    index.  The files in this switchboard's slice are kept in a heap ordered
+    by their arrival time, so the FIFO ordering can be calculated without
+    re-examining every file on every pass.
+    """
+
+    def __init__(self, accept):
+        # A callable which is passed a file's hex digest and returns whether
+        # the file is in this switchboard's slice or not.
+        self._accept = accept
+        # All the filebases known to be in the queue directory.
+        self._present = set()
+        # The filebases in our slice, and a heap of (time, filebase) tuples
+        # for those.  Entries for files that have left the queue are only
+        # removed from the heap lazily; until then they are remembered as
+        # stale, since the same file can come back, e.g. when a backup file
+        # is recovered.
+        self._mine = set()
+        self._stale = set()
+        self._heap = []
+        # Whether the index can be updated incrementally, or needs to be
+        # rebuilt from a full directory listing.
+        self.valid = False
+
+    def __len__(self):
+        return len(self._mine)
+
+    def add(self, filebase):
+        if filebase in self._present:
+            return
+        self._present.add(filebase)
+        if filebase in self._stale:
+            # Its heap entry is still there.
+            self._stale.remove(filebase)
+            self._mine.add(filebase)
+            return
+        when, digest = filebase.split('+', 1)
+        if self._accept(digest):
+            self._mine.add(filebase)
+            heapq.heappush(self._heap, (float(when), filebase))
+
+    def discard(self, filebase):
+        self._present.discard(filebase)
+        if filebase not in self._mine:
+            return
+        self._mine.remove(filebase)
+        self._stale.add(filebase)
+        if len(self._stale) > MAX_STALE_ENTRIES:
+            self._heap = [entry for entry in self._heap
+                          if entry[1] in self._mine]
+            heapq.heapify(self._heap)
+            self._stale.clear()
+
+    def sync(self, filebases):
+        """Bring the index up to date with a full directory listing.
+
+        :param filebases: All the .pck filebases in the queue directory.
+        :type filebases: set
+        """
+        for filebase in self._present - filebases:
+            self.discard(filebase)
+        for filebase in filebases - self._present:
+            self.add(filebase)
+        self.valid = True
+
+    def files(self, count=None):
+        """Return the filebases in our slice, in FIFO order.
+
+        :param count: The maximum number of filebases to return, or None to
+            return them all.
+        """
+        if count is None or count > len(self._mine):
+            count = len(self._mine)
+        # Pop the oldest entries off the heap, dropping the stale ones along
+        # the way, and push the live ones back.
+        taken = []
+        while len(taken) < count:
+            entry = heapq.heappop(self._heap)
+            if entry[1] in self._mine:
+                taken.append(entry)
+            else:
+                self._stale.discard(entry[1])
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return [filebase for when, filebase in taken]
+
+    def enqueued(self, get_time, slack):
+        """Return when the longest waiting file in our slice was enqueued.
+
+        Only the oldest files by the time in their base name are looked at,
+        as far as they could have been enqueued earlier than the files
+        already looked at.
+
+        :param get_time: A callable which is passed a filebase and returns
+            when the file was enqueued, or None if it has left the queue.
+        :param slack: How many seconds earlier than the time in its base
+            name a file can have been enqueued, at most.
+        :return: The time, or None if our slice is empty.
+        """
+        oldest = None
+        taken = []
+        while len(self._heap) > 0:
+            entry = heapq.heappop(self._heap)
+            if entry[1] not in self._mine:
+                self._stale.discard(entry[1])
+                continue
+            taken.append(entry)
+            if oldest is not None and entry[0] - slack >= oldest:
+                break
+            when = get_time(entry[1])
+            if when is not None and (oldest is None or when < oldest):
+                oldest = when
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return oldest
+
+
+
+def is_sliced(section):
+    """Return whether a queue's files are stored in slice subdirectories.
+
+    Queues which may have more than one runner instance, either all the time
+    or when their runners are autoscaled, always use the subdirectories.
+
+    :param section: The runner's configuration section.
+    :return: Whether the queue is sliced.
+    :rtype: bool
+    """
+    return max(int(section.instances), int(section.max_instances)) > 1
+
+
+
+def scale_file(queue_directory, pid=None):
+    """Return the path of a file through which a runner is rescaled.
+
+    When the master changes the number of instances of an autoscaled runner,
+    it writes the new number to a file in the queue directory, and tells the
+    running instances to reload.  Each of them then takes up its slice of
+    the queue for the new number of instances, and acknowledges that in a
+    file of its own.
+
+    :param queue_directory: The runner's queue directory.
+    :type queue_directory: str
+    :param pid: The process id of the instance acknowledging, or None for the
+        file written by the master.
+    :type pid: int
+    :return: The path of the file.
+    :rtype: str
+    """
+    if pid is None:
+        return os.path.join(queue_directory, 'instances')
+    return os.path.join(queue_directory, 'instances.{0:d}'.format(pid))
+
+
+
+def get_priority(kind):
+    """Return the queue priority of a kind of message.
+
+    :param kind: The kind of message, one of 'notification', 'probe',
+        'digest' or 'post'.
+    :type kind: str
+    :return: The priority from the `[priorities]` configuration section.
+    :rtype: int
+    """
+    return int(getattr(config.priorities, kind))
+
+
+
+def _stamp_enqueued(data, name):
+    """Record in the metadata that the message is enqueued in a queue."""
+    if as_boolean(config.mailman.stage_timing):
+        # Copy the list, since the metadata is only copied shallowly and the
+        # caller's stages must not change.
+        stage = dict(queue=name, enqueued=time.time())
+        data[STAGE_TIMES] = data.get(STAGE_TIMES, []) + [stage]
+
+
+def _stamp_dequeued(data, name):
+    """Record in the metadata that the message is dequeued from a queue."""
+    stages = data.get(STAGE_TIMES)
+    if stages and stages[-1]['queue'] == name:
+        stages[-1]['dequeued'] = time.time()
+
+
+
+def _current_batch():
+    """Return the group commit batch in progress in this thread, or None."""
+    return getattr(_local, 'batch', None)
+
+
+
+def _pickle_entry(msg, metadata, kws, raw=False, name=None,
+                  default_priority=0, weight=0):
+    """Serialize a message and its metadata for storing in a queue.
+
+    :param raw: Whether to store the message in the raw format.  Messages
+        which can't be flattened to bytes are pickled anyway.
+    :param name: The name of the queue, for the stage times.
+    :param default_priority: The priority of messages which don't have one.
+    :param weight: The number of seconds each priority point moves the
+        message's time back by.
+    :return: A 3-tuple of the entry's file base name, the serialized message
+        and the pickled metadata.
+    """
+    if metadata is None:
+        metadata = {}
+    # Calculate the SHA hexdigest of the message to get a unique base
+    # filename.  We're also going to use the digest as a hash into the set
+    # of parallel runner processes.
+    data = metadata.copy()
+    data.update(kws)
+    if name is not None:
+        _stamp_enqueued(data, name)
+    list_id = data.get('listid', '--nolist--')
+    # Get some data for the input to the sha hash.  Files are sorted by this
+    # time, which for prioritized messages is moved back by their priority's
+    # weight.
+    priority = data.get('priority', default_priority)
+    now = time.time()
+    if priority != 0:
+        now -= priority * weight
+    now = repr(now)
+    msgsave = None
+    attributes = None
+    if data.get('_plaintext'):
+        protocol = 0
+        msgsave = pickle.dumps(str(msg), protocol)
+    else:
+        protocol = pickle.HIGHEST_PROTOCOL
+        if raw:
+            msgsave, attributes = _flatten(msg)
+        if msgsave is None:
+            msgsave = pickle.dumps(msg, protocol)
+    # The list-id field is a string but the input to the hash function must
+    # be bytes.
+    hashfood = msgsave + list_id.encode('utf-8') + now.encode('utf-8')
+    # Encode the time into the file name for FIFO sorting.  The file name
+    # consists of two parts separated by a '+': the received time for this
+    # message (i.e. when it first showed up on this system), adjusted for
+    # its priority, and the sha hex digest.
+    filebase = now + '+' + hashlib.sha1(hashfood).hexdigest()
+    # Always add the metadata schema version number
+    data['version'] = config.QFILE_SCHEMA_VERSION
+    # Filter out volatile entries.  Use .keys() so that we can mutate the
+    # dictionary during the iteration.
+    for k in list(data):
+        if k.startswith('_'):
+            del data[k]
+    # We have to tell the dequeue() method whether to parse the message
+    # object or not.
+    data['_parsemsg'] = (protocol == 0)
+    # Attributes of the message object which aren't part of its bytes.
+    if attributes:
+        data['_attributes'] = attributes
+    return filebase, msgsave, pickle.dumps(data, protocol)
+
+
+# The attributes of a message object which are restored by parsing it.
+_PARSED_ATTRIBUTES = frozenset(Message().__dict__) | {'_raw'}
+
+
+def _flatten(msg):
+    """Return the raw format of a message and its other attributes.
+
+    The message is None if it can't be flattened.
+    """
+    if not isinstance(msg, Message):
+        return None, None
+    # Only write the envelope sender when there is one, otherwise the
+    # generator makes one up.  Unparsed messages are written unchanged.
+    unixfrom = ((isinstance(msg, LazyMessage) and not msg.is_parsed) or
+                msg.get_unixfrom() is not None)
+    try:
+        flat = msg.as_bytes(unixfrom=unixfrom)
+    except Exception:
+        return None, None
+    attributes = {name: value for name, value in msg.__dict__.items()
+                  if name not in _PARSED_ATTRIBUTES}
+    return (RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, len(flat)) + flat,
+            attributes)
+
+
+def _read_message(fp):
+    """Read the serialized message from the start of a queue file.
+
+    The file is left positioned at the metadata pickle.  Messages in the raw
+    format are returned unparsed.
+
+    :return: A 2-tuple of the message and the reference to the shared
+        message body it was read from, or None.
+    """
+    header = fp.read(RAW_HEADER.size)
+    if header[:len(RAW_MAGIC)] != RAW_MAGIC:
+        fp.seek(0)
+        return pickle.load(fp), None
+    magic, version, size = RAW_HEADER.unpack(header)
+    if version == RAW_VERSION:
+        return LazyMessage(fp.read(size)), None
+    if version == REFERENCE_VERSION:
+        reference = fp.read(size).decode('ascii')
+        with _body_store().open(reference) as body_fp:
+            msg, nested = _read_message(body_fp)
+        return msg, reference
+    raise ValueError(
+        'Unsupported queue file format version: {0}'.format(version))
+
+
+class _Skipped:
+    """Stands in for every object in a skipped message pickle."""
+
+    def __init__(self, *args, **kws):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class _Skipper(pickle.Unpickler):
+    """Read past a message pickle without building the message."""
+
+    def find_class(self, module, name):
+        return _Skipped
+
+
+def _skip_message(fp):
+    """Like `_read_message()`, but skip the message without loading it.
+
+    Raw messages and references to shared message bodies are seeked past, and
+    pickled messages are read without creating any of their objects.
+    """
+    header = fp.read(RAW_HEADER.size)
+    if header[:len(RAW_MAGIC)] != RAW_MAGIC:
+        fp.seek(0)
+        _Skipper(fp).load()
+        return
+    magic, version, size = RAW_HEADER.unpack(header)
+    if version not in (RAW_VERSION, REFERENCE_VERSION):
+        raise ValueError(
+            'Unsupported queue file format version: {0}'.format(version))
+    fp.seek(size, os.SEEK_CUR)
+
+
+def _loads_message(msgsave):
+    """Like `_read_message()`, but for a serialized message in memory."""
+    with io.BytesIO(msgsave) as fp:
+        msg, reference = _read_message(fp)
+    return msg
+
+
+def _load_message(msg, data):
+    """Return the message object for a deserialized queue entry."""
+    if data.get('_parsemsg'):
+        # Calculate the original size of the text now so that we won't
+        # have to generate the message later when we do size restriction
+        # checking.
+        original_size = len(msg)
+        msg = email.message_from_string(msg, Message)
+        msg.original_size = original_size
+        data['original_size'] = original_size
+    for name, value in data.pop('_attributes', {}).items():
+        setattr(msg, name, value)
+    return msg
 
 
 
@@ -66,7 +654,8 @@ class Switchboard:
     """See `ISwitchboard`."""
 
     def __init__(self, name, queue_directory,
-                 slice=None, numslices=1, recover=False):
+                 slice=None, numslices=1, recover=False, notify=False,
+                 qfile_format='pickle', sliced=None):
         """Create a switchboard object.
 
         :param name: The queue name.
@@ -77,101 +666,200 @@ class Switchboard:
             None, it must be [0..`numslices`).
         :type slice: int or None
         :param numslices: The total number of slices to split this queue
-            directory into.  It must be a power of 2.
+            directory into.  It must be a power of 2.  When it is greater
+            than 1, the queue files are stored in per-slice subdirectories of
+            the queue directory.  If `slice` is None, the switchboard still
+            manages the entire queue.
         :type numslices: int
-        :param recover: True if backup files should be recovered.
+        :param recover: True if backup files should be recovered.  Otherwise
+            they can be recovered later with `recover_backup_files()`.
         :type recover: bool
+        :param notify: True if `wait()` should be woken up as soon as a new
+            file is enqueued, instead of just sleeping.  This requires
+            inotify; when it isn't available, `wait()` falls back to
+            sleeping.
+        :type notify: bool
+        :param qfile_format: The format of the queue files written by
+            `enqueue()`, either 'pickle' or 'raw'.
+        :type qfile_format: str
+        :param sliced: Whether the queue files are stored in the per-slice
+            subdirectories.  By default they are when `numslices` is greater
+            than 1.  Queues whose number of slices changes at run time must
+            always use the subdirectories.
+        :type sliced: bool or None
         """
         assert (numslices & (numslices - 1)) == 0, (
             'Not a power of 2: {0}'.format(numslices))
+        assert qfile_format in ('pickle', 'raw'), (
+            'Bad queue file format: {0}'.format(qfile_format))
         self.name = name
         self.queue_directory = queue_directory
+        self._raw = (qfile_format == 'raw')
         # If configured to, create the directory if it doesn't yet exist.
         if config.create_paths:
             makedirs(self.queue_directory, 0o770)
-        # Fast track for no slices
+        # The directories holding this switchboard's queue files.  With no
+        # slices, that's just the queue directory.
+        self._sliced = (numslices > 1 if sliced is None else sliced)
+        if not self._sliced:
+            self._directories = [self.queue_directory]
+        elif slice is None or numslices == 1:
+            self._directories = [self._bucket_directory(bucket)
+                                 for bucket in range(BUCKETS)]
+        else:
+            first = slice * BUCKETS // numslices
+            last = max(first + 1, (slice + 1) * BUCKETS // numslices)
+            self._directories = [self._bucket_directory(bucket)
+                                 for bucket in range(first, last)]
+        if config.create_paths:
+            for directory in self._directories:
+                makedirs(directory, 0o770)
+        # Fast track for no slices, or for slices which own whole
+        # subdirectories.  Otherwise the slice shares its subdirectory with
+        # other slices and must filter on the digest's bit range.
         self._lower = None
         self._upper = None
-        # BAW: test performance and end-cases of this algorithm
-        if numslices != 1:
-            self._lower = ((shamax + 1) * slice) / numslices
-            self._upper = (((shamax + 1) * (slice + 1)) / numslices) - 1
+        if slice is not None and numslices > BUCKETS:
+            self._lower = ((shamax + 1) * slice) // numslices
+            self._upper = ((shamax + 1) * (slice + 1)) // numslices - 1
+        self._index = _QueueIndex(self._in_slice)
+        # The shared message bodies referenced by dequeued files, by file
+        # base name.
+        self._references = {}
+        # Events read from the watcher while waiting, which have not yet been
+        # applied to the index.
+        self._events = []
+        self._watcher = None
+        if notify:
+            try:
+                self._watcher = DirectoryWatcher(
+                    self._directories,
+                    IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE,
+                    suffix='.pck')
+            except OSError as error:
+                rlog.warning('%s queue falling back to polling: %s',
+                             self.name, error)
+        # The backup files still to be recovered, when they are recovered a
+        # batch at a time.
+        self._migrated = False
+        self._backups = None
+        self.configure()
         if recover:
             self.recover_backup_files()
 
-    def enqueue(self, _msg, _metadata=None, **_kws):
+    def configure(self):
         """See `ISwitchboard`."""
-        if _metadata is None:
-            _metadata = {}
-        # Calculate the SHA hexdigest of the message to get a unique base
-        # filename.  We're also going to use the digest as a hash into the set
-        # of parallel runner processes.
-        data = _metadata.copy()
-        data.update(_kws)
-        list_id = data.get('listid', '--nolist--')
-        # Get some data for the input to the sha hash.
-        now = repr(time.time())
-        if data.get('_plaintext'):
-            protocol = 0
-            msgsave = pickle.dumps(str(_msg), protocol)
+        self._default_priority = get_priority('post')
+        self._lowest_priority = min(
+            0, *(get_priority(kind) for kind in PRIORITY_KINDS))
+        self._weight = as_timedelta(config.priorities.weight).total_seconds()
+
+    def _bucket_directory(self, bucket):
+        return os.path.join(self.queue_directory, '{0:x}'.format(bucket))
+
+    def _path(self, filebase, extension):
+        """Return the path to the queue file."""
+        if self._sliced:
+            when, digest = filebase.split('+', 1)
+            return os.path.join(
+                self.queue_directory, digest[0], filebase + extension)
+        return os.path.join(self.queue_directory, filebase + extension)
+
+    def _migrate(self):
+        """Move queue files left behind by a different layout.
+
+        When a queue goes from one slice to many, the existing queue files
+        are moved from the top-level queue directory into the slices'
+        subdirectories, and when it goes back to one slice they are moved up
+        again.  Backup files are moved too so they can be recovered.
+        """
+        if self._sliced:
+            sources = [self.queue_directory]
         else:
-            protocol = pickle.HIGHEST_PROTOCOL
-            msgsave = pickle.dumps(_msg, protocol)
-        # The list-id field is a string but the input to the hash function must
-        # be bytes.
-        hashfood = msgsave + list_id.encode('utf-8') + now.encode('utf-8')
-        # Encode the current time into the file name for FIFO sorting.  The
-        # file name consists of two parts separated by a '+': the received
-        # time for this message (i.e. when it first showed up on this system)
-        # and the sha hex digest.
-        filebase = now + '+' + hashlib.sha1(hashfood).hexdigest()
-        filename = os.path.join(self.queue_directory, filebase + '.pck')
+            sources = [self._bucket_directory(bucket)
+                       for bucket in range(BUCKETS)]
+        for source in sources:
+            try:
+                names = os.listdir(source)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                filebase, ext = os.path.splitext(name)
+                if ext not in ('.pck', '.bak') or '+' not in filebase:
+                    continue
+                when, digest = filebase.split('+', 1)
+                if not self._in_slice(digest):
+                    continue
+                destination = self._path(filebase, ext)
+                if os.path.dirname(destination) not in self._directories:
+                    # Some other slice owns this file.
+                    continue
+                os.rename(os.path.join(source, name), destination)
+
+    def enqueue(self, _msg, _metadata=None, **_kws):
+        """See `ISwitchboard`."""
+        filebase, msgsave, datasave = _pickle_entry(
+            _msg, _metadata, _kws, self._raw, self.name,
+            self._default_priority, self._weight)
+        filename = self._path(filebase, '.pck')
         tmpfile = filename + '.tmp'
-        # Always add the metadata schema version number
-        data['version'] = config.QFILE_SCHEMA_VERSION
-        # Filter out volatile entries.  Use .keys() so that we can mutate the
-        # dictionary during the iteration.
-        for k in list(data):
-            if k.startswith('_'):
-                del data[k]
-        # We have to tell the dequeue() method whether to parse the message
-        # object or not.
-        data['_parsemsg'] = (protocol == 0)
-        # Write to the pickle file the message object and metadata.
+        batch = _current_batch()
+        # When the same message is enqueued several times, the caller can ask
+        # for it to be stored only once, with the queue file referencing it.
+        if _kws.get('_sharebody', (_metadata or {}).get('_sharebody')):
+            reference = _body_store().add(msgsave, filebase)
+            msgsave = RAW_HEADER.pack(
+                RAW_MAGIC, REFERENCE_VERSION, len(reference))
+            msgsave += reference.encode('ascii')
+            if batch is not None:
+                batch.references.append((tmpfile, reference))
+        # Write to the pickle file the message object and metadata.  In a
+        # group commit, the file is synced and published later along with all
+        # the others in the batch.
         with open(tmpfile, 'wb') as fp:
             fp.write(msgsave)
-            pickle.dump(data, fp, protocol)
+            fp.write(datasave)
             fp.flush()
-            os.fsync(fp.fileno())
-        os.rename(tmpfile, filename)
+            if batch is None:
+                os.fsync(fp.fileno())
+        if batch is None:
+            os.rename(tmpfile, filename)
+        else:
+            batch.pending.append((tmpfile, filename))
         return filebase
 
     def dequeue(self, filebase):
         """See `ISwitchboard`."""
         # Calculate the filename from the given filebase.
-        filename = os.path.join(self.queue_directory, filebase + '.pck')
-        backfile = os.path.join(self.queue_directory, filebase + '.bak')
+        filename = self._path(filebase, '.pck')
+        backfile = self._path(filebase, '.bak')
         # Read the message object and metadata.
-        with open(filename, 'rb') as fp:
+        try:
+            fp = open(filename, 'rb')
+        except FileNotFoundError:
+            # Our index is out of sync with the queue directory, so it must
+            # be rebuilt from scratch.
+            self._index.valid = False
+            self._index.discard(filebase)
+            raise
+        with fp:
             # Move the file to the backup file name for processing.  If this
             # process crashes uncleanly the .bak file will be used to
             # re-instate the .pck file in order to try again.
             os.rename(filename, backfile)
-            msg = pickle.load(fp)
+            self._index.discard(filebase)
+            msg, reference = _read_message(fp)
             data = pickle.load(fp)
-        if data.get('_parsemsg'):
-            # Calculate the original size of the text now so that we won't
-            # have to generate the message later when we do size restriction
-            # checking.
-            original_size = len(msg)
-            msg = email.message_from_string(msg, Message)
-            msg.original_size = original_size
-            data['original_size'] = original_size
-        return msg, data
+        if reference is not None:
+            self._references[filebase] = reference
+        _stamp_dequeued(data, self.name)
+        return _load_message(msg, data), data
 
     def finish(self, filebase, preserve=False):
         """See `ISwitchboard`."""
-        bakfile = os.path.join(self.queue_directory, filebase + '.bak')
+        bakfile = self._path(filebase, '.bak')
+        # Preserved files keep their reference to a shared message body.
+        reference = self._references.pop(filebase, None)
         try:
             if preserve:
                 bad_dir = config.switchboards['bad'].queue_directory
@@ -179,31 +867,71 @@ class Switchboard:
                 os.rename(bakfile, psvfile)
             else:
                 os.unlink(bakfile)
+                if reference is not None:
+                    _body_store().release(reference)
         except EnvironmentError:
             elog.exception(
                 'Failed to unlink/preserve backup file: %s', bakfile)
 
+    def restore(self, filebase):
+        """See `ISwitchboard`."""
+        # The queue file keeps its reference to a shared message body.
+        self._references.pop(filebase, None)
+        os.rename(self._path(filebase, '.bak'), self._path(filebase, '.pck'))
+        self._index.add(filebase)
+
     @property
     def files(self):
         """See `ISwitchboard`."""
         return self.get_files()
 
-    def get_files(self, extension='.pck'):
+    def get_files(self, extension='.pck', count=None):
         """See `ISwitchboard`."""
+        if extension != '.pck':
+            return self._scan(extension)[:count]
+        self._refresh_index()
+        return self._index.files(count)
+
+    def get_age(self):
+        """See `ISwitchboard`.
+
+        Queue files are never rewritten once they are enqueued, so their
+        modification time is when they were enqueued.  The time in a file's
+        base name is moved back by its priority, but never by more than the
+        lowest priority allows, so only the oldest few files need to be
+        looked at.
+        """
+        def get_time(filebase):
+            try:
+                return os.path.getmtime(self._path(filebase, '.pck'))
+            except FileNotFoundError:
+                # The file was dequeued in the meantime.
+                return None
+        self._refresh_index()
+        oldest = self._index.enqueued(
+            get_time, max(0, -self._lowest_priority * self._weight))
+        if oldest is None:
+            return 0
+        return max(0, time.time() - oldest)
+
+    def _in_slice(self, digest):
+        # Throw out any files which don't match our bitrange.  BAW: test
+        # performance and end-cases of this algorithm.  MAS: both
+        # comparisons need to be <= to get complete range.
+        return (self._lower is None or
+                self._lower <= int(digest, 16) <= self._upper)
+
+    def _scan(self, extension):
+        """Scan the queue directory for files with the given extension."""
         times = {}
-        lower = self._lower
-        upper = self._upper
-        for f in os.listdir(self.queue_directory):
+        for f in self._listdir():
             # By ignoring anything that doesn't end in .pck, we ignore
             # tempfiles and avoid a race condition.
             filebase, ext = os.path.splitext(f)
             if ext != extension:
                 continue
             when, digest = filebase.split('+', 1)
-            # Throw out any files which don't match our bitrange.  BAW: test
-            # performance and end-cases of this algorithm.  MAS: both
-            # comparisons need to be <= to get complete range.
-            if lower is None or (lower <= int(digest, 16) <= upper):
+            if self._in_slice(digest):
                 key = float(when)
                 while key in times:
                     key += DELTA
@@ -211,21 +939,94 @@ class Switchboard:
         # FIFO sort
         return [times[k] for k in sorted(times)]
 
-    def recover_backup_files(self):
+    def _listdir(self):
+        """List the files in all of this switchboard's directories."""
+        if len(self._directories) == 1:
+            return os.listdir(self._directories[0])
+        names = []
+        for directory in self._directories:
+            names.extend(os.listdir(directory))
+        return names
+
+    def _refresh_index(self):
+        """Bring the index of .pck files up to date.
+
+        When notifications are enabled, the index is updated from the events
+        the watcher has seen since the last refresh.  Otherwise, or when the
+        index has become invalid, the queue directory is listed, but only the
+        newly seen file names get parsed.
+        """
+        events = self._events
+        self._events = []
+        if self._watcher is not None:
+            events.extend(self._watcher.read_events())
+            if any(name is None for directory, name, mask in events):
+                # The kernel's event queue overflowed.
+                self._index.valid = False
+        if self._watcher is None or not self._index.valid:
+            self._index.sync(set(
+                f[:-4] for f in self._listdir() if f.endswith('.pck')))
+        # Replaying events which happened before the directory listing is
+        # harmless, since they get applied in the order they happened.
+        for directory, name, mask in events:
+            if not name.endswith('.pck'):
+                continue
+            if mask & IN_MOVED_TO:
+                self._index.add(name[:-4])
+            else:
+                self._index.discard(name[:-4])
+
+    def wait(self, timeout):
         """See `ISwitchboard`."""
-        # Move all .bak files in our slice to .pck.  It's impossible for both
-        # to exist at the same time, so the move is enough to ensure that our
-        # normal dequeuing process will handle them.  We keep count in
-        # _bak_count in the metadata of the number of times we recover this
-        # file.  When the count reaches MAX_BAK_COUNT, we move the .bak file
-        # to a .psv file in the bad queue.
-        for filebase in self.get_files('.bak'):
-            src = os.path.join(self.queue_directory, filebase + '.bak')
-            dst = os.path.join(self.queue_directory, filebase + '.pck')
-            with open(src, 'rb+') as fp:
+        if self._watcher is None:
+            time.sleep(timeout)
+        else:
+            self._events.extend(self._watcher.wait(timeout))
+
+    def recover_backup_files(self, count=None):
+        """See `ISwitchboard`."""
+        # Queue files left behind by a different layout are moved into place
+        # first, so that their backups get recovered too.
+        if not self._migrated:
+            self._migrate()
+            self._migrated = True
+        if count is None:
+            self._backups = None
+            self._recover(self.get_files('.bak'))
+            return None
+        if self._backups is None:
+            # Only the files which are backups now get recovered; the files
+            # dequeued after this are backed up by their own processing.
+            self._backups = self.get_files('.bak')
+        filebases = self._backups[:count]
+        del self._backups[:count]
+        self._recover(filebases)
+        return len(self._backups)
+
+    def _recover(self, filebases):
+        """Move backup files to .pck, or preserve them.
+
+        It's impossible for both to exist at the same time, so the move is
+        enough to ensure that our normal dequeuing process will handle them.
+        We keep count in _bak_count in the metadata of the number of times we
+        recover a file.  When the count reaches MAX_BAK_COUNT, we move the
+        .bak file to a .psv file in the bad queue.
+
+        Only the metadata is read and rewritten, the message is skipped.  The
+        rewritten files are flushed to disk together, and then renamed, with
+        one flush per directory for the renames.
+        """
+        recovered = []
+        for filebase in filebases:
+            src = self._path(filebase, '.bak')
+            try:
+                fp = open(src, 'rb+')
+            except FileNotFoundError:
+                # It was recovered or preserved by someone else.
+                continue
+            with fp:
                 try:
-                    # Throw away the message object.
-                    pickle.load(fp)
+                    _skip_message(fp)
                     data_pos = fp.tell()
                     data = pickle.load(fp)
                 except Exception as error:
@@ -234,23 +1035,30 @@ class Switchboard:
                     elog.error('Unpickling .bak exception: %s\n'
                                'Preserving file: %s', error, filebase)
                     self.finish(filebase, preserve=True)
+                    continue
+                data['_bak_count'] = data.get('_bak_count', 0) + 1
+                fp.seek(data_pos)
+                if data.get('_parsemsg'):
+                    protocol = 0
                 else:
-                    data['_bak_count'] = data.get('_bak_count', 0) + 1
-                    fp.seek(data_pos)
-                    if data.get('_parsemsg'):
-                        protocol = 0
-                    else:
-                        protocol = 1
-                    pickle.dump(data, fp, protocol)
-                    fp.truncate()
-                    fp.flush()
-                    os.fsync(fp.fileno())
-                    if data['_bak_count'] >= MAX_BAK_COUNT:
-                        elog.error('.bak file max count, preserving file: %s',
-                                   filebase)
-                        self.finish(filebase, preserve=True)
-                    else:
-                        os.rename(src, dst)
+                    protocol = 1
+                pickle.dump(data, fp, protocol)
+                fp.truncate()
+            if data['_bak_count'] >= MAX_BAK_COUNT:
+                elog.error('.bak file max count, preserving file: %s',
+                           filebase)
+                self.finish(filebase, preserve=True)
+            else:
+                recovered.append(src)
+        if not recovered:
+            return
+        sync_files(recovered)
+        directories = set()
+        for src in recovered:
+            os.rename(src, src[:-4] + '.pck')
+            directories.add(os.path.dirname(src))
+        for directory in directories:
+            fsync_directory(directory)
 
 
 
@@ -269,4 +1077,6 @@ def handle_ConfigurationUpdatedEvent(event):
             substitutions = config.paths
             substitutions['name'] = name
             path = expand(conf.path, substitutions)
-            config.switchboards[name] = Switchboard(name, path)
+            config.switchboards[name] = call_name(
+                conf.switchboard, name, path, numslices=int(conf.instances),
+                qfile_format=conf.qfile_format, sliced=is_sliced(conf))
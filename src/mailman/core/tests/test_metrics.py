@@ -0,0 +1,248 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the metrics shared by Mailman's processes."""
+
+__all__ = [
+    'TestMetrics',
+    ]
+
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import threading
+
+from mailman.config import config
+from mailman.core import metrics
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+
+class TestMetrics(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        config.push('metrics', """
+        [metrics]
+        path: {0}
+        flush_interval: 1h
+        """.format(self._directory))
+        self.addCleanup(config.pop, 'metrics')
+        # This process writes its metrics, like a runner.
+        patcher = patch('mailman.core.metrics._interval', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.start()
+        self._counter = metrics.counter('test_total', 'A test counter.')
+        self._histogram = metrics.histogram(
+            'test_seconds', 'A test histogram.', buckets=(1, 10))
+        self.addCleanup(self._counter.samples.clear)
+        self.addCleanup(self._histogram.samples.clear)
+
+    def _write(self, pid, data, started=1000):
+        with open(os.path.join(self._directory, '{0}-{1}.json'.format(
+                pid, started)), 'w') as fp:
+            json.dump(data, fp)
+
+    def _own_file(self):
+        return '{0}-{1}.json'.format(
+            os.getpid(), int(metrics._started * 1000))
+
+    def test_same_metric(self):
+        # Metrics are registered once per name.
+        self.assertIs(metrics.counter('test_total', 'Help.'), self._counter)
+
+    def test_collect_own_metrics(self):
+        self._counter.inc(runner='in')
+        self._counter.inc(2, runner='in')
+        self._counter.inc(runner='out')
+        self._histogram.observe(0.5)
+        self._histogram.observe(5)
+        metrics.flush()
+        collected = metrics.collect()
+        self.assertEqual(collected['test_total']['kind'], 'counter')
+        self.assertEqual(
+            sorted(collected['test_total']['samples'],
+                   key=lambda sample: sample[0]['runner']),
+            [[dict(runner='in'), 3], [dict(runner='out'), 1]])
+        self.assertEqual(collected['test_seconds']['samples'], [
+            [{}, dict(buckets=[1, 2], sum=5.5, count=2)]])
+
+    def test_gauge(self):
+        gauge = metrics.gauge('test_interval', 'A test gauge.')
+        self.addCleanup(gauge.samples.clear)
+        gauge.set(5, runner='in')
+        gauge.set(2, runner='in')
+        metrics.flush()
+        collected = metrics.collect()
+        self.assertEqual(collected['test_interval']['kind'], 'gauge')
+        self.assertEqual(collected['test_interval']['samples'],
+                         [[dict(runner='in'), 2]])
+
+    def test_collect_adds_up_processes(self):
+        # The metrics of all the processes are added up.
+        self._counter.inc(runner='in')
+        metrics.flush()
+        sample = dict(kind='counter', help='A test counter.',
+                      samples=[[dict(runner='in'), 5]])
+        self._write(1, dict(test_total=sample))
+        collected = metrics.collect()
+        self.assertEqual(collected['test_total']['samples'],
+                         [[dict(runner='in'), 6]])
+
+    def test_retire(self):
+        # The metrics of processes which are gone are kept in the retired
+        # totals.
+        sample = dict(kind='counter', help='A test counter.',
+                      samples=[[dict(runner='in'), 5]])
+        self._write(1, dict(test_total=sample))
+        self._write(2, dict(test_total=sample))
+        metrics.retire(1)
+        with patch('mailman.core.metrics._alive', return_value=False):
+            metrics.retire()
+        self.assertEqual(os.listdir(self._directory), ['retired.json'])
+        collected = metrics.collect()
+        self.assertEqual(collected['test_total']['samples'],
+                         [[dict(runner='in'), 10]])
+
+    def test_collect_while_retiring(self):
+        # A file being retired is counted either on its own or in the retired
+        # totals, never both.
+        sample = dict(kind='counter', help='A test counter.',
+                      samples=[[dict(runner='in'), 5]])
+        self._write(1, dict(test_total=sample))
+        collected = []
+        collector = threading.Thread(
+            target=lambda: collected.append(metrics.collect()))
+        unlink = os.unlink
+        def collect_then_unlink(path):
+            # The retired totals are written, but the file is still there.
+            if path.endswith('.json'):
+                collector.start()
+                collector.join(1)
+            unlink(path)
+        with patch('mailman.core.metrics.os.unlink', collect_then_unlink):
+            metrics.retire(1)
+        collector.join()
+        self.assertEqual(collected[0]['test_total']['samples'],
+                         [[dict(runner='in'), 5]])
+
+    def test_retire_drops_gauges(self):
+        # The gauges of processes which are gone are not kept.
+        gauge = dict(kind='gauge', help='A test gauge.',
+                     samples=[[dict(runner='in'), 5]])
+        counter = dict(kind='counter', help='A test counter.',
+                       samples=[[dict(runner='in'), 5]])
+        self._write(1, dict(test_interval=gauge, test_total=counter))
+        self._write(2, dict(test_interval=gauge))
+        metrics.retire(1)
+        metrics.retire(2)
+        self.assertEqual(os.listdir(self._directory), ['retired.json'])
+        self.assertEqual(sorted(metrics.collect()), ['test_total'])
+
+    def test_retire_skips_live_processes(self):
+        self._counter.inc()
+        metrics.flush()
+        metrics.retire()
+        self.assertEqual(os.listdir(self._directory), [self._own_file()])
+
+    def test_reused_pid(self):
+        # A process which reuses the id of a process which is gone doesn't
+        # overwrite its file.
+        sample = dict(kind='counter', help='A test counter.',
+                      samples=[[dict(runner='in'), 5]])
+        self._write(os.getpid(), dict(test_total=sample))
+        self._counter.inc(runner='in')
+        metrics.flush()
+        collected = metrics.collect()
+        self.assertEqual(collected['test_total']['samples'],
+                         [[dict(runner='in'), 6]])
+        # Both are retired when the process is gone.
+        metrics.retire(os.getpid())
+        self.assertEqual(os.listdir(self._directory), ['retired.json'])
+
+    def test_not_started(self):
+        # Processes which haven't started writing their metrics, such as
+        # command line scripts, only keep them in memory.
+        with patch('mailman.core.metrics._interval', None):
+            self._counter.inc()
+            metrics.flush()
+        self.assertEqual(os.listdir(self._directory), [])
+
+    def test_flush_interval(self):
+        # The metrics are written once the flush interval has passed since
+        # they were started or last written, and the interval is only read
+        # again when the configuration changes.
+        with patch('mailman.core.metrics.as_timedelta',
+                   side_effect=AssertionError):
+            self._counter.inc()
+        self.assertEqual(os.listdir(self._directory), [])
+        config.push('interval', """
+        [metrics]
+        flush_interval: 0s
+        """)
+        self.addCleanup(config.pop, 'interval')
+        self._counter.inc()
+        self.assertEqual(os.listdir(self._directory), [self._own_file()])
+
+    def test_forked_child(self):
+        # A forked child starts counting from scratch.
+        self._counter.inc(runner='in')
+        with patch('mailman.core.metrics._pid', -1):
+            self._counter.inc(runner='out')
+            self.assertEqual(list(self._counter.samples),
+                             [(('runner', 'out'),)])
+
+    def test_disabled(self):
+        self._counter.inc()
+        config.push('disabled', """
+        [metrics]
+        enabled: no
+        """)
+        try:
+            metrics.flush()
+        finally:
+            config.pop('disabled')
+        self.assertEqual(os.listdir(self._directory), [])
+
+    def test_render(self):
+        collected = dict(
+            test_total=dict(kind='counter', help='A test counter.',
+                            samples=[[dict(code=550), 2]]),
+            test_seconds=dict(kind='histogram', help='A test histogram.',
+                              buckets=[1, 10],
+                              samples=[[{}, dict(buckets=[1, 2], sum=5.5,
+                                                 count=3)]]),
+            )
+        self.assertEqual(metrics.render(collected), """\
+# HELP test_seconds A test histogram.
+# TYPE test_seconds histogram
+test_seconds_bucket{le="1"} 1
+test_seconds_bucket{le="10"} 2
+test_seconds_bucket{le="+Inf"} 3
+test_seconds_sum 5.5
+test_seconds_count 3
+# HELP test_total A test counter.
+# TYPE test_total counter
+test_total{code="550"} 2
+""")
@@ -22,12 +22,24 @@ __all__ = [
     ]
 
 
+import os
+import json
+import pstats
+import signal
 import unittest
+import threading
 
+from contextlib import ExitStack
+from unittest.mock import Mock, patch
 from mailman.app.lifecycle import create_list
 from mailman.config import config
-from mailman.core.runner import Runner
+from mailman.core import metrics
+from mailman.core.i18n import _
+from mailman.core.runner import (
+    Runner, messages_processed, messages_shunted, processing_time)
+from mailman.core.switchboard import scale_file
 from mailman.interfaces.runner import RunnerCrashEvent
+from mailman.runners.outgoing import OutgoingRunner
 from mailman.runners.virgin import VirginRunner
 from mailman.testing.helpers import (
     LogFileMark, configuration, event_subscribers, get_queue_messages,
@@ -42,6 +54,36 @@ class CrashingRunner(Runner):
         raise RuntimeError('borked')
 
 
+class EnqueuingRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        config.switchboards['out'].enqueue(msg, msgdata)
+        config.switchboards['virgin'].enqueue(msg, msgdata)
+        if msgdata.get('crash'):
+            raise RuntimeError('borked')
+
+
+class CountingRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        mlist.post_id += 1
+        config.switchboards['out'].enqueue(msg, msgdata)
+        if msgdata.get('crash'):
+            raise RuntimeError('borked')
+
+
+class RendezvousRunner(Runner):
+    # Every message must be disposed of while another one is, or the
+    # barrier breaks.
+    barrier = None
+    languages = []
+
+    def _dispose(self, mlist, msg, msgdata):
+        self.barrier.wait()
+        self.languages.append((msgdata['lang'], _.code))
+        config.switchboards['out'].enqueue(msg, msgdata)
+        if msgdata.get('crash'):
+            raise RuntimeError('borked')
+
+
 
 class TestRunner(unittest.TestCase):
     """Test the Runner base class behavior."""
@@ -120,3 +162,438 @@ Message-ID: <ant>
         # The list's -request address is the original sender.
         self.assertEqual(bag.msgdata['original_sender'],
                          'test-request@example.com')
+
+    def test_group_commit(self):
+        # With group commits enabled, everything the runner enqueues while
+        # processing a message is published before the message is finished.
+        runner = make_testable_runner(EnqueuingRunner, 'in')
+        runner.group_commit = True
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['in'].enqueue(msg, listid='test.example.com')
+        runner.run()
+        self.assertEqual(len(get_queue_messages('in')), 0)
+        self.assertEqual(len(get_queue_messages('out')), 1)
+        self.assertEqual(len(get_queue_messages('virgin')), 1)
+        self.assertEqual(len(get_queue_messages('shunt')), 0)
+
+    def test_group_commit_discarded_on_crash(self):
+        # With group commits enabled, nothing the runner enqueued while
+        # processing a message survives a crash; only the shunted original
+        # message is left.
+        runner = make_testable_runner(EnqueuingRunner, 'in')
+        runner.group_commit = True
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['in'].enqueue(
+            msg, listid='test.example.com', crash=True)
+        runner.run()
+        self.assertEqual(len(get_queue_messages('out')), 0)
+        self.assertEqual(len(get_queue_messages('virgin')), 0)
+        self.assertEqual(len(get_queue_messages('shunt')), 1)
+
+    def _enqueue_batch(self, crash_index=None):
+        for index in range(3):
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{0}>
+
+""".format(index))
+            config.switchboards['in'].enqueue(
+                msg, listid='test.example.com', crash=(index == crash_index))
+
+    def test_batch(self):
+        # With batches, the runner commits once for all the queue files.
+        self._mlist.post_id = 1
+        config.db.commit()
+        runner = make_testable_runner(CountingRunner, 'in')
+        runner.batch_size = 10
+        self._enqueue_batch()
+        with patch.object(config.db, 'commit',
+                          wraps=config.db.commit) as commit:
+            runner.run()
+        self.assertEqual(commit.call_count, 1)
+        self.assertEqual(self._mlist.post_id, 4)
+        self.assertEqual(len(get_queue_messages('in')), 0)
+        self.assertEqual(len(get_queue_messages('out')), 3)
+
+    def test_files_per_pass(self):
+        # A pass over the queue only takes the oldest files.
+        runner = make_testable_runner(CountingRunner, 'in')
+        self._enqueue_batch()
+        with patch('mailman.core.runner.FILES_PER_PASS', 2):
+            self.assertEqual(runner._one_iteration(), 2)
+            self.assertEqual(runner._one_iteration(), 1)
+        self.assertEqual(len(get_queue_messages('out')), 3)
+
+    def test_batch_size(self):
+        # A batch is committed when it is full.
+        runner = make_testable_runner(CountingRunner, 'in')
+        runner.batch_size = 2
+        self._enqueue_batch()
+        with patch.object(config.db, 'commit',
+                          wraps=config.db.commit) as commit:
+            runner.run()
+        self.assertEqual(commit.call_count, 2)
+        self.assertEqual(len(get_queue_messages('out')), 3)
+
+    def test_batch_falls_back_on_crash(self):
+        # When a file in a batch crashes, the batch is rolled back and its
+        # files are processed one at a time, so only the bad one is shunted
+        # and the others are processed exactly once.  With group commits,
+        # the bad file doesn't leave anything behind either.
+        self._mlist.post_id = 1
+        config.db.commit()
+        runner = make_testable_runner(CountingRunner, 'in')
+        runner.batch_size = 10
+        runner.group_commit = True
+        self._enqueue_batch(crash_index=1)
+        mark = LogFileMark('mailman.error')
+        runner.run()
+        self.assertIn('falling back to one file at a time', mark.read())
+        self.assertEqual(self._mlist.post_id, 3)
+        self.assertEqual(len(get_queue_messages('in')), 0)
+        self.assertEqual(config.switchboards['in'].get_files('.bak'), [])
+        messages = get_queue_messages('out', sort_on='message-id')
+        self.assertEqual([message.msg['message-id'] for message in messages],
+                         ['<ant0>', '<ant2>'])
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<ant1>')
+
+    def test_batch_commit_fails(self):
+        # When the transaction of a batch can't be committed, the files it
+        # enqueued are not written, so they aren't enqueued twice when the
+        # batch is processed again one file at a time.
+        config.db.commit()
+        runner = make_testable_runner(CountingRunner, 'in')
+        runner.batch_size = 10
+        runner.group_commit = True
+        self._enqueue_batch()
+        commit = config.db.commit
+        failures = [RuntimeError('borked')]
+        def fail_once():
+            if failures:
+                raise failures.pop()
+            commit()
+        with patch.object(config.db, 'commit', side_effect=fail_once):
+            runner.run()
+        messages = get_queue_messages('out', sort_on='message-id')
+        self.assertEqual([message.msg['message-id'] for message in messages],
+                         ['<ant0>', '<ant1>', '<ant2>'])
+
+    def test_no_batches_with_side_effects(self):
+        # Runners whose work can't be rolled back, such as delivering a
+        # message over SMTP, always process one file at a time.
+        config.push('batch', """
+        [runner.out]
+        batch_size: 10
+        """)
+        self.addCleanup(config.pop, 'batch')
+        mark = LogFileMark('mailman.error')
+        runner = make_testable_runner(OutgoingRunner, 'out')
+        self.assertEqual(runner.batch_size, 1)
+        self.assertIn('cannot process files in batches', mark.read())
+
+    def test_recovery_in_batches(self):
+        # Backup files left behind by a crash are recovered a batch at a
+        # time, and new messages are processed in between.
+        switchboard = config.switchboards['in']
+        self._enqueue_batch()
+        for filebase in switchboard.files:
+            switchboard.dequeue(filebase)
+        switchboard.enqueue(mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <bee>
+
+"""), listid='test.example.com')
+        runner = make_testable_runner(CountingRunner, 'in')
+        with patch('mailman.core.runner.RECOVERY_BATCH_SIZE', 2):
+            runner.run()
+        self.assertEqual(switchboard.get_files('.bak'), [])
+        messages = get_queue_messages('out')
+        self.assertEqual([message.msg['message-id'] for message in messages],
+                         ['<ant0>', '<ant1>', '<bee>', '<ant2>'])
+
+    def test_workers(self):
+        # With workers, queue files are processed concurrently, and each
+        # file is finished or shunted on its own.
+        runner = make_testable_runner(RendezvousRunner, 'in')
+        runner.workers = 2
+        RendezvousRunner.barrier = threading.Barrier(2, timeout=10)
+        del RendezvousRunner.languages[:]
+        self._mlist.preferred_language = 'fr'
+        create_list('other@example.com').preferred_language = 'en'
+        config.db.commit()
+        for index in range(4):
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{0}>
+
+""".format(index))
+            listid = ('test.example.com' if index % 2 == 0
+                      else 'other.example.com')
+            config.switchboards['in'].enqueue(
+                msg, listid=listid, crash=(index == 2))
+        runner.run()
+        self.assertFalse(RendezvousRunner.barrier.broken)
+        # Each worker had the language context of its own message, even
+        # though the messages were processed at the same time.
+        self.assertEqual(len(RendezvousRunner.languages), 4)
+        for language, context in RendezvousRunner.languages:
+            self.assertEqual(language, context)
+        self.assertEqual(len(get_queue_messages('in')), 0)
+        self.assertEqual(config.switchboards['in'].get_files('.bak'), [])
+        self.assertEqual(len(get_queue_messages('out')), 4)
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<ant2>')
+
+    @configuration('runner.in', sleep_time='1s', max_sleep_time='5s')
+    def test_backoff(self):
+        # An idle runner sleeps longer and longer, up to max_sleep_time, and
+        # goes back to sleep_time as soon as it finds work.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        intervals = [runner._backoff(0) for i in range(5)]
+        self.assertEqual(intervals, [1, 2, 4, 5, 5])
+        self.assertEqual(runner.poll_interval, 5)
+        self.assertEqual(runner._backoff(3), 1)
+        self.assertEqual(runner.poll_interval, 1)
+        self.assertEqual(runner._backoff(0), 1)
+        self.assertEqual(runner._backoff(0), 2)
+
+    @configuration('runner.in', sleep_time='1s', max_sleep_time='5s')
+    def test_no_sleep_while_busy(self):
+        # The runner doesn't sleep while there is work to do, however long it
+        # has been idle before.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        with patch.object(runner.switchboard, 'wait') as wait:
+            for i in range(3):
+                runner._snooze(0)
+            self.assertEqual([call[0][0] for call in wait.call_args_list],
+                             [1, 2, 4])
+            wait.reset_mock()
+            runner._snooze(1)
+            self.assertFalse(wait.called)
+            runner._snooze(0)
+            wait.assert_called_once_with(1)
+
+    @configuration('runner.in', sleep_time='1s')
+    def test_default_backoff(self):
+        # By default, an idle runner backs off to sleeping for 10 seconds.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        intervals = [runner._backoff(0) for i in range(6)]
+        self.assertEqual(intervals, [1, 2, 4, 8, 10, 10])
+
+    @configuration('runner.in', sleep_time='1s', max_sleep_time='1s')
+    def test_fixed_interval(self):
+        # With max_sleep_time no longer than sleep_time, the runner always
+        # sleeps for sleep_time.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        intervals = set(runner._backoff(0) for i in range(5))
+        self.assertEqual(intervals, {1})
+
+    @configuration('runner.in', sleep_time='1s', max_sleep_time='5s')
+    def test_poll_interval_metric(self):
+        # The current poll interval of each runner is a metric.
+        samples = metrics.gauge(
+            'mailman_runner_poll_interval_seconds', '').samples
+        runner = make_testable_runner(CrashingRunner, 'in')
+        key = (('runner', 'in'), ('slice', 0))
+        self.addCleanup(samples.pop, key, None)
+        self.assertEqual(samples[key], 1)
+        for i in range(3):
+            runner._backoff(0)
+        self.assertEqual(samples[key], 4)
+        runner._backoff(1)
+        self.assertEqual(samples[key], 1)
+
+    @configuration('runner.in', profile_count=2)
+    def test_profile(self):
+        # SIGUSR2 starts profiling, and the profile is dumped once
+        # profile_count files have been profiled.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        runner._process_one_file = Mock()
+        runner.signal_handler(signal.SIGUSR2, None)
+        msg = mfs('Message-ID: <ant>\n\n')
+        for index in range(3):
+            config.switchboards['in'].enqueue(msg, listid='ant')
+        runner.run()
+        self.assertEqual(runner._process_one_file.call_count, 3)
+        path = runner.profile_path
+        self.addCleanup(os.remove, path)
+        self.assertEqual(
+            path, os.path.join(config.LOG_DIR, 'profiles',
+                               'in-0-{0}.prof'.format(os.getpid())))
+        self.assertEqual(runner._profiled_files, 2)
+        self.assertIsNone(runner._profile)
+        # The dump is a regular profile.
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_profile_stopped_by_signal(self):
+        # A second SIGUSR2 stops profiling and dumps the profile.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        runner.signal_handler(signal.SIGUSR2, None)
+        runner._check_profile()
+        self.assertIsNotNone(runner._profile)
+        self.assertEqual(runner._profiled(len, 'ant'), 3)
+        runner.signal_handler(signal.SIGUSR2, None)
+        runner._check_profile()
+        self.addCleanup(os.remove, runner.profile_path)
+        self.assertIsNone(runner._profile)
+        self.assertEqual(runner._profiled_files, 1)
+        self.assertTrue(os.path.exists(runner.profile_path))
+
+    def test_profile_dumped_on_exit(self):
+        # The profile is dumped when the runner exits while profiling.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        runner._process_one_file = Mock()
+        runner.signal_handler(signal.SIGUSR2, None)
+        msg = mfs('Message-ID: <ant>\n\n')
+        config.switchboards['in'].enqueue(msg, listid='ant')
+        runner.run()
+        self.addCleanup(os.remove, runner.profile_path)
+        self.assertIsNone(runner._profile)
+        self.assertEqual(runner._profiled_files, 1)
+
+    def test_reload(self):
+        # SIGHUP makes the runner reload the configuration once it's done
+        # with the files it's processing.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        with ExitStack() as resources:
+            reload = resources.enter_context(patch.object(config, 'reload'))
+            resources.enter_context(patch('mailman.core.runner.reconfigure'))
+            resources.enter_context(configuration('runner.in', batch_size=7))
+            runner.signal_handler(signal.SIGHUP, None)
+            self.assertEqual(reload.call_count, 0)
+            self.assertEqual(runner.batch_size, 1)
+            runner._check_signals()
+            self.assertEqual(reload.call_count, 1)
+            self.assertEqual(runner.batch_size, 7)
+            # The configuration is reloaded only once per signal.
+            runner._check_signals()
+            self.assertEqual(reload.call_count, 1)
+
+    def test_reload_after_commit(self):
+        # The configuration is only reloaded once the transaction of the
+        # file being processed is committed.
+        runner = make_testable_runner(CountingRunner, 'in')
+        calls = []
+        commit = config.db.commit
+        def record_commit():
+            calls.append('commit')
+            commit()
+        with ExitStack() as resources:
+            resources.enter_context(patch.object(
+                config, 'reload', side_effect=lambda: calls.append('reload')))
+            resources.enter_context(patch('mailman.core.runner.reconfigure'))
+            resources.enter_context(patch.object(
+                config.db, 'commit', side_effect=record_commit))
+            self._enqueue_batch()
+            runner.signal_handler(signal.SIGHUP, None)
+            runner._one_iteration()
+        self.assertEqual(calls, ['commit', 'reload', 'commit', 'commit'])
+
+    def test_reload_failure(self):
+        # When the configuration cannot be reloaded, the runner carries on
+        # with the old one.
+        runner = make_testable_runner(CrashingRunner, 'in')
+        mark = LogFileMark('mailman.error')
+        with ExitStack() as resources:
+            resources.enter_context(patch.object(
+                config, 'reload', side_effect=ValueError('borked')))
+            reconfigure = resources.enter_context(
+                patch('mailman.core.runner.reconfigure'))
+            resources.enter_context(configuration('runner.in', batch_size=7))
+            runner.signal_handler(signal.SIGHUP, None)
+            runner._check_signals()
+        self.assertEqual(reconfigure.call_count, 0)
+        self.assertEqual(runner.batch_size, 1)
+        self.assertIn('in runner cannot reload the configuration',
+                      mark.read())
+
+    @configuration('runner.in', instances=2, max_instances=4)
+    def test_rescale(self):
+        # When the master rescales an autoscaled runner, its instances take
+        # up their new slices of the queue on SIGHUP, and acknowledge them.
+        runner = CountingRunner('in', 1)
+        path = scale_file(runner.queue_directory)
+        acknowledgment = scale_file(runner.queue_directory, os.getpid())
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.remove, acknowledgment)
+        def buckets():
+            return [int(os.path.basename(directory), 16)
+                    for directory in runner.switchboard._directories]
+        self.assertEqual(buckets(), list(range(8, 16)))
+        with open(path, 'w') as fp:
+            fp.write('4')
+        with ExitStack() as resources:
+            resources.enter_context(patch.object(config, 'reload'))
+            resources.enter_context(patch('mailman.core.runner.reconfigure'))
+            runner.signal_handler(signal.SIGHUP, None)
+            runner._check_signals()
+            self.assertEqual((runner.slice, runner.numslices), (2, 4))
+            self.assertEqual(buckets(), list(range(8, 12)))
+            with open(acknowledgment) as fp:
+                self.assertEqual(fp.read(), '4')
+            # Scaling down, the instance takes over the slice of the one the
+            # master stopped.
+            with open(path, 'w') as fp:
+                fp.write('2')
+            runner.signal_handler(signal.SIGHUP, None)
+            runner._check_signals()
+            self.assertEqual((runner.slice, runner.numslices), (1, 2))
+            self.assertEqual(buckets(), list(range(8, 16)))
+            with open(acknowledgment) as fp:
+                self.assertEqual(fp.read(), '2')
+
+    @configuration('mailman', stage_timing='yes')
+    def test_stage_timing(self):
+        # With stage timing, the runner records when it was done with the
+        # message, and logs the message's latencies.
+        runner = make_testable_runner(EnqueuingRunner, 'in')
+        msg = mfs('Message-ID: <ant>\n\n')
+        config.switchboards['in'].enqueue(msg, listid='test.example.com')
+        mark = LogFileMark('mailman.timing')
+        runner.run()
+        record = json.loads(mark.readline())
+        self.assertEqual(record['runner'], 'in')
+        self.assertEqual(record['queue'], 'in')
+        self.assertEqual(record['listid'], 'test.example.com')
+        self.assertEqual(record['message_id'], '<ant>')
+        self.assertGreaterEqual(record['wait'], 0)
+        self.assertGreaterEqual(record['processing'], 0)
+        self.assertAlmostEqual(record['total'],
+                               record['wait'] + record['processing'])
+        # The next queue's stage is recorded after this one's.
+        items = get_queue_messages('out')
+        self.assertEqual(
+            [stage['queue'] for stage in items[0].msgdata['stage_times']],
+            ['in', 'out'])
+
+    def test_metrics(self):
+        # Runners count the files they process and the messages they shunt.
+        runner = make_testable_runner(EnqueuingRunner, 'in')
+        key = (('runner', 'in'),)
+        processed = messages_processed.samples.get(key, 0)
+        shunted = messages_shunted.samples.get(key, 0)
+        observed = processing_time.samples.get(key, dict(count=0))['count']
+        msg = mfs('Message-ID: <ant>\n\n')
+        config.switchboards['in'].enqueue(msg, listid='test.example.com')
+        config.switchboards['in'].enqueue(
+            msg, listid='test.example.com', crash=True)
+        runner.run()
+        self.assertEqual(messages_processed.samples[key], processed + 1)
+        self.assertEqual(messages_shunted.samples[key], shunted + 1)
+        self.assertEqual(processing_time.samples[key]['count'], observed + 2)
@@ -0,0 +1,213 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the SQLite switchboard."""
+
+__all__ = [
+    'TestSQLiteSwitchboard',
+    ]
+
+
+import os
+import shutil
+import pickle
+import tempfile
+import unittest
+
+from mailman.config import config
+from mailman.core.sqlitequeue import SQLiteSwitchboard
+from mailman.core.switchboard import Switchboard, group_commit
+from mailman.interfaces.switchboard import ISwitchboard
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+from zope.interface.verify import verifyObject
+
+
+
+class TestSQLiteSwitchboard(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._queue_directory = tempfile.mkdtemp(dir=config.QUEUE_DIR)
+        self.addCleanup(shutil.rmtree, self._queue_directory)
+        self._switchboard = SQLiteSwitchboard('test', self._queue_directory)
+
+    def test_verify_interface(self):
+        self.assertTrue(verifyObject(ISwitchboard, self._switchboard))
+
+    def test_enqueue_dequeue(self):
+        # A message and its metadata survive the round trip, minus the
+        # volatile metadata.
+        filebase = self._switchboard.enqueue(
+            self._msg, listid='test.example.com', _volatile=True)
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, data = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(data['listid'], 'test.example.com')
+        self.assertNotIn('_volatile', data)
+        # The entry is leased until it is finished.
+        self.assertEqual(self._switchboard.files, [])
+        self.assertEqual(self._switchboard.get_files('.bak'), [filebase])
+        self._switchboard.finish(filebase)
+        self.assertEqual(self._switchboard.get_files('.bak'), [])
+
+    def test_plaintext(self):
+        filebase = self._switchboard.enqueue(
+            self._msg.as_string(), _plaintext=True)
+        msg, data = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(data['original_size'], len(self._msg.as_string()))
+
+    def test_fifo_order(self):
+        filebases = [self._switchboard.enqueue(self._msg) for i in range(5)]
+        self.assertEqual(self._switchboard.files, filebases)
+
+    def test_oldest_files(self):
+        filebases = [self._switchboard.enqueue(self._msg) for i in range(5)]
+        self.assertEqual(self._switchboard.get_files(count=2), filebases[:2])
+
+    @configuration('priorities', weight='1h')
+    def test_age(self):
+        # The age of the queue is how long its oldest entry has been waiting,
+        # whatever the entries' priorities.
+        self.assertEqual(self._switchboard.get_age(), 0)
+        self._switchboard.configure()
+        with patch('mailman.core.sqlitequeue.time.time', return_value=1000):
+            self._switchboard.enqueue(self._msg, priority=2)
+        with patch('mailman.core.sqlitequeue.time.time', return_value=1100):
+            self.assertEqual(self._switchboard.get_age(), 100)
+
+    def test_dequeue_missing_entry(self):
+        self.assertRaises(FileNotFoundError,
+                          self._switchboard.dequeue, '1+abcdef')
+
+    def test_slices(self):
+        # Every entry is seen by exactly one of the slices.
+        filebases = [self._switchboard.enqueue(self._msg) for i in range(20)]
+        seen = []
+        for slice in range(4):
+            switchboard = SQLiteSwitchboard(
+                'test', self._queue_directory, slice, 4)
+            seen.extend(switchboard.files)
+        self.assertEqual(sorted(seen), sorted(filebases))
+
+    def test_recover_leased_entries(self):
+        # Entries which were dequeued but never finished are returned to the
+        # queue when a switchboard recovers, until they have been recovered
+        # too many times.  Then they are preserved in the bad queue.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        for count in range(1, 3):
+            switchboard = SQLiteSwitchboard(
+                'test', self._queue_directory, recover=True)
+            self.assertEqual(switchboard.files, [filebase])
+            msg, data = self._switchboard.dequeue(filebase)
+            self.assertEqual(data['_bak_count'], count)
+        switchboard = SQLiteSwitchboard(
+            'test', self._queue_directory, recover=True)
+        self.assertEqual(switchboard.files, [])
+        self.assertEqual(switchboard.get_files('.bak'), [])
+        bad = config.switchboards['bad']
+        self.assertEqual(bad.get_files('.psv'), [filebase])
+        os.remove(os.path.join(bad.queue_directory, filebase + '.psv'))
+
+    def test_recover_in_batches(self):
+        # Leased entries can be recovered a batch at a time.
+        filebases = [self._switchboard.enqueue(self._msg) for i in range(3)]
+        for filebase in filebases:
+            self._switchboard.dequeue(filebase)
+        switchboard = SQLiteSwitchboard('test', self._queue_directory)
+        self.assertEqual(switchboard.recover_backup_files(2), 1)
+        self.assertEqual(switchboard.files, filebases[:2])
+        self.assertEqual(switchboard.recover_backup_files(2), 0)
+        self.assertEqual(switchboard.files, filebases)
+        self.assertEqual(switchboard.get_files('.bak'), [])
+
+    def test_restore(self):
+        # A leased entry can be returned to the queue unchanged.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self._switchboard.restore(filebase)
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, data = self._switchboard.dequeue(filebase)
+        self.assertNotIn('_bak_count', data)
+        self._switchboard.finish(filebase)
+        self.assertRaises(FileNotFoundError,
+                          self._switchboard.restore, filebase)
+
+    def test_finish_preserve(self):
+        # Preserved entries are written to the bad queue as .psv files in the
+        # same format as the file based switchboard's.
+        filebase = self._switchboard.enqueue(self._msg, listid='ant')
+        self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase, preserve=True)
+        self.assertEqual(self._switchboard.get_files('.bak'), [])
+        bad = config.switchboards['bad']
+        psvfile = os.path.join(bad.queue_directory, filebase + '.psv')
+        with open(psvfile, 'rb') as fp:
+            msg = pickle.load(fp)
+            data = pickle.load(fp)
+        os.remove(psvfile)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(data['listid'], 'ant')
+
+    def test_group_commit(self):
+        # Entries enqueued in a group commit are committed together, or not
+        # at all.
+        with group_commit():
+            first = self._switchboard.enqueue(self._msg)
+            second = self._switchboard.enqueue(self._msg)
+            reader = SQLiteSwitchboard('test', self._queue_directory)
+            self.assertEqual(reader.files, [])
+        self.assertEqual(reader.files, [first, second])
+        with self.assertRaises(RuntimeError):
+            with group_commit():
+                self._switchboard.enqueue(self._msg)
+                raise RuntimeError
+        self.assertEqual(reader.files, [first, second])
+
+    def test_migrate_queue_files(self):
+        # Queue files left behind by the file based switchboard are moved
+        # into the database when the switchboard recovers.
+        files = Switchboard('test', self._queue_directory)
+        queued = files.enqueue(self._msg)
+        leased = files.enqueue(self._msg)
+        files.dequeue(leased)
+        switchboard = SQLiteSwitchboard(
+            'test', self._queue_directory, recover=True)
+        self.assertEqual(switchboard.files, [queued, leased])
+        self.assertEqual(
+            [name for name in os.listdir(self._queue_directory)
+             if name.endswith(('.pck', '.bak'))], [])
+        msg, data = switchboard.dequeue(leased)
+        self.assertEqual(data['_bak_count'], 1)
+
+    @configuration('runner.virgin',
+                   switchboard='mailman.core.sqlitequeue.SQLiteSwitchboard')
+    def test_selected_by_configuration(self):
+        # The switchboard class is selected per queue.
+        self.assertIsInstance(config.switchboards['virgin'],
+                              SQLiteSwitchboard)
+        self.assertIsInstance(config.switchboards['in'], Switchboard)
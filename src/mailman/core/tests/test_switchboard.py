@@ -22,19 +22,45 @@ __all__ = [
     ]
 
 
+import os
+import time
+import shutil
+import tempfile
 import unittest
+import threading
 
 from mailman.config import config
+from mailman.core.switchboard import Switchboard, group_commit
+from mailman.email.message import LazyMessage
 from mailman.testing.helpers import (
-    LogFileMark,
+    LogFileMark, configuration,
     specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.inotify import DirectoryWatcher
 from unittest.mock import patch
 
 
+def _inotify_available():
+    try:
+        DirectoryWatcher([config.QUEUE_DIR]).close()
+    except OSError:
+        return False
+    return True
+
+
 class TestSwitchboard(unittest.TestCase):
     layer = ConfigLayer
 
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._queue_directory = tempfile.mkdtemp(dir=config.QUEUE_DIR)
+        self.addCleanup(shutil.rmtree, self._queue_directory)
+
     def test_log_exception_in_finish(self):
         # If something bad happens in .finish(), the traceback should get
         # logged.  LP: #1165589.
@@ -56,3 +82,501 @@ Message-ID: <ant>
         traceback = error_log.read().splitlines()
         self.assertEqual(traceback[1], 'Traceback (most recent call last):')
         self.assertEqual(traceback[-1], 'OSError: Oops!')
+
+    def test_wait_sleeps_when_polling(self):
+        # Without notifications, .wait() just sleeps for the full timeout.
+        switchboard = Switchboard('test', self._queue_directory)
+        with patch('mailman.core.switchboard.time.sleep') as sleep:
+            switchboard.wait(7)
+        sleep.assert_called_once_with(7)
+
+    def test_wait_wakes_up_on_enqueue(self):
+        # With notifications, .wait() returns as soon as a file gets enqueued
+        # into the queue, even by some other process.
+        if not _inotify_available():
+            self.skipTest('inotify is not available')
+        switchboard = Switchboard('test', self._queue_directory, notify=True)
+        producer = Switchboard('test', self._queue_directory)
+        timer = threading.Timer(0.1, producer.enqueue, (self._msg,))
+        start = time.time()
+        timer.start()
+        try:
+            switchboard.wait(30)
+        finally:
+            timer.join()
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(len(switchboard.files), 1)
+
+    def test_files_in_fifo_order(self):
+        switchboard = Switchboard('test', self._queue_directory)
+        filebases = [switchboard.enqueue(self._msg) for i in range(5)]
+        self.assertEqual(switchboard.files, filebases)
+
+    def test_oldest_files(self):
+        # Only the oldest files are taken from the index, and the entries of
+        # files which have left the queue are dropped on the way.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebases = [switchboard.enqueue(self._msg) for i in range(5)]
+        switchboard.dequeue(filebases[0])
+        switchboard.finish(filebases[0])
+        with patch('mailman.core.switchboard.sorted',
+                   side_effect=AssertionError, create=True):
+            self.assertEqual(switchboard.get_files(count=2), filebases[1:3])
+        self.assertEqual(len(switchboard._index._heap), 4)
+        self.assertEqual(switchboard.files, filebases[1:])
+
+    def test_index_tracks_external_changes(self):
+        # The index of queue files follows changes made by other processes.
+        switchboard = Switchboard('test', self._queue_directory)
+        producer = Switchboard('test', self._queue_directory)
+        filebase_1 = producer.enqueue(self._msg)
+        filebase_2 = producer.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [filebase_1, filebase_2])
+        os.remove(os.path.join(self._queue_directory, filebase_1 + '.pck'))
+        filebase_3 = producer.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [filebase_2, filebase_3])
+
+    def test_recovered_files_are_not_duplicated(self):
+        # A dequeued file which gets recovered from its backup shows up in
+        # the index exactly once.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [filebase])
+        switchboard.dequeue(filebase)
+        self.assertEqual(switchboard.files, [])
+        switchboard.recover_backup_files()
+        self.assertEqual(switchboard.files, [filebase])
+
+    def test_dequeue_missing_file(self):
+        # Trying to dequeue a file which some other process has removed
+        # drops it from the index.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [filebase])
+        os.remove(os.path.join(self._queue_directory, filebase + '.pck'))
+        self.assertRaises(FileNotFoundError, switchboard.dequeue, filebase)
+        self.assertEqual(switchboard.files, [])
+
+    def test_notified_index_does_not_list_directory(self):
+        # With notifications, the index is updated from the events and the
+        # queue directory only needs to be listed once.
+        if not _inotify_available():
+            self.skipTest('inotify is not available')
+        switchboard = Switchboard('test', self._queue_directory, notify=True)
+        producer = Switchboard('test', self._queue_directory)
+        filebase_1 = producer.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [filebase_1])
+        filebase_2 = producer.enqueue(self._msg)
+        with patch('mailman.core.switchboard.os.listdir',
+                   side_effect=AssertionError('listed')):
+            self.assertEqual(switchboard.files, [filebase_1, filebase_2])
+            switchboard.dequeue(filebase_1)
+            self.assertEqual(switchboard.files, [filebase_2])
+
+    def test_sliced_queue_uses_subdirectories(self):
+        # When a queue is split into slices, the files are spread over
+        # subdirectories and each slice gets a disjoint subset of them.
+        producer = Switchboard('test', self._queue_directory, numslices=4)
+        filebases = set(producer.enqueue(self._msg) for i in range(32))
+        for filebase in filebases:
+            digest = filebase.split('+', 1)[1]
+            path = os.path.join(
+                self._queue_directory, digest[0], filebase + '.pck')
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(set(producer.files), filebases)
+        seen = set()
+        for slice_number in range(4):
+            switchboard = Switchboard(
+                'test', self._queue_directory, slice_number, 4)
+            files = set(switchboard.files)
+            self.assertEqual(files & seen, set())
+            seen |= files
+            # Each slice owns 4 of the 16 subdirectories.
+            for filebase in files:
+                digest = filebase.split('+', 1)[1]
+                self.assertEqual(int(digest[0], 16) // 4, slice_number)
+        self.assertEqual(seen, filebases)
+
+    def test_more_slices_than_subdirectories(self):
+        # Slices which share a subdirectory still get disjoint files.
+        producer = Switchboard('test', self._queue_directory, numslices=32)
+        filebases = set(producer.enqueue(self._msg) for i in range(64))
+        seen = set()
+        for slice_number in range(32):
+            switchboard = Switchboard(
+                'test', self._queue_directory, slice_number, 32)
+            files = set(switchboard.files)
+            self.assertEqual(files & seen, set())
+            seen |= files
+        self.assertEqual(seen, filebases)
+
+    def test_migrate_to_slices(self):
+        # Files in a flat queue directory, including backup files, are moved
+        # into the subdirectories when the queue is split into slices.
+        producer = Switchboard('test', self._queue_directory)
+        filebases = set(producer.enqueue(self._msg) for i in range(16))
+        in_flight = producer.files[0]
+        producer.dequeue(in_flight)
+        seen = set()
+        for slice_number in range(2):
+            switchboard = Switchboard(
+                'test', self._queue_directory, slice_number, 2, recover=True)
+            seen |= set(switchboard.files)
+        self.assertEqual(seen, filebases)
+        self.assertEqual(
+            [name for name in os.listdir(self._queue_directory)
+             if not os.path.isdir(os.path.join(self._queue_directory, name))],
+            [])
+
+    def test_migrate_from_slices(self):
+        # Going back to a single slice moves the files back up into the
+        # queue directory.
+        producer = Switchboard('test', self._queue_directory, numslices=2)
+        filebases = set(producer.enqueue(self._msg) for i in range(16))
+        switchboard = Switchboard('test', self._queue_directory, recover=True)
+        self.assertEqual(set(switchboard.files), filebases)
+
+    def test_group_commit_publishes_on_exit(self):
+        # Files enqueued in a group commit only show up in the queue once the
+        # group commit is done.
+        switchboard = Switchboard('test', self._queue_directory)
+        with group_commit():
+            first = switchboard.enqueue(self._msg)
+            second = switchboard.enqueue(self._msg)
+            self.assertEqual(switchboard.files, [])
+        self.assertEqual(switchboard.files, [first, second])
+        self.assertEqual(
+            [name for name in os.listdir(self._queue_directory)
+             if name.endswith('.tmp')], [])
+
+    def test_group_commit_syncs_once(self):
+        # The files in a group commit are not fsync'd one at a time.  They
+        # are flushed together and then their directory is fsync'd once.
+        switchboard = Switchboard('test', self._queue_directory)
+        with patch('mailman.core.switchboard.os.fsync') as fsync, \
+             patch('mailman.core.switchboard.sync_files') as sync_files, \
+             patch('mailman.core.switchboard.fsync_directory') as fsync_dir:
+            with group_commit():
+                for i in range(3):
+                    switchboard.enqueue(self._msg)
+        self.assertEqual(fsync.call_count, 0)
+        self.assertEqual(sync_files.call_count, 1)
+        self.assertEqual(len(sync_files.call_args[0][0]), 3)
+        fsync_dir.assert_called_once_with(self._queue_directory)
+
+    def test_group_commit_discards_on_exception(self):
+        # When the group commit exits with an exception, none of its files
+        # are published.
+        switchboard = Switchboard('test', self._queue_directory)
+        with self.assertRaises(RuntimeError):
+            with group_commit():
+                switchboard.enqueue(self._msg)
+                raise RuntimeError
+        self.assertEqual(os.listdir(self._queue_directory), [])
+
+    def test_nested_group_commit(self):
+        # Nested group commits are part of the outermost one.
+        switchboard = Switchboard('test', self._queue_directory)
+        with group_commit():
+            with group_commit():
+                filebase = switchboard.enqueue(self._msg)
+            self.assertEqual(switchboard.files, [])
+        self.assertEqual(switchboard.files, [filebase])
+
+    def test_raw_format(self):
+        # In the raw format, the message is stored as bytes and only parsed
+        # when it's used.  The message's other attributes are kept.
+        switchboard = Switchboard(
+            'test', self._queue_directory, qfile_format='raw')
+        self._msg.original_size = 42
+        filebase = switchboard.enqueue(self._msg, listid='test.example.com')
+        with open(os.path.join(self._queue_directory,
+                               filebase + '.pck'), 'rb') as fp:
+            self.assertEqual(fp.read(4), b'MMQF')
+        msg, data = switchboard.dequeue(filebase)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertFalse(msg.is_parsed)
+        self.assertEqual(msg.original_size, 42)
+        self.assertEqual(data['listid'], 'test.example.com')
+        self.assertNotIn('_attributes', data)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertIsNone(msg.get_unixfrom())
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_raw_format_requeue_without_parsing(self):
+        # An unparsed message passes through another queue without being
+        # parsed.
+        switchboard = Switchboard(
+            'test', self._queue_directory, qfile_format='raw')
+        filebase = switchboard.enqueue(self._msg)
+        msg, data = switchboard.dequeue(filebase)
+        switchboard.finish(filebase)
+        filebase = switchboard.enqueue(msg, data)
+        self.assertFalse(msg.is_parsed)
+        msg, data = switchboard.dequeue(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+
+    def test_both_formats_readable(self):
+        # Switchboards read queue files in either format.
+        raw = Switchboard('test', self._queue_directory, qfile_format='raw')
+        pickled = Switchboard('test', self._queue_directory)
+        first = pickled.enqueue(self._msg)
+        second = raw.enqueue(self._msg)
+        for switchboard, filebase in ((raw, first), (pickled, second)):
+            msg, data = switchboard.dequeue(filebase)
+            self.assertEqual(msg['message-id'], '<ant>')
+
+    def test_raw_format_falls_back_to_pickle(self):
+        # Messages which can't be flattened to bytes are pickled.
+        switchboard = Switchboard(
+            'test', self._queue_directory, qfile_format='raw')
+        with patch.object(type(self._msg), 'as_bytes',
+                          side_effect=UnicodeEncodeError(
+                              'ascii', '', 0, 1, 'Oops')):
+            filebase = switchboard.enqueue(self._msg)
+        msg, data = switchboard.dequeue(filebase)
+        self.assertNotIsInstance(msg, LazyMessage)
+        self.assertEqual(msg['message-id'], '<ant>')
+
+    def test_raw_format_recovery(self):
+        # Backup files in the raw format are recovered.
+        switchboard = Switchboard(
+            'test', self._queue_directory, qfile_format='raw')
+        filebase = switchboard.enqueue(self._msg)
+        switchboard.dequeue(filebase)
+        switchboard = Switchboard(
+            'test', self._queue_directory, recover=True)
+        msg, data = switchboard.dequeue(filebase)
+        self.assertEqual(data['_bak_count'], 1)
+        self.assertEqual(msg['message-id'], '<ant>')
+
+    def _bodies(self):
+        directory = os.path.join(config.QUEUE_DIR, 'bodies')
+        try:
+            return sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return []
+
+    def test_shared_body(self):
+        # A message enqueued several times with a shared body is only stored
+        # once.  It is removed when the last queue file referencing it is
+        # finished.
+        switchboard = Switchboard('test', self._queue_directory)
+        first = switchboard.enqueue(self._msg, _sharebody=True, listid='a')
+        second = switchboard.enqueue(self._msg, _sharebody=True, listid='b')
+        bodies = self._bodies()
+        # The message itself, plus one link for each queue file.
+        self.assertEqual(len(bodies), 3)
+        inodes = set(
+            os.stat(os.path.join(config.QUEUE_DIR, 'bodies', name)).st_ino
+            for name in bodies)
+        self.assertEqual(len(inodes), 1)
+        msg, data = switchboard.dequeue(first)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(data['listid'], 'a')
+        self.assertNotIn('_sharebody', data)
+        switchboard.finish(first)
+        self.assertEqual(len(self._bodies()), 2)
+        msg, data = switchboard.dequeue(second)
+        self.assertEqual(data['listid'], 'b')
+        switchboard.finish(second)
+        self.assertEqual(self._bodies(), [])
+
+    def test_shared_body_recovered(self):
+        # Backup files referencing a shared body are recovered.
+        switchboard = Switchboard(
+            'test', self._queue_directory, qfile_format='raw')
+        filebase = switchboard.enqueue(self._msg, _sharebody=True)
+        switchboard.dequeue(filebase)
+        switchboard = Switchboard('test', self._queue_directory, recover=True)
+        msg, data = switchboard.dequeue(filebase)
+        self.assertEqual(data['_bak_count'], 1)
+        self.assertEqual(msg['message-id'], '<ant>')
+        switchboard.finish(filebase)
+        self.assertEqual(self._bodies(), [])
+
+    def test_recovery_skips_messages(self):
+        # Recovering backup files only reads their metadata, in every format.
+        filebases = []
+        for qfile_format in ('pickle', 'raw'):
+            switchboard = Switchboard(
+                'test', self._queue_directory, qfile_format=qfile_format)
+            filebases.append(switchboard.enqueue(self._msg, listid='ant'))
+        filebases.append(switchboard.enqueue(self._msg, _sharebody=True))
+        for filebase in filebases:
+            switchboard.dequeue(filebase)
+        with patch('mailman.core.switchboard._read_message',
+                   side_effect=AssertionError):
+            switchboard.recover_backup_files()
+        self.assertEqual(switchboard.files, filebases)
+        for filebase in filebases:
+            msg, data = switchboard.dequeue(filebase)
+            self.assertEqual(data['_bak_count'], 1)
+            self.assertEqual(msg['message-id'], '<ant>')
+            switchboard.finish(filebase)
+
+    def test_recovery_syncs_once(self):
+        # The recovered files are flushed together, and their directory is
+        # fsync'd once.
+        switchboard = Switchboard('test', self._queue_directory)
+        for i in range(3):
+            switchboard.dequeue(switchboard.enqueue(self._msg))
+        with patch('mailman.core.switchboard.os.fsync') as fsync, \
+             patch('mailman.core.switchboard.sync_files') as sync_files, \
+             patch('mailman.core.switchboard.fsync_directory') as fsync_dir:
+            switchboard.recover_backup_files()
+        self.assertEqual(fsync.call_count, 0)
+        self.assertEqual(sync_files.call_count, 1)
+        self.assertEqual(len(sync_files.call_args[0][0]), 3)
+        fsync_dir.assert_called_once_with(self._queue_directory)
+        self.assertEqual(len(switchboard.files), 3)
+
+    def test_recovery_in_batches(self):
+        # Backup files can be recovered a batch at a time.  Only the files
+        # which were backups when the first batch was recovered get
+        # recovered, not the files dequeued since.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebases = [switchboard.enqueue(self._msg) for i in range(5)]
+        for filebase in filebases:
+            switchboard.dequeue(filebase)
+        self.assertEqual(switchboard.recover_backup_files(2), 3)
+        self.assertEqual(switchboard.files, filebases[:2])
+        switchboard.dequeue(filebases[0])
+        self.assertEqual(switchboard.recover_backup_files(2), 1)
+        self.assertEqual(switchboard.recover_backup_files(2), 0)
+        self.assertEqual(switchboard.files, filebases[1:])
+        self.assertEqual(switchboard.get_files('.bak'), filebases[:1])
+        self.assertEqual(switchboard.recover_backup_files(2), 0)
+
+    def test_shared_body_group_commit(self):
+        # Shared bodies are released when a group commit is discarded.
+        switchboard = Switchboard('test', self._queue_directory)
+        with group_commit():
+            first = switchboard.enqueue(self._msg, _sharebody=True)
+            second = switchboard.enqueue(self._msg, _sharebody=True)
+        self.assertEqual(switchboard.files, [first, second])
+        with self.assertRaises(RuntimeError):
+            with group_commit():
+                switchboard.enqueue(self._msg, _sharebody=True)
+                raise RuntimeError
+        self.assertEqual(len(self._bodies()), 3)
+        for filebase in (first, second):
+            switchboard.dequeue(filebase)
+            switchboard.finish(filebase)
+        self.assertEqual(self._bodies(), [])
+
+    def test_priority_order(self):
+        # Files with a higher priority are dequeued first, and files with
+        # the same priority in FIFO order.
+        switchboard = Switchboard('test', self._queue_directory)
+        low = switchboard.enqueue(self._msg)
+        high_1 = switchboard.enqueue(self._msg, priority=2)
+        middle = switchboard.enqueue(self._msg, priority=1)
+        high_2 = switchboard.enqueue(self._msg, priority=2)
+        self.assertEqual(switchboard.files, [high_1, high_2, middle, low])
+        msg, data = switchboard.dequeue(high_1)
+        self.assertEqual(data['priority'], 2)
+
+    @configuration('priorities', post=-1)
+    def test_post_priority(self):
+        # Files without a priority get the priority of posts.
+        switchboard = Switchboard('test', self._queue_directory)
+        post = switchboard.enqueue(self._msg)
+        other = switchboard.enqueue(self._msg, priority=0)
+        self.assertEqual(switchboard.files, [other, post])
+
+    @configuration('priorities', weight='10s')
+    def test_priority_starvation_guard(self):
+        # A file with a lower priority is not passed by a file with a higher
+        # priority once it has been waiting for longer than the difference
+        # in their priorities is worth.
+        switchboard = Switchboard('test', self._queue_directory)
+        with patch('mailman.core.switchboard.time.time', return_value=1000):
+            low = switchboard.enqueue(self._msg)
+        with patch('mailman.core.switchboard.time.time', return_value=1005):
+            early = switchboard.enqueue(self._msg, priority=1)
+        with patch('mailman.core.switchboard.time.time', return_value=1015):
+            late = switchboard.enqueue(self._msg, priority=1)
+        self.assertEqual(switchboard.files, [early, low, late])
+
+    def test_priority_settings_read_once(self):
+        # The priority settings are read when the switchboard is created, and
+        # read again when it is reconfigured.
+        switchboard = Switchboard('test', self._queue_directory)
+        with patch('mailman.core.switchboard.as_timedelta',
+                   side_effect=AssertionError):
+            switchboard.enqueue(self._msg, priority=1)
+        with configuration('priorities', weight='10s'):
+            switchboard.configure()
+            with patch('mailman.core.switchboard.time.time',
+                       return_value=1000):
+                filebase = switchboard.enqueue(self._msg, priority=1)
+        self.assertEqual(filebase.split('+')[0], '990.0')
+
+    @configuration('priorities', weight='1h')
+    def test_age(self):
+        # The age of the queue is how long its oldest file has been waiting,
+        # whatever the files' priorities.
+        switchboard = Switchboard('test', self._queue_directory)
+        self.assertEqual(switchboard.get_age(), 0)
+        filebase = switchboard.enqueue(self._msg, priority=2)
+        self.assertLess(switchboard.get_age(), 60)
+        when = time.time() - 100
+        os.utime(switchboard._path(filebase, '.pck'), (when, when))
+        self.assertAlmostEqual(switchboard.get_age(), 100, delta=60)
+
+    def test_age_of_long_queue(self):
+        # Without priorities, only the oldest files are looked at to find
+        # the age of the queue.
+        switchboard = Switchboard('test', self._queue_directory)
+        for i in range(20):
+            switchboard.enqueue(self._msg)
+        with patch('mailman.core.switchboard.os.path.getmtime',
+                   wraps=os.path.getmtime) as getmtime:
+            self.assertLess(switchboard.get_age(), 60)
+        self.assertLessEqual(getmtime.call_count, 2)
+
+    def test_restore(self):
+        # A dequeued file can be put back in the queue unchanged.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg, listid='ant')
+        msg, data = switchboard.dequeue(filebase)
+        data['listid'] = 'bee'
+        switchboard.restore(filebase)
+        self.assertEqual(switchboard.files, [filebase])
+        self.assertEqual(switchboard.get_files('.bak'), [])
+        msg, data = switchboard.dequeue(filebase)
+        self.assertEqual(data['listid'], 'ant')
+        self.assertNotIn('_bak_count', data)
+        switchboard.finish(filebase)
+
+    @configuration('mailman', stage_timing='yes')
+    def test_stage_times(self):
+        # With stage timing, every queue a message goes through is recorded
+        # in its metadata, with when it was enqueued and dequeued there.
+        first = Switchboard('first', self._queue_directory)
+        second = Switchboard('second', self._queue_directory)
+        with patch('mailman.core.switchboard.time.time', return_value=1000):
+            filebase = first.enqueue(self._msg)
+        with patch('mailman.core.switchboard.time.time', return_value=1002):
+            msg, data = first.dequeue(filebase)
+        first.finish(filebase)
+        self.assertEqual(data['stage_times'], [
+            dict(queue='first', enqueued=1000, dequeued=1002)])
+        with patch('mailman.core.switchboard.time.time', return_value=1003):
+            filebase = second.enqueue(msg, data)
+        # The caller's metadata is left alone.
+        self.assertEqual(len(data['stage_times']), 1)
+        msg, data = second.dequeue(filebase)
+        second.finish(filebase)
+        self.assertEqual([stage['queue'] for stage in data['stage_times']],
+                         ['first', 'second'])
+        self.assertEqual(data['stage_times'][1]['enqueued'], 1003)
+
+    def test_no_stage_times(self):
+        # Stage times are only recorded when stage timing is enabled.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        msg, data = switchboard.dequeue(filebase)
+        switchboard.finish(filebase)
+        self.assertNotIn('stage_times', data)
@@ -22,18 +22,24 @@ __all__ = [
     ]
 
 
+import time
 import logging
 
 from mailman.config import config
+from mailman.core import metrics
 from mailman.interfaces.database import IDatabase
 from mailman.utilities.string import expand
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from zope.interface import implementer
 
 
 log = logging.getLogger('mailman.database')
 
+commit_time = metrics.histogram(
+    'mailman_database_commit_seconds',
+    'The time it took to commit a database transaction.')
+
 
 
 @implementer(IDatabase)
@@ -53,12 +59,19 @@ class SABaseDatabase:
 
     def commit(self):
         """See `IDatabase`."""
+        start = time.time()
         self.store.commit()
+        commit_time.observe(time.time() - start)
 
     def abort(self):
         """See `IDatabase`."""
         self.store.rollback()
 
+    def dispose(self):
+        """See `IDatabase`."""
+        self.store.remove()
+        self.engine.dispose()
+
     def _pre_reset(self, store):
         """Clean up method for testing.
 
@@ -108,6 +121,9 @@ class SABaseDatabase:
         # half dozen and all...
         self.url = url
         self.engine = create_engine(url)
+        # Every thread gets its own session, so that e.g. the workers of a
+        # runner processing several queue files at once each have their own
+        # transaction.
         session = sessionmaker(bind=self.engine)
-        self.store = session()
+        self.store = scoped_session(session)
         self.store.commit()
@@ -24,6 +24,7 @@ attributes.
 """
 
 __all__ = [
+    'LazyMessage',
     'Message',
     'MultipartDigestMessage',
     'OwnerNotification',
@@ -130,11 +131,64 @@ class Message(email.message.Message):
         return clean_senders
 
 
+
+class LazyMessage(Message):
+    """A message which is parsed from its bytes when it is first used.
+
+    Until then, only the wire format bytes of the message are kept, and they
+    are handed back unchanged by `as_bytes()`.  Instances are still `Message`
+    instances, so they can be used anywhere messages are.
+    """
+
+    def __init__(self, raw):
+        # The base class is not initialized; parsing fills in its attributes.
+        self._raw = raw
+
+    def __getattr__(self, name):
+        # This is only called for attributes which aren't set, i.e. any of
+        # the email package's attributes before the message is parsed.
+        # Special names are looked up by e.g. pickle and copy, which must not
+        # trigger the parsing.
+        raw = self.__dict__.get('_raw')
+        if raw is None or name.startswith('__'):
+            raise AttributeError(name)
+        parsed = email.message_from_bytes(raw, Message)
+        # Attributes already set on the unparsed message win.
+        values = parsed.__dict__
+        values.update(self.__dict__)
+        del values['_raw']
+        self.__dict__ = values
+        return getattr(self, name)
+
+    @property
+    def is_parsed(self):
+        """True when the message has been parsed."""
+        return '_raw' not in self.__dict__
+
+    def as_bytes(self, unixfrom=False, policy=None):
+        """See `email.message.Message`."""
+        raw = self.__dict__.get('_raw')
+        if raw is not None and unixfrom and policy is None:
+            return raw
+        return super().as_bytes(unixfrom, policy)
+
+
 
 class MultipartDigestMessage(MIMEMultipart, Message):
     """Mix-in class for MIME digest messages."""
 
 
+
+def _prioritize(kws):
+    # Not imported at module scope to avoid import loop.
+    from mailman.core.switchboard import get_priority
+    priority = get_priority(
+        'probe' if 'probe_token' in kws else 'notification')
+    # The default priority is not recorded in the metadata.
+    if priority != 0:
+        kws.setdefault('priority', priority)
+
+
 
 class UserNotification(Message):
     """Class for internally crafted messages."""
@@ -196,6 +250,7 @@ class UserNotification(Message):
         if mlist is not None:
             enqueue_kws['listid'] = mlist.list_id
         enqueue_kws.update(_kws)
+        _prioritize(enqueue_kws)
         virginq.enqueue(self, **enqueue_kws)
 
 
@@ -222,6 +277,7 @@ class OwnerNotification(UserNotification):
         # Not imported at module scope to avoid import loop
         virginq = config.switchboards['virgin']
         # The message metadata better have a `recip' attribute
+        _prioritize(_kws)
         virginq.enqueue(self,
                         listid=mlist.list_id,
                         recipients=self.recipients,
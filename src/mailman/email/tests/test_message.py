@@ -18,17 +18,20 @@
 """Test the message API."""
 
 __all__ = [
+    'TestLazyMessage',
     'TestMessage',
     'TestMessageSubclass',
     ]
 
 
+import copy
+import pickle
 import unittest
 
 from email.parser import FeedParser
 from mailman.app.lifecycle import create_list
-from mailman.email.message import Message, UserNotification
-from mailman.testing.helpers import get_queue_messages
+from mailman.email.message import LazyMessage, Message, UserNotification
+from mailman.testing.helpers import configuration, get_queue_messages
 from mailman.testing.layers import ConfigLayer
 
 
@@ -58,6 +61,22 @@ class TestMessage(unittest.TestCase):
         self.assertEqual(messages[0].msg.get_all('precedence'),
                          ['omg wtf bbq'])
 
+    @configuration('priorities', notification=5, probe=3)
+    def test_notification_priority(self):
+        # Notifications and probes are enqueued with their priorities.
+        self._msg.send(self._mlist)
+        self._msg.send(self._mlist, probe_token='abc')
+        self._msg.send(self._mlist, priority=1)
+        messages = get_queue_messages('virgin')
+        self.assertEqual(
+            sorted(message.msgdata['priority'] for message in messages),
+            [1, 3, 5])
+
+    def test_default_priority_not_recorded(self):
+        self._msg.send(self._mlist)
+        messages = get_queue_messages('virgin')
+        self.assertNotIn('priority', messages[0].msgdata)
+
 
 
 class TestMessageSubclass(unittest.TestCase):
@@ -88,3 +107,51 @@ Test content
         except TypeError as error:
             self.fail(error)
         self.assertEqual(filename, u'd\xe9jeuner.txt')
+
+
+
+class TestLazyMessage(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._raw = b"""\
+From: anne@example.com
+To: test@example.com
+Subject: Lazy
+
+A body.
+"""
+
+    def test_parsed_on_first_use(self):
+        msg = LazyMessage(self._raw)
+        self.assertFalse(msg.is_parsed)
+        self.assertIsInstance(msg, Message)
+        self.assertEqual(msg['subject'], 'Lazy')
+        self.assertTrue(msg.is_parsed)
+        self.assertEqual(msg.get_payload(), 'A body.\n')
+        self.assertEqual(msg.sender, 'anne@example.com')
+
+    def test_attributes_survive_parsing(self):
+        msg = LazyMessage(self._raw)
+        msg.original_size = 42
+        self.assertEqual(msg['to'], 'test@example.com')
+        self.assertEqual(msg.original_size, 42)
+
+    def test_missing_attribute(self):
+        msg = LazyMessage(self._raw)
+        self.assertRaises(AttributeError, getattr, msg, 'no_such_attribute')
+
+    def test_as_bytes_without_parsing(self):
+        msg = LazyMessage(self._raw)
+        self.assertEqual(msg.as_bytes(unixfrom=True), self._raw)
+        self.assertFalse(msg.is_parsed)
+        # Once parsed, the message may have changed.
+        msg['X-Mailman'] = 'yes'
+        self.assertIn(b'X-Mailman: yes', msg.as_bytes(unixfrom=True))
+
+    def test_pickle_and_copy_without_parsing(self):
+        msg = LazyMessage(self._raw)
+        for clone in (pickle.loads(pickle.dumps(msg)), copy.deepcopy(msg)):
+            self.assertFalse(msg.is_parsed)
+            self.assertFalse(clone.is_parsed)
+            self.assertEqual(clone['subject'], 'Lazy')
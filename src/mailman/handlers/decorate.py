@@ -21,6 +21,7 @@ __all__ = [
     'Decorate',
     'decorate',
     'decorate_template',
+    'member_substitutions',
     ]
 
 
@@ -52,13 +53,7 @@ def process(mlist, msg, msgdata):
     if member is not None:
         # Calculate the extra personalization dictionary.
         recipient = msgdata.get('recipient', member.address.original_email)
-        d['user_address'] = recipient
-        d['user_delivered_to'] = member.address.original_email
-        d['user_language'] = member.preferred_language.description
-        d['user_name'] = (member.user.display_name
-                          if member.user.display_name
-                          else member.address.original_email)
-        d['user_optionsurl'] = member.options_url
+        d.update(member_substitutions(member, recipient))
     # These strings are descriptive for the log file and shouldn't be i18n'd
     d.update(msgdata.get('decoration-data', {}))
     try:
@@ -235,6 +230,28 @@ def decorate_template(mlist, template, extradict=None):
     return re.sub(r' *\r?\n', r'\n', text)
 
 
+
+def member_substitutions(member, recipient):
+    """Return the decoration substitutions for a member.
+
+    :param member: The member being delivered to.
+    :type member: `IMember`
+    :param recipient: The address the message is delivered to.
+    :type recipient: string
+    :return: The `user_*` substitutions for the member's decorations.
+    :rtype: dict
+    """
+    return dict(
+        user_address      = recipient,
+        user_delivered_to = member.address.original_email,
+        user_language     = member.preferred_language.description,
+        user_name         = (member.user.display_name
+                             if member.user.display_name
+                             else member.address.original_email),
+        user_optionsurl   = member.options_url,
+        )
+
+
 
 @implementer(IHandler)
 class Decorate:
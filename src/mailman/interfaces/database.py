@@ -54,6 +54,14 @@ class IDatabase(Interface):
     def abort():
         """Abort the current transaction."""
 
+    def dispose():
+        """Close the current session and all the database connections.
+
+        The transaction is aborted.  New connections are opened as they are
+        needed, e.g. by a child process forked after this is called, so that
+        no connection is shared with the parent process.
+        """
+
     store = Attribute(
         """The underlying database object on which you can do queries.""")
 
@@ -68,6 +68,20 @@ class IRoster(Interface):
         :rtype: `IMember` or None
         """
 
+    def get_members(emails):
+        """Get the members for the given addresses.
+
+        This is like calling ``get_member()`` for each address, but the
+        members are looked up together, along with their addresses, users
+        and preferences.
+
+        :param emails: The email addresses to search for.
+        :type emails: iterable of strings
+        :return: The members found, keyed by their email address.  Email
+            addresses which are not subscribed are missing.
+        :rtype: dict mapping strings to ``IMember``
+        """
+
     def get_memberships(email):
         """Get the memberships for the given address.
 
@@ -60,6 +60,12 @@ class IRunner(Interface):
         through the main loop.
         """)
 
+    poll_interval = Attribute("""\
+        The number of seconds this runner currently sleeps between iterations
+        through the main loop.  This starts out as `sleep_time`, and grows
+        while the runner keeps finding nothing to do.
+        """)
+
     def set_signals():
         """Set up the signal handlers necessary to control the runner.
 
@@ -69,6 +75,8 @@ class IRunner(Interface):
         - SIGUSR1: Also causes the runner to exit, but the master watcher will
           retart it.
         - SIGHUP: Re-open the log files.
+        - SIGUSR2: Start profiling the runner, or stop profiling it and dump
+          the profile.
         """
 
     def _one_iteration():
@@ -128,7 +136,8 @@ class IRunner(Interface):
         :param filecnt: The number of messages in the queue the last time
             through.  Runners can decide to continue to do work, or sleep for
             a while based on this value.  By default, the base runner only
-            snoozes when there was nothing to do last time around.
+            snoozes when there was nothing to do last time around, for longer
+            and longer as long as there is nothing to do.
         :type filecnt: int
         """
 
@@ -67,24 +67,74 @@ class ISwitchboard(Interface):
         a preservation file instead of being unlinked.
         """
 
+    def restore(filebase):
+        """Return a dequeued file to the queue without processing it.
+
+        This undoes .dequeue(), e.g. when the transaction in which the
+        message was processed had to be rolled back.  The file can then be
+        dequeued again, and its message and metadata are as they were when
+        it was first dequeued.
+        """
+
     files = Attribute(
         """An iterator over all the .pck files in the queue directory.
 
         The base names of the matching files are returned.
         """)
 
-    def get_files(extension='.pck'):
+    def get_files(extension='.pck', count=None):
         """Like the 'files' attribute, but accepts an alternative extension.
 
         Only the files in the queue directory that have a matching extension
         are returned.  Like 'files', the base names of the matching files are
         returned.
+
+        :param extension: The extension of the files to return.
+        :type extension: string
+        :param count: The maximum number of files to return, or None to
+            return them all.  The oldest files are returned first.
+        :type count: int
+        """
+
+    def get_age():
+        """Return how long the oldest queued file has been waiting.
+
+        This is measured from when the file was enqueued, so unlike the time
+        in the file's base name, it doesn't depend on the file's priority.
+
+        :return: The number of seconds, or 0 if the queue is empty.
+        :rtype: float
         """
 
-    def recover_backup_files():
+    def configure():
+        """Read the switchboard's settings from the configuration again.
+
+        The settings are read when the switchboard is created.  This is
+        called when the configuration is reloaded.
+        """
+
+    def wait(timeout):
+        """Wait for new files to show up in the queue.
+
+        This returns after at most `timeout` seconds.  It may return earlier
+        if the switchboard can tell that new files have been enqueued, but
+        there is no guarantee that the queue is not empty afterward.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float
+        """
+
+    def recover_backup_files(count=None):
         """Move all backup files to active message files.
 
         It is impossible for both the .bak and .pck files to exist at the same
         time, so moving them is enough to ensure that a normal dequeing
         operation will handle them.
+
+        :param count: The maximum number of backup files to recover, or None
+            to recover them all.  When given, the backup files found by the
+            first such call are recovered over this and the following calls.
+        :type count: int or None
+        :return: When `count` is given, the number of backup files left to
+            recover, otherwise None.
         """
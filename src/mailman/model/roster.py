@@ -40,9 +40,33 @@ from mailman.interfaces.roster import IRoster
 from mailman.model.address import Address
 from mailman.model.member import Member
 from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager, joinedload
 from zope.interface import implementer
 
 
+# The most email addresses looked up in one query by get_members().  This
+# keeps the query below the number of parameters SQLite allows.
+MAX_EMAILS_PER_QUERY = 500
+
+
+
+def _chunks(emails):
+    emails = list(emails)
+    for i in range(0, len(emails), MAX_EMAILS_PER_QUERY):
+        yield emails[i:i + MAX_EMAILS_PER_QUERY]
+
+
+def _address_options():
+    # Avoid circular imports.
+    from mailman.model.user import User
+    # Load the members subscribed with an explicit address along with
+    # everything their preferences are looked up from.
+    return (joinedload(Member.preferences),
+            contains_eager(Member._address).joinedload(Address.preferences),
+            contains_eager(Member._address).joinedload(
+                Address.user).joinedload(User.preferences))
+
+
 
 @implementer(IRoster)
 class AbstractRoster:
@@ -97,23 +121,28 @@ class AbstractRoster:
             yield member.address
 
     @dbconnection
-    def _get_all_memberships(self, store, email):
+    def _get_queries(self, store, emails):
         # Avoid circular imports.
         from mailman.model.user import User
         # Here's a query that finds all members subscribed with an explicit
         # email address.
-        members_a = store.query(Member).filter(
+        members_a = store.query(Member).join(
+            Address, Member.address_id == Address.id).filter(
             Member.list_id == self._mlist.list_id,
             Member.role == self.role,
-            Address.email == email,
-            Member.address_id == Address.id)
+            Address.email.in_(emails))
         # Here's a query that finds all members subscribed with their
         # preferred address.
-        members_u = store.query(Member).filter(
+        members_u = store.query(Member).join(
+            User, Member.user_id == User.id).join(
+            Address, User._preferred_address_id == Address.id).filter(
             Member.list_id == self._mlist.list_id,
             Member.role == self.role,
-            Address.email==email,
-            Member.user_id == User.id)
+            Address.email.in_(emails))
+        return members_a, members_u
+
+    def _get_all_memberships(self, email):
+        members_a, members_u = self._get_queries([email])
         return members_a.union(members_u).all()
 
     def get_member(self, email):
@@ -132,6 +161,29 @@ class AbstractRoster:
                 if memberships[0]._address is not None
                 else memberships[1])
 
+    def get_members(self, emails):
+        """See ``IRoster``."""
+        # Avoid circular imports.
+        from mailman.model.user import User
+        members = {}
+        for chunk in _chunks(emails):
+            members_a, members_u = self._get_queries(chunk)
+            # The members are loaded with everything their preferences are
+            # looked up from.
+            members_u = members_u.options(
+                joinedload(Member.preferences),
+                contains_eager(Member._user).joinedload(User.preferences),
+                contains_eager(Member._user).contains_eager(
+                    User._preferred_address).joinedload(Address.preferences))
+            members_a = members_a.options(*_address_options())
+            # Like get_member(), the explicit address membership wins when an
+            # email address is subscribed both ways.
+            for member in members_u:
+                members[member._user.preferred_address.email] = member
+            for member in members_a:
+                members[member._address.email] = member
+        return members
+
     def get_memberships(self, email):
         """See ``IRoster``."""
         memberships = self._get_all_memberships(email)
@@ -203,6 +255,28 @@ class AdministratorRoster(AbstractRoster):
             raise AssertionError(
                 'Too many matching member results: {0}'.format(results))
 
+    @dbconnection
+    def get_members(self, store, emails):
+        """See `IRoster`."""
+        members = {}
+        for chunk in _chunks(emails):
+            # Like get_member(), only the members subscribed with an explicit
+            # address are found.
+            results = store.query(Member).join(
+                Address, Member.address_id == Address.id).filter(
+                Member.list_id == self._mlist.list_id,
+                or_(Member.role == MemberRole.moderator,
+                    Member.role == MemberRole.owner),
+                Address.email.in_(chunk)).options(*_address_options())
+            for member in results:
+                email = member._address.email
+                if email in members:
+                    raise AssertionError(
+                        'Too many matching member results: {0}'.format(
+                            email))
+                members[email] = member
+        return members
+
 
 
 class DeliveryMemberRoster(AbstractRoster):
@@ -318,7 +392,8 @@ class Memberships:
         """See `IRoster`."""
         results = store.query(Member).filter(
             Member.address_id == Address.id,
-            Address.user_id == self._user.id)
+            Address.user_id == self._user.id,
+            Address.email == email)
         if results.count() == 0:
             return None
         elif results.count() == 1:
@@ -328,6 +403,24 @@ class Memberships:
                 'Too many matching member results: {0}'.format(
                     results.count()))
 
+    @dbconnection
+    def get_members(self, store, emails):
+        """See `IRoster`."""
+        members = {}
+        for chunk in _chunks(emails):
+            results = store.query(Member).join(
+                Address, Member.address_id == Address.id).filter(
+                Address.user_id == self._user.id,
+                Address.email.in_(chunk)).options(*_address_options())
+            for member in results:
+                email = member._address.email
+                if email in members:
+                    raise AssertionError(
+                        'Too many matching member results: {0}'.format(
+                            email))
+                members[email] = member
+        return members
+
     @dbconnection
     def get_memberships(self, store, address):
         """See `IRoster`."""
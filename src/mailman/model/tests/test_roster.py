@@ -18,6 +18,7 @@
 """Test rosters."""
 
 __all__ = [
+    'TestGetMembers',
     'TestMailingListRoster',
     'TestMembershipsRoster',
     ]
@@ -26,12 +27,15 @@ __all__ = [
 import unittest
 
 from mailman.app.lifecycle import create_list
+from mailman.config import config
 from mailman.interfaces.address import IAddress
 from mailman.interfaces.member import DeliveryMode, MemberRole
 from mailman.interfaces.user import IUser
 from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import now
+from sqlalchemy import event
+from unittest.mock import patch
 from zope.component import getUtility
 
 
@@ -200,3 +204,163 @@ class TestMembershipsRoster(unittest.TestCase):
         self.assertEqual(
             [record.address.email for record in memberships],
             ['anne@example.com', 'anne@example.com'])
+
+    def test_get_members(self):
+        # The members are looked up for several email addresses at once.
+        user_manager = getUtility(IUserManager)
+        bart = user_manager.create_address('bart@example.com')
+        cris = user_manager.create_address('cris@example.com')
+        self._ant.subscribe(self._anne)
+        self._ant.subscribe(bart)
+        self._ant.subscribe(cris, MemberRole.owner)
+        members = self._ant.members.get_members(
+            ['anne@example.com', 'bart@example.com', 'cris@example.com',
+             'dave@example.com'])
+        self.assertEqual(sorted(members), [
+            'anne@example.com', 'bart@example.com'])
+        for email, member in members.items():
+            self.assertEqual(
+                member, self._ant.members.get_member(email))
+        self.assertEqual(
+            self._ant.owners.get_members(['cris@example.com']),
+            {'cris@example.com': self._ant.owners.get_member(
+                'cris@example.com')})
+
+    def test_get_members_subscribed_as_user_and_address(self):
+        # Like get_member(), get_members() returns the explicit address.
+        self._ant.subscribe(self._anne)
+        self._ant.subscribe(self._anne.preferred_address)
+        member = self._ant.members.get_members(
+            ['anne@example.com'])['anne@example.com']
+        self.assertTrue(IAddress.providedBy(member.subscriber))
+
+    def test_get_members_in_chunks(self):
+        # The email addresses are looked up a few at a time.
+        user_manager = getUtility(IUserManager)
+        emails = ['person_{0}@example.com'.format(i) for i in range(5)]
+        for email in emails:
+            self._ant.subscribe(user_manager.create_address(email))
+        with patch('mailman.model.roster.MAX_EMAILS_PER_QUERY', 2):
+            members = self._ant.members.get_members(emails)
+        self.assertEqual(sorted(members), emails)
+
+    def test_get_members_loads_preferences(self):
+        # The members' addresses, users and preferences are loaded along with
+        # them.
+        bart = getUtility(IUserManager).make_user('bart@example.com')
+        self._ant.subscribe(self._anne)
+        self._ant.subscribe(list(bart.addresses)[0])
+        config.db.store.expire_all()
+        members = self._ant.members.get_members(
+            ['anne@example.com', 'bart@example.com'])
+        statements = []
+        def count(*args):
+            statements.append(args)
+        event.listen(config.db.engine, 'before_cursor_execute', count)
+        self.addCleanup(event.remove, config.db.engine,
+                        'before_cursor_execute', count)
+        for member in members.values():
+            member.address.email
+            member.user.display_name
+            member.delivery_mode
+        self.assertEqual(statements, [])
+
+
+
+class TestGetMembers(unittest.TestCase):
+    """Test that get_members() agrees with get_member() in every roster."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._ant = create_list('ant@example.com')
+        self._bee = create_list('bee@example.com')
+        user_manager = getUtility(IUserManager)
+        # Anne and Bart subscribe as users, Bart as an owner too.
+        self._anne = self._make_user('anne@example.com')
+        self._ant.subscribe(self._anne)
+        bart = self._make_user('bart@example.com')
+        self._ant.subscribe(bart)
+        self._ant.subscribe(bart, MemberRole.owner)
+        # Anne also subscribes to another list with her address.
+        self._bee.subscribe(self._anne.preferred_address)
+        # Cris subscribes with her address as a digest member and an owner.
+        cris = user_manager.create_address('cris@example.com')
+        member = self._ant.subscribe(cris)
+        member.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._ant.subscribe(cris, MemberRole.owner)
+        # Dave is a moderator and Elle is a nonmember.
+        self._ant.subscribe(
+            user_manager.create_address('dave@example.com'),
+            MemberRole.moderator)
+        self._ant.subscribe(
+            user_manager.create_address('elle@example.com'),
+            MemberRole.nonmember)
+        self._emails = [
+            'anne@example.com', 'bart@example.com', 'cris@example.com',
+            'dave@example.com', 'elle@example.com', 'fred@example.com']
+
+    def _make_user(self, email):
+        user = getUtility(IUserManager).make_user(email)
+        preferred = list(user.addresses)[0]
+        preferred.verified_on = now()
+        user.preferred_address = preferred
+        return user
+
+    def _check(self, roster):
+        expected = {}
+        for email in self._emails:
+            member = roster.get_member(email)
+            if member is not None:
+                expected[email] = member
+        self.assertEqual(roster.get_members(self._emails), expected)
+        return expected
+
+    def test_members(self):
+        self.assertEqual(sorted(self._check(self._ant.members)), [
+            'anne@example.com', 'bart@example.com', 'cris@example.com'])
+
+    def test_nonmembers(self):
+        self.assertEqual(sorted(self._check(self._ant.nonmembers)),
+                         ['elle@example.com'])
+
+    def test_owners(self):
+        self.assertEqual(sorted(self._check(self._ant.owners)),
+                         ['bart@example.com', 'cris@example.com'])
+
+    def test_moderators(self):
+        self.assertEqual(sorted(self._check(self._ant.moderators)),
+                         ['dave@example.com'])
+
+    def test_administrators(self):
+        # Only the administrators subscribed with an explicit address are
+        # found.
+        self.assertEqual(sorted(self._check(self._ant.administrators)),
+                         ['cris@example.com', 'dave@example.com'])
+
+    def test_regular_members(self):
+        self._check(self._ant.regular_members)
+
+    def test_digest_members(self):
+        self._check(self._ant.digest_members)
+
+    def test_subscribers(self):
+        self._check(self._ant.subscribers)
+
+    def test_memberships(self):
+        # Only the memberships with an explicit address are found.
+        self.assertEqual(sorted(self._check(self._anne.memberships)),
+                         ['anne@example.com'])
+
+    def test_memberships_in_one_query(self):
+        # The user's memberships are looked up in one query.
+        memberships = self._anne.memberships
+        config.db.store.flush()
+        statements = []
+        def count(*args):
+            statements.append(args)
+        event.listen(config.db.engine, 'before_cursor_execute', count)
+        self.addCleanup(event.remove, config.db.engine,
+                        'before_cursor_execute', count)
+        memberships.get_members(self._emails)
+        self.assertEqual(len(statements), 1)
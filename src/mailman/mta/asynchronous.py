@@ -0,0 +1,429 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Outgoing delivery multiplexed over many SMTP connections with asyncio.
+
+The delivery classes hand each SMTP transaction to `_deliver_to_recipients()`.
+The classes here queue the transactions instead of sending them one at a time,
+and send the queued transactions over a pool of connections to the outgoing
+mail server, all driven by one event loop.
+"""
+
+__all__ = [
+    'AsyncBulkDelivery',
+    'AsyncConnection',
+    'AsyncDeliveryMixin',
+    ]
+
+
+import re
+import socket
+import base64
+import asyncio
+import logging
+import smtplib
+
+from lazr.config import as_boolean
+from mailman.config import config
+from mailman.mta.bulk import BulkDelivery
+
+
+log = logging.getLogger('mailman.smtp')
+
+CRLF = b'\r\n'
+
+
+
+class _SMTPProtocol(asyncio.Protocol):
+    """Split the data from the SMTP server into replies."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._buffer = b''
+        self._lines = []
+
+    def data_received(self, data):
+        self._buffer += data
+        while True:
+            line, eol, rest = self._buffer.partition(CRLF)
+            if not eol:
+                break
+            self._buffer = rest
+            self._lines.append(line[4:])
+            # The last line of a reply has a space after the code, the
+            # others a dash.
+            if line[3:4] != b'-':
+                try:
+                    code = int(line[:3])
+                except ValueError:
+                    code = -1
+                reply = b'\n'.join(self._lines)
+                self._lines = []
+                self._connection._reply(code, reply)
+
+    def connection_made(self, transport):
+        self._connection._made(transport)
+
+    def connection_lost(self, error):
+        self._connection._lost(error)
+
+
+
+class AsyncConnection:
+    """Manage a connection to the SMTP server, driven by an event loop.
+
+    Like `Connection`, this connects on first use, and reconnects once the
+    given number of sessions have been done over the connection.  Only one
+    transaction at a time can be sent over a connection.
+    """
+
+    def __init__(self, loop, host, port, sessions_per_connection,
+                 smtp_user=None, smtp_pass=None):
+        """Create a connection manager.
+
+        :param loop: The event loop driving the connection.
+        :type loop: `asyncio.AbstractEventLoop`
+        The other arguments are the same as for `Connection`.
+        """
+        self._loop = loop
+        self._host = host
+        self._port = port
+        self._sessions_per_connection = sessions_per_connection
+        self._username = smtp_user
+        self._password = smtp_pass
+        self._session_count = None
+        self._transport = None
+        # The generator driving the current transaction, and the future for
+        # its result.
+        self._steps = None
+        self._future = None
+
+    def sendmail(self, envsender, recipients, msgtext):
+        """Like `Connection.sendmail()`, but asynchronous.
+
+        :return: A future for the failed recipients, as returned by
+            `smtplib.SMTP.sendmail`, or for the exception it would raise.
+        :rtype: `asyncio.Future`
+        """
+        assert self._future is None, 'Connection is busy'
+        if as_boolean(config.devmode.enabled):
+            # Force the recipients to the specified address, but still deliver
+            # to the same number of recipients.
+            recipients = [config.devmode.recipient] * len(recipients)
+        log.debug('envsender: %s, recipients: %s, size(msgtext): %s',
+                  envsender, recipients, len(msgtext))
+        if isinstance(msgtext, str):
+            msgtext = msgtext.encode('ascii')
+        future = self._future = asyncio.Future(loop=self._loop)
+        if self._transport is None:
+            self._steps = self._sendmail(envsender, recipients, msgtext, True)
+            # Start the transaction, so that it waits for the greeting.
+            next(self._steps)
+            log.debug('Connecting to %s:%s', self._host, self._port)
+            task = self._loop.create_task(self._loop.create_connection(
+                lambda: _SMTPProtocol(self), self._host, self._port))
+            task.add_done_callback(self._connected)
+        else:
+            self._steps = self._sendmail(envsender, recipients, msgtext)
+            self._advance(None)
+        return future
+
+    def quit(self):
+        """Close the connection, if it is open.
+
+        :return: A future which is done when the connection is closed.
+        :rtype: `asyncio.Future`
+        """
+        assert self._future is None, 'Connection is busy'
+        future = self._future = asyncio.Future(loop=self._loop)
+        if self._transport is None:
+            self._finish(None)
+        else:
+            self._steps = self._quit()
+            self._advance(None)
+        return future
+
+    def _connected(self, task):
+        try:
+            task.result()
+        except Exception as error:
+            self._fail(error)
+
+    def _made(self, transport):
+        self._transport = transport
+        self._session_count = self._sessions_per_connection
+
+    def _sendmail(self, envsender, recipients, msgtext, greet=False):
+        """The steps of an SMTP transaction, as done by `smtplib`.
+
+        The generator yields the data to send to the server, or None to just
+        wait, and is sent the server's reply in return.
+        """
+        if greet:
+            yield from self._greet()
+        code, reply = yield self._command('MAIL FROM:<{0}>', envsender)
+        if code != 250:
+            yield from self._reset()
+            raise smtplib.SMTPSenderRefused(code, reply, envsender)
+        refused = {}
+        for recipient in recipients:
+            code, reply = yield self._command('RCPT TO:<{0}>', recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, reply)
+        if len(refused) == len(recipients):
+            yield from self._reset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, reply = yield self._command('DATA')
+        if code != 354:
+            yield from self._reset()
+            raise smtplib.SMTPDataError(code, reply)
+        code, reply = yield self._data(msgtext)
+        if code != 250:
+            yield from self._reset()
+            raise smtplib.SMTPDataError(code, reply)
+        # This session has been successfully completed.  By testing exactly
+        # for equality to 0, we automatically handle the case for
+        # sessions_per_connection <= 0 meaning never close the connection.
+        self._session_count -= 1
+        if self._session_count == 0:
+            yield from self._quit()
+        return refused
+
+    def _greet(self):
+        code, reply = yield None
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, reply)
+        code, reply = yield self._command('EHLO {0}', socket.getfqdn())
+        if code != 250:
+            code, reply = yield self._command('HELO {0}', socket.getfqdn())
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, reply)
+        if self._username is not None and self._password is not None:
+            log.debug('Logging in')
+            token = base64.b64encode('\0{0}\0{1}'.format(
+                self._username, self._password).encode('utf-8'))
+            code, reply = yield self._command(
+                'AUTH PLAIN {0}', token.decode('ascii'))
+            if code not in (235, 503):
+                raise smtplib.SMTPAuthenticationError(code, reply)
+
+    def _reset(self):
+        yield self._command('RSET')
+
+    def _quit(self):
+        yield self._command('QUIT')
+        self._close()
+
+    def _command(self, template, *args):
+        return template.format(*args).encode('ascii') + CRLF
+
+    def _data(self, msgtext):
+        # Like smtplib, send the lines with CRLF line endings, and quote
+        # the lines starting with a period.
+        data = re.sub(br'(?:\r\n|\n|\r(?!\n))', CRLF, msgtext)
+        data = re.sub(br'(?m)^\.', b'..', data)
+        if not data.endswith(CRLF):
+            data += CRLF
+        return data + b'.' + CRLF
+
+    def _advance(self, reply):
+        """Pass a reply to the transaction, and send what it yields."""
+        try:
+            data = self._steps.send(reply)
+        except StopIteration as stop:
+            self._finish(stop.value)
+        except Exception as error:
+            self._fail(error)
+        else:
+            if data is not None:
+                self._transport.write(data)
+
+    def _reply(self, code, reply):
+        if self._steps is None:
+            # Nothing is waiting for this reply.
+            return
+        self._advance((code, reply))
+
+    def _lost(self, error):
+        self._transport = None
+        if self._steps is not None:
+            self._fail(smtplib.SMTPServerDisconnected(
+                'Connection unexpectedly closed: {0}'.format(error)))
+
+    def _close(self):
+        if self._transport is not None:
+            transport = self._transport
+            self._transport = None
+            transport.close()
+
+    def _finish(self, result):
+        future, self._future, self._steps = self._future, None, None
+        future.set_result(result)
+
+    def _fail(self, error):
+        # For safety, close this connection.  The next send attempt will
+        # automatically re-open it.
+        self._close()
+        future, self._future, self._steps = self._future, None, None
+        future.set_exception(error)
+
+
+
+class AsyncDeliveryMixin:
+    """Send the transactions of a delivery concurrently.
+
+    Up to `[mta] asyncio_connections` connections to the outgoing mail server
+    are used.  Mix this in before the delivery class.
+    """
+
+    def __init__(self, *args, **kws):
+        super(AsyncDeliveryMixin, self).__init__(*args, **kws)
+        self._max_connections = max(1, int(config.mta.asyncio_connections))
+        self._loop = None
+        self._queue = None
+        self._workers = []
+        self._refused = {}
+        self._error = None
+
+    def deliver(self, mlist, msg, msgdata):
+        """See `IMailTransportAgentDelivery`."""
+        self._loop = asyncio.new_event_loop()
+        # Each connection's worker takes the next transaction as soon as it
+        # is done with the last one.  At most one transaction per connection
+        # waits to be sent, so that a large personalized delivery isn't held
+        # in memory all at once.
+        try:
+            self._queue = asyncio.Queue(
+                self._max_connections, loop=self._loop)
+        except TypeError:
+            # Since Python 3.10, the queue uses the loop it is used from.
+            self._queue = asyncio.Queue(self._max_connections)
+        try:
+            refused = super(AsyncDeliveryMixin, self).deliver(
+                mlist, msg, msgdata)
+            # Tell the workers that there are no more transactions.
+            for worker in self._workers:
+                self._loop.run_until_complete(self._queue.put(None))
+            self._run_all(self._workers)
+            refused.update(self._collect())
+        finally:
+            del self._workers[:]
+            self._queue = None
+            self._refused = {}
+            self._error = None
+            self._loop.close()
+            self._loop = None
+        return refused
+
+    def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
+        """See `BaseDelivery`.
+
+        The transaction is queued, and its failures are returned by a later
+        call, or by `deliver()`.
+        """
+        sender = self._get_sender(mlist, msg, msgdata)
+        # The message is flattened when it is sent, unless its bytes have
+        # already been calculated, e.g. because they're shared by all the
+        # transactions of a bulk delivery.
+        msgtext = None
+        if self._flattened is not None and self._flattened[0] is msg:
+            msgtext = self._flattened[1]
+        if len(self._workers) < self._max_connections:
+            self._workers.append(self._start_worker())
+        # This waits for a worker to make room in the queue, if need be.
+        self._loop.run_until_complete(
+            self._queue.put((msg, sender, list(recipients), msgtext)))
+        return self._collect()
+
+    def _collect(self):
+        """Return the failures of the transactions sent so far."""
+        if self._error is not None:
+            raise self._error
+        refused, self._refused = self._refused, {}
+        return refused
+
+    def _start_worker(self):
+        """Send the queued transactions over a new connection.
+
+        :return: A future which is done when the worker is told to stop, and
+            has closed its connection.
+        :rtype: `asyncio.Future`
+        """
+        connection = AsyncConnection(self._loop, *self._connection_args)
+        stopped = asyncio.Future(loop=self._loop)
+
+        def take():
+            task = self._loop.create_task(self._queue.get())
+            task.add_done_callback(send)
+
+        def send(task):
+            transaction = task.result()
+            if transaction is None:
+                connection.quit().add_done_callback(
+                    lambda future: stopped.set_result(None))
+                return
+            msg, sender, recipients, msgtext = transaction
+            if self._error is not None:
+                # The delivery has failed; just drain the queue.
+                take()
+                return
+            try:
+                if msgtext is None:
+                    msgtext = self._flatten(msg)
+                future = connection.sendmail(sender, recipients, msgtext)
+            except Exception as error:
+                self._error = error
+                take()
+                return
+            future.add_done_callback(
+                lambda future: sent(msg, recipients, future))
+
+        def sent(msg, recipients, future):
+            try:
+                self._refused.update(future.result())
+            except (socket.error, IOError, smtplib.SMTPException) as error:
+                self._refused.update(self._refused_by_error(
+                    msg['message-id'], recipients, error))
+            except Exception as error:
+                if self._error is None:
+                    self._error = error
+            take()
+
+        take()
+        return stopped
+
+    def _run_all(self, futures):
+        """Run the event loop until all the futures are done."""
+        if not futures:
+            return
+        done = asyncio.Future(loop=self._loop)
+        remaining = len(futures)
+
+        def finished(future):
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                done.set_result(None)
+
+        for future in futures:
+            future.add_done_callback(finished)
+        self._loop.run_until_complete(done)
+
+
+
+class AsyncBulkDelivery(AsyncDeliveryMixin, BulkDelivery):
+    """Deliver the chunks of a bulk delivery concurrently."""
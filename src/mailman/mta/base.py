@@ -20,14 +20,18 @@
 __all__ = [
     'BaseDelivery',
     'IndividualDelivery',
+    'flatten',
     ]
 
 
+import io
 import copy
 import socket
 import logging
 import smtplib
+import threading
 
+from email.generator import BytesGenerator
 from mailman.config import config
 from mailman.interfaces.mta import IMailTransportAgentDelivery
 from mailman.mta.connection import Connection
@@ -37,6 +41,24 @@ from zope.interface import implementer
 log = logging.getLogger('mailman.smtp')
 
 
+
+def flatten(msg):
+    """Return the bytes of a message, as sent to the MTA.
+
+    Like `msg.as_string()`, the headers are not folded again.  The lines end
+    in CRLF, since smtplib only converts the line endings of strings.
+
+    :param msg: The message.
+    :type msg: `Message`
+    :return: The message's bytes.
+    :rtype: bytes
+    """
+    fp = io.BytesIO()
+    BytesGenerator(fp, mangle_from_=False, maxheaderlen=0).flatten(
+        msg, linesep='\r\n')
+    return fp.getvalue()
+
+
 
 @implementer(IMailTransportAgentDelivery)
 class BaseDelivery:
@@ -46,10 +68,30 @@ class BaseDelivery:
         """Create a basic deliverer."""
         username = (config.mta.smtp_user if config.mta.smtp_user else None)
         password = (config.mta.smtp_pass if config.mta.smtp_pass else None)
-        self._connection = Connection(
+        self._connection_args = (
             config.mta.smtp_host, int(config.mta.smtp_port),
             int(config.mta.max_sessions_per_connection),
             username, password)
+        # Each thread delivering through this deliverer gets its own
+        # connection, so that chunks can be sent in parallel.  All the
+        # connections made are remembered so that they can be closed.
+        self._local = threading.local()
+        self._connections = []
+        # The message being delivered and its bytes, when the same message
+        # is sent in several transactions.
+        self._flattened = None
+        # The size in bytes of the last message flattened for delivery.
+        self.size = None
+
+    @property
+    def _connection(self):
+        """The calling thread's connection to the SMTP server."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = Connection(*self._connection_args)
+            self._local.connection = connection
+            self._connections.append(connection)
+        return connection
 
     def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
         """Low-level delivery to a set of recipients.
@@ -70,28 +112,54 @@ class BaseDelivery:
         message_id = msg['message-id']
         try:
             refused = self._connection.sendmail(
-                sender, recipients, msg.as_string())
-        except smtplib.SMTPRecipientsRefused as error:
+                sender, recipients, self._flatten(msg))
+        except (socket.error, IOError, smtplib.SMTPException) as error:
+            refused = self._refused_by_error(message_id, recipients, error)
+        return refused
+
+    def _flatten(self, msg):
+        """Return the bytes of the message to send.
+
+        The bytes of the message being delivered in several transactions are
+        only calculated once.
+        """
+        if self._flattened is not None and self._flattened[0] is msg:
+            return self._flattened[1]
+        msgtext = flatten(msg)
+        self.size = len(msgtext)
+        return msgtext
+
+    def _refused_by_error(self, message_id, recipients, error):
+        """Return the delivery failures caused by an exception.
+
+        :param message_id: The Message-ID of the message being delivered.
+        :type message_id: string
+        :param recipients: The recipients of this message.
+        :type recipients: sequence
+        :param error: The exception raised while sending the message.
+        :type error: `socket.error`, `IOError` or `smtplib.SMTPException`
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`
+        :rtype: dictionary
+        """
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
             log.error('%s recipients refused: %s', message_id, error)
-            refused = error.recipients
-        except smtplib.SMTPResponseException as error:
+            return error.recipients
+        if isinstance(error, smtplib.SMTPResponseException):
             log.error('%s response exception: %s', message_id, error)
-            refused = dict(
+            return dict(
                 # recipient -> (code, error)
                 (recipient, (error.smtp_code, error.smtp_error))
                 for recipient in recipients)
-        except (socket.error, IOError, smtplib.SMTPException) as error:
-            # MTA not responding, or other socket problems, or any other
-            # kind of SMTPException.  In that case, nothing got delivered,
-            # so treat this as a temporary failure.  We use error code 444
-            # for this (temporary, unspecified failure, cf RFC 5321).
-            log.error('%s low level smtp error: %s', message_id, error)
-            error = str(error)
-            refused = dict(
-                # recipient -> (code, error)
-                (recipient, (444, error))
-                for recipient in recipients)
-        return refused
+        # MTA not responding, or other socket problems, or any other kind of
+        # SMTPException.  In that case, nothing got delivered, so treat this
+        # as a temporary failure.  We use error code 444 for this (temporary,
+        # unspecified failure, cf RFC 5321).
+        log.error('%s low level smtp error: %s', message_id, error)
+        error = str(error)
+        return dict(
+            # recipient -> (code, error)
+            (recipient, (444, error))
+            for recipient in recipients)
 
     def _get_sender(self, mlist, msg, msgdata):
         """Return the envelope sender to use.
@@ -146,25 +214,44 @@ class IndividualDelivery(BaseDelivery):
         """
         refused = {}
         recipients = msgdata.get('recipients', set())
+        # Look up which recipients are members of the mailing list all at
+        # once.  Each recipient's membership is squirreled away for use by
+        # other modules, such as the header/footer decorator.
+        members = mlist.members.get_members(recipients)
         for recipient in recipients:
             log.debug('IndividualDelivery to: %s', recipient)
-            # Make a copy of the original messages and operator on it, since
-            # we're going to munge it repeatedly for each recipient.
-            message_copy = copy.deepcopy(msg)
-            msgdata_copy = msgdata.copy()
-            # Squirrel the current recipient away in the message metadata.
-            # That way the subclass's _get_sender() override can encode the
-            # recipient address in the sender, e.g. for VERP.
-            msgdata_copy['recipient'] = recipient
-            # See if the recipient is a member of the mailing list, and if so,
-            # squirrel this information away for use by other modules, such as
-            # the header/footer decorator.  XXX 2012-03-05 this is probably
-            # highly inefficient on the database.
-            member = mlist.members.get_member(recipient)
-            msgdata_copy['member'] = member
-            for callback in self.callbacks:
-                callback(mlist, message_copy, msgdata_copy)
-            status = self._deliver_to_recipients(
-                mlist, message_copy, msgdata_copy, [recipient])
+            status = self._deliver_to_recipient(
+                mlist, msg, msgdata, recipient, members.get(recipient))
             refused.update(status)
         return refused
+
+    def _deliver_to_recipient(self, mlist, msg, msgdata, recipient, member):
+        """Craft and deliver the message for one recipient.
+
+        :param mlist: The mailing list being delivered to.
+        :type mlist: `IMailingList`
+        :param msg: The original message being delivered.
+        :type msg: `Message`
+        :param msgdata: Additional message metadata for this delivery.
+        :type msgdata: dictionary
+        :param recipient: The recipient of this message.
+        :type recipient: string
+        :param member: The recipient's membership in the mailing list, or
+            None if the recipient is not a member.
+        :type member: `IMember`
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`
+        :rtype: dictionary
+        """
+        # Make a copy of the original messages and operator on it, since
+        # we're going to munge it repeatedly for each recipient.
+        message_copy = copy.deepcopy(msg)
+        msgdata_copy = msgdata.copy()
+        # Squirrel the current recipient away in the message metadata.  That
+        # way the subclass's _get_sender() override can encode the recipient
+        # address in the sender, e.g. for VERP.
+        msgdata_copy['recipient'] = recipient
+        msgdata_copy['member'] = member
+        for callback in self.callbacks:
+            callback(mlist, message_copy, msgdata_copy)
+        return self._deliver_to_recipients(
+            mlist, message_copy, msgdata_copy, [recipient])
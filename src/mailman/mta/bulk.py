@@ -22,7 +22,9 @@ __all__ = [
     ]
 
 
-from mailman.mta.base import BaseDelivery
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from mailman.mta.base import BaseDelivery, flatten
 
 
 # A mapping of top-level domains to bucket numbers.  The zeroth bucket is
@@ -42,18 +44,25 @@ CHUNKMAP = dict(
 class BulkDelivery(BaseDelivery):
     """Deliver messages to the MSA in as few sessions as possible."""
 
-    def __init__(self, max_recipients=None):
+    def __init__(self, max_recipients=None, max_threads=None):
         """See `BaseDelivery`.
 
         :param max_recipients: The maximum number of recipients per delivery
             chunk.  None, zero or less means to group all recipients into one
             big chunk.
         :type max_recipients: integer
+        :param max_threads: The maximum number of chunks to deliver in
+            parallel, each over its own connection to the SMTP server.  None,
+            zero or one means to deliver the chunks one after another.
+        :type max_threads: integer
         """
         super(BulkDelivery, self).__init__()
         self._max_recipients = (max_recipients
                                 if max_recipients is not None
                                 else 0)
+        self._max_threads = (max_threads
+                             if max_threads is not None
+                             else 0)
 
     def chunkify(self, recipients):
         """Split a set of recipients into chunks.
@@ -100,8 +109,37 @@ class BulkDelivery(BaseDelivery):
     def deliver(self, mlist, msg, msgdata):
         """See `IMailTransportAgentDelivery`."""
         refused = {}
-        for recipients in self.chunkify(msgdata.get('recipients', set())):
-            chunk_refused = self._deliver_to_recipients(
-                mlist, msg, msgdata, recipients)
-            refused.update(chunk_refused)
+        chunks = list(self.chunkify(msgdata.get('recipients', set())))
+        if len(chunks) == 0:
+            return refused
+        # Every chunk is sent the same message, so it is only flattened once.
+        msgtext = flatten(msg)
+        self._flattened = (msg, msgtext)
+        self.size = len(msgtext)
+        try:
+            if self._max_threads <= 1 or len(chunks) == 1:
+                for recipients in chunks:
+                    chunk_refused = self._deliver_to_recipients(
+                        mlist, msg, msgdata, recipients)
+                    refused.update(chunk_refused)
+            else:
+                self._deliver_concurrently(mlist, msg, msgdata, chunks,
+                                           refused)
+        finally:
+            self._flattened = None
         return refused
+
+    def _deliver_concurrently(self, mlist, msg, msgdata, chunks, refused):
+        """Deliver the chunks from a pool of threads."""
+        deliver_chunk = partial(
+            self._deliver_to_recipients, mlist, msg, msgdata)
+        try:
+            with ThreadPoolExecutor(
+                    min(self._max_threads, len(chunks))) as executor:
+                for chunk_refused in executor.map(deliver_chunk, chunks):
+                    refused.update(chunk_refused)
+        finally:
+            # The threads are gone, so close their connections.
+            for connection in self._connections:
+                connection.quit()
+            del self._connections[:]
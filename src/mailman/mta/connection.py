@@ -74,7 +74,12 @@ class Connection:
         self._session_count = self._sessions_per_connection
 
     def sendmail(self, envsender, recipients, msgtext):
-        """Mimic `smtplib.SMTP.sendmail`."""
+        """Mimic `smtplib.SMTP.sendmail`.
+
+        The message text should be bytes with CRLF line endings, as returned
+        by `flatten()`, which are sent unchanged.  Strings must be ASCII, and
+        are encoded with their line endings converted to CRLF.
+        """
         if as_boolean(config.devmode.enabled):
             # Force the recipients to the specified address, but still deliver
             # to the same number of recipients.
@@ -18,6 +18,9 @@
 """Generic delivery."""
 
 __all__ = [
+    'AsyncDeliver',
+    'Deliver',
+    'SplicingDeliver',
     'deliver',
     ]
 
@@ -26,12 +29,15 @@ import time
 import logging
 
 from mailman.config import config
+from mailman.core import metrics
 from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.mta import SomeRecipientsFailed
+from mailman.mta.asynchronous import AsyncBulkDelivery, AsyncDeliveryMixin
 from mailman.mta.decorating import DecoratingMixin
 from mailman.mta.personalized import PersonalizedMixin
+from mailman.mta.splicing import SplicingMixin
 from mailman.mta.verp import VERPMixin
-from mailman.mta.base import IndividualDelivery
+from mailman.mta.base import IndividualDelivery, flatten
 from mailman.mta.bulk import BulkDelivery
 from mailman.utilities.string import expand
 
@@ -39,6 +45,13 @@ from mailman.utilities.string import expand
 COMMA = ','
 log = logging.getLogger('mailman.smtp')
 
+delivery_time = metrics.histogram(
+    'mailman_delivery_seconds',
+    'The time it took to deliver a message to all its recipients.')
+refusals = metrics.counter(
+    'mailman_smtp_refusals_total',
+    'The number of recipients refused by the MTA, by SMTP reply code.')
+
 
 
 class Deliver(VERPMixin, DecoratingMixin, PersonalizedMixin,
@@ -62,6 +75,16 @@ class Deliver(VERPMixin, DecoratingMixin, PersonalizedMixin,
             ])
 
 
+
+class SplicingDeliver(SplicingMixin, Deliver):
+    """Like `Deliver`, but splice the messages from a flattened template."""
+
+
+
+class AsyncDeliver(AsyncDeliveryMixin, SplicingDeliver):
+    """Like `Deliver`, but send the messages concurrently."""
+
+
 
 def deliver(mlist, msg, msgdata):
     """Deliver a message to the outgoing mail server."""
@@ -73,12 +96,15 @@ def deliver(mlist, msg, msgdata):
     # Which delivery agent should we use?  Several situations can cause us to
     # use individual delivery.  If not specified, use bulk delivery.  See the
     # to-outgoing handler for when the 'verp' key is set in the metadata.
-    if msgdata.get('verp', False):
-        agent = Deliver()
-    elif mlist.personalize != Personalization.none:
-        agent = Deliver()
+    asynchronous = (config.mta.delivery_engine == 'asyncio')
+    if msgdata.get('verp', False) or (
+            mlist.personalize != Personalization.none):
+        agent = (AsyncDeliver() if asynchronous else SplicingDeliver())
+    elif asynchronous:
+        agent = AsyncBulkDelivery(int(config.mta.max_recipients))
     else:
-        agent = BulkDelivery(int(config.mta.max_recipients))
+        agent = BulkDelivery(int(config.mta.max_recipients),
+                             int(config.mta.max_delivery_threads))
     log.debug('Using agent: %s', agent)
     # Keep track of the original recipients and the original sender for
     # logging purposes.
@@ -89,10 +115,14 @@ def deliver(mlist, msg, msgdata):
     t0 = time.time()
     refused = agent.deliver(mlist, msg, msgdata)
     t1 = time.time()
+    delivery_time.observe(t1 - t0)
     # Log this posting.
     size = getattr(msg, 'original_size', msgdata.get('original_size'))
     if size is None:
-        size = len(msg.as_string())
+        # The agent already flattened the message to send it.
+        size = agent.size
+    if size is None:
+        size = len(flatten(msg))
     substitutions = dict(
         msgid       = msg.get('message-id', 'n/a'),
         listname    = mlist.fqdn_listname,
@@ -126,6 +156,7 @@ def deliver(mlist, msg, msgdata):
     temporary_failures = []
     permanent_failures = []
     for recipient, (code, smtp_message) in refused.items():
+        refusals.inc(code=code)
         # RFC 5321, $4.5.3.1.10 says:
         #
         #   RFC 821 [1] incorrectly listed the error where an SMTP server
@@ -50,17 +50,25 @@ class PersonalizedMixin:
         # Personalize the To header if the list requests it.
         if mlist.personalize != Personalization.full:
             return
-        recipient = msgdata['recipient']
+        msg.replace_header('To', self._personalized_to(msgdata['recipient']))
+
+    def _personalized_to(self, recipient):
+        """Return the personalized To header for the recipient.
+
+        :param recipient: The recipient's address.
+        :type recipient: string
+        :return: The value of the recipient's To header.
+        :rtype: string
+        """
         user_manager = getUtility(IUserManager)
         user = user_manager.get_user(recipient)
         if user is None:
-            msg.replace_header('To', recipient)
-        else:
-            # Convert the unicode name to an email-safe representation.
-            # Create a Header instance for the name so that it's properly
-            # encoded for email transport.
-            name = Header(user.display_name).encode()
-            msg.replace_header('To', formataddr((name, recipient)))
+            return recipient
+        # Convert the unicode name to an email-safe representation.  Create a
+        # Header instance for the name so that it's properly encoded for email
+        # transport.
+        name = Header(user.display_name).encode()
+        return formataddr((name, recipient))
 
 
 
@@ -0,0 +1,209 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Personalized delivery spliced together from a flattened message.
+
+The callbacks of `Deliver` only change a few places in each recipient's copy
+of the message: the To header, the X-Mailman-Copy header, and the member
+substitutions in the header and footer decorations.  Instead of copying and
+changing the message for every recipient, the message is flattened once with
+placeholders in those places, and each recipient's bytes are joined together
+from the pieces.
+"""
+
+__all__ = [
+    'SplicingMixin',
+    ]
+
+
+import os
+import re
+import copy
+import logging
+import binascii
+
+from mailman.handlers.decorate import member_substitutions
+from mailman.mta.base import flatten
+from mailman.mta.decorating import DecoratingMixin
+from mailman.mta.personalized import PersonalizedMixin
+from mailman.mta.verp import VERPMixin
+
+
+log = logging.getLogger('mailman.smtp')
+
+# The callbacks whose changes to the message can be spliced.
+SPLICED_CALLBACKS = (
+    VERPMixin.avoid_duplicates,
+    DecoratingMixin.decorate,
+    PersonalizedMixin.personalize_to,
+    )
+# The decoration substitutions which differ between members.
+MEMBER_KEYS = (
+    'user_address',
+    'user_delivered_to',
+    'user_language',
+    'user_name',
+    'user_optionsurl',
+    )
+# Values which are spliced in verbatim give the same bytes as the callbacks.
+# They must not change the charset or transfer encoding of the message, nor
+# be changed by the clean up of the decorations' line endings.
+SPLICEABLE = re.compile(r'[\x20-\x7e]*[\x21-\x7e]\Z')
+# Nothing can be spliced into parts with these transfer encodings, since the
+# values would have to be encoded too, e.g. an = in a quoted-printable body,
+# and the encoded lines would be broken up in other places.
+ENCODED = ('base64', 'quoted-printable')
+
+
+
+def _placeholder():
+    return 'splice' + binascii.hexlify(os.urandom(8)).decode('ascii')
+
+
+
+class SplicingMixin:
+    """Splice each recipient's message from a flattened template.
+
+    Mix this in before `Deliver`.  The message for a recipient which can't be
+    spliced, e.g. because its decorations are re-encoded, is crafted by the
+    callbacks as usual.
+    """
+
+    def __init__(self, *args, **kws):
+        super(SplicingMixin, self).__init__(*args, **kws)
+        # The templates of the message being delivered, by kind of recipient.
+        self._templates = None
+
+    def deliver(self, mlist, msg, msgdata):
+        """See `IMailTransportAgentDelivery`."""
+        if all(getattr(callback, '__func__', None) in SPLICED_CALLBACKS
+               for callback in self.callbacks):
+            self._templates = {}
+        try:
+            return super(SplicingMixin, self).deliver(mlist, msg, msgdata)
+        finally:
+            self._templates = None
+
+    def _deliver_to_recipient(self, mlist, msg, msgdata, recipient, member):
+        """See `IndividualDelivery`."""
+        msgtext = self._splice(mlist, msg, msgdata, recipient, member)
+        if msgtext is None:
+            return super(SplicingMixin, self)._deliver_to_recipient(
+                mlist, msg, msgdata, recipient, member)
+        msgdata_copy = msgdata.copy()
+        msgdata_copy['recipient'] = recipient
+        msgdata_copy['member'] = member
+        # The spliced bytes are sent in place of the original message's.
+        self._flattened = (msg, msgtext)
+        self.size = len(msgtext)
+        try:
+            return self._deliver_to_recipients(
+                mlist, msg, msgdata_copy, [recipient])
+        finally:
+            self._flattened = None
+
+    def _splice(self, mlist, msg, msgdata, recipient, member):
+        """Return the recipient's message bytes, or None if not spliceable."""
+        if self._templates is None:
+            return None
+        kind = (member is not None,
+                recipient in msgdata.get('add-dup-header', {}))
+        if kind not in self._templates:
+            self._templates[kind] = self._make_template(
+                mlist, msg, msgdata, *kind)
+        template = self._templates[kind]
+        if template is None:
+            return None
+        # Only look up what the template actually uses.
+        keys = set(template[1::2])
+        values = {}
+        if 'to' in keys:
+            values['to'] = self._personalized_to(recipient)
+        if keys.intersection(MEMBER_KEYS):
+            values.update(member_substitutions(member, recipient))
+        pieces = list(template)
+        for i in range(1, len(pieces), 2):
+            value = values[pieces[i]]
+            if not isinstance(value, str) or SPLICEABLE.match(value) is None:
+                return None
+            pieces[i] = value.encode('ascii')
+        return b''.join(pieces)
+
+    def _make_template(self, mlist, msg, msgdata, is_member, duplicate):
+        """Flatten the message with placeholders for the recipient.
+
+        :return: The pieces of the flattened message, alternating with the
+            names of the values spliced between them, or None if the message
+            can't be spliced.
+        :rtype: list
+        """
+        keys = ('to',) + (MEMBER_KEYS if is_member else ())
+        renderings = []
+        for attempt in range(2):
+            placeholders = dict((key, _placeholder()) for key in keys)
+            renderings.append((placeholders, self._render(
+                mlist, msg, msgdata, placeholders, is_member, duplicate)))
+        (placeholders, message), (check_placeholders, check) = renderings
+        for part in message.walk():
+            encoding = part.get('content-transfer-encoding', '').lower()
+            if encoding in ENCODED and any(
+                    placeholder in part.get_payload()
+                    for placeholder in placeholders.values()):
+                log.debug('%s cannot be spliced into its %s part',
+                          msg.get('message-id', 'n/a'), encoding)
+                return None
+        msgtext = flatten(message)
+        check = flatten(check)
+        names = dict((placeholder.encode('ascii'), key)
+                     for key, placeholder in placeholders.items())
+        pattern = re.compile(b'(' + b'|'.join(names) + b')')
+        template = pattern.split(msgtext)
+        template[1::2] = [names[placeholder] for placeholder in template[1::2]]
+        # The placeholders must end up verbatim in the flattened message,
+        # which is not the case e.g. when the decorated body is base64
+        # encoded, or gets a new MIME boundary.  Make sure that the second
+        # rendering can be spliced from the first one's pieces.
+        pieces = list(template)
+        for i in range(1, len(pieces), 2):
+            pieces[i] = check_placeholders[pieces[i]].encode('ascii')
+        if b''.join(pieces) != check:
+            log.debug('%s cannot be spliced', msg.get('message-id', 'n/a'))
+            return None
+        return template
+
+    def _render(self, mlist, msg, msgdata, placeholders, is_member,
+                duplicate):
+        """Run the callbacks with placeholders for the recipient.
+
+        :return: The recipient's copy of the message.
+        """
+        message_copy = copy.deepcopy(msg)
+        msgdata_copy = msgdata.copy()
+        msgdata_copy['recipient'] = placeholders['to']
+        msgdata_copy['member'] = None
+        msgdata_copy['add-dup-header'] = (
+            set([placeholders['to']]) if duplicate else set())
+        if is_member:
+            # Like the member substitutions, these are overridden by any
+            # decoration data.
+            substitutions = dict(
+                (key, placeholders[key]) for key in MEMBER_KEYS)
+            substitutions.update(msgdata.get('decoration-data', {}))
+            msgdata_copy['decoration-data'] = substitutions
+        for callback in self.callbacks:
+            callback(mlist, message_copy, msgdata_copy)
+        return message_copy
@@ -0,0 +1,219 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the asyncio delivery engine."""
+
+__all__ = [
+    'TestAsyncDelivery',
+    ]
+
+
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.interfaces.mta import SomeRecipientsFailed
+from mailman.mta.asynchronous import (
+    AsyncBulkDelivery, AsyncConnection, AsyncDeliveryMixin)
+from mailman.mta.deliver import AsyncDeliver, deliver
+from mailman.mta.verp import VERPDelivery
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import SMTPLayer
+from unittest.mock import patch
+
+
+
+class TestAsyncDelivery(unittest.TestCase):
+    """Test the asyncio delivery engine."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+This is a test.
+.A line starting with a period.
+""")
+        self._recipients = set(
+            'person_{0:02d}@example.com'.format(i) for i in range(100))
+
+    def _delivered(self):
+        recipients = []
+        for message in SMTPLayer.smtpd.messages:
+            self.assertEqual(message['message-id'], '<ant>')
+            self.assertEqual(message.get_payload().splitlines(), [
+                'This is a test.',
+                '.A line starting with a period.',
+                ])
+            recipients.extend(
+                address.strip()
+                for address in message['x-rcptto'].split(','))
+        return recipients
+
+    @configuration('mta', asyncio_connections=3)
+    def test_bulk_delivery(self):
+        # The chunks are delivered concurrently, over at most the configured
+        # number of connections.
+        bulk = AsyncBulkDelivery(10)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        recipients = self._delivered()
+        self.assertEqual(len(recipients), 100)
+        self.assertEqual(set(recipients), self._recipients)
+        self.assertEqual(SMTPLayer.smtpd.get_connection_count(), 3)
+
+    @configuration('mta', asyncio_connections=1,
+                   max_sessions_per_connection=2)
+    def test_sessions_per_connection(self):
+        # Connections are closed and re-opened after the configured number of
+        # sessions.
+        bulk = AsyncBulkDelivery(20)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        self.assertEqual(len(self._delivered()), 100)
+        self.assertEqual(SMTPLayer.smtpd.get_connection_count(), 3)
+
+    def test_individual_delivery(self):
+        # Personalized deliveries send each recipient their own message.
+        agent = AsyncDeliver()
+        recipients = set(list(self._recipients)[:5])
+        refused = agent.deliver(
+            self._mlist, self._msg, dict(recipients=recipients, verp=True))
+        self.assertEqual(refused, {})
+        messages = list(SMTPLayer.smtpd.messages)
+        self.assertEqual(len(messages), 5)
+        self.assertEqual(
+            set(message['x-rcptto'] for message in messages), recipients)
+        # The messages are VERP'd.
+        for message in messages:
+            self.assertEqual(message['x-mailfrom'],
+                             'test-bounces+{0}={1}@example.com'.format(
+                                 *message['x-rcptto'].split('@')))
+
+    @configuration('mta', asyncio_connections=2)
+    def test_transactions_are_streamed(self):
+        # The transactions are sent as they are made, and each message is
+        # only flattened when a connection is ready to send it, so only a
+        # few of them are held in memory at any time.
+        class AsyncVERPDelivery(AsyncDeliveryMixin, VERPDelivery):
+            pass
+        agent = AsyncVERPDelivery()
+        made = []
+        sent = []
+        unsent = []
+        get_sender = agent._get_sender
+        sendmail = AsyncConnection.sendmail
+        def make(mlist, msg, msgdata):
+            unsent.append(len(made) - len(sent))
+            made.append(msg)
+            return get_sender(mlist, msg, msgdata)
+        def send(connection, sender, recipients, msgtext):
+            future = sendmail(connection, sender, recipients, msgtext)
+            future.add_done_callback(sent.append)
+            return future
+        agent._get_sender = make
+        with patch.object(AsyncConnection, 'sendmail', send):
+            refused = agent.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        self.assertEqual(len(self._delivered()), 100)
+        self.assertEqual(len(sent), 100)
+        self.assertLessEqual(max(unsent), 4)
+
+    def test_refused_recipients(self):
+        # Recipients refused by the server are returned like the smtplib
+        # engine does.
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 500))
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 500))
+        bulk = AsyncBulkDelivery()
+        recipients = ['anne@example.com', 'bart@example.com',
+                      'cate@example.com']
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=recipients))
+        self.assertEqual(len(refused), 2)
+        for code, reply in refused.values():
+            self.assertEqual(code, 500)
+            self.assertEqual(reply, b'Error: SMTPRecipientsRefused')
+        delivered = self._delivered()
+        self.assertEqual(len(delivered), 1)
+        self.assertEqual(set(refused) | set(delivered), set(recipients))
+
+    def test_response_exception(self):
+        # A failed transaction fails all its recipients.
+        SMTPLayer.smtpd.err_queue.put(('mail', 450))
+        bulk = AsyncBulkDelivery()
+        recipients = ['anne@example.com', 'bart@example.com']
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=recipients))
+        self.assertEqual(refused, {
+            'anne@example.com': (450, b'Error: SMTPResponseException'),
+            'bart@example.com': (450, b'Error: SMTPResponseException'),
+            })
+        self.assertEqual(self._delivered(), [])
+
+    @configuration('mta', smtp_port=9)
+    def test_connection_refused(self):
+        # When the server can't be reached, the recipients are temporary
+        # failures.
+        bulk = AsyncBulkDelivery()
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=['anne@example.com']))
+        self.assertEqual(refused['anne@example.com'][0], 444)
+
+    @configuration('mta', smtp_user='testuser', smtp_pass='testpass')
+    def test_authentication(self):
+        # The engine logs in to the server.
+        bulk = AsyncBulkDelivery()
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=['anne@example.com']))
+        self.assertEqual(refused, {})
+        self.assertEqual(SMTPLayer.smtpd.get_authentication_credentials(),
+                         'PLAIN AHRlc3R1c2VyAHRlc3RwYXNz')
+
+    @configuration('mta', smtp_user='baduser', smtp_pass='badpass')
+    def test_authentication_failure(self):
+        bulk = AsyncBulkDelivery()
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=['anne@example.com']))
+        self.assertEqual(refused, {
+            'anne@example.com': (571, b'Bad authentication')})
+
+    @configuration('mta', delivery_engine='asyncio')
+    def test_some_recipients_failed(self):
+        # The engine is selected in the configuration, and its failures are
+        # reported to the outgoing runner.
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 450))
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 550))
+        recipients = ['anne@example.com', 'bart@example.com',
+                      'cate@example.com']
+        with self.assertRaises(SomeRecipientsFailed) as cm:
+            deliver(self._mlist, self._msg, dict(recipients=recipients))
+        self.assertEqual(len(cm.exception.temporary_failures), 1)
+        self.assertEqual(len(cm.exception.permanent_failures), 1)
+        delivered = self._delivered()
+        self.assertEqual(len(delivered), 1)
+        self.assertEqual(
+            set(cm.exception.temporary_failures +
+                cm.exception.permanent_failures + delivered),
+            set(recipients))
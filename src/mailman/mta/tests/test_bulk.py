@@ -0,0 +1,186 @@
+# Copyright (C) 2014-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test bulk delivery."""
+
+__all__ = [
+    'TestBulkDelivery',
+    'TestDeliveryOverSMTP',
+    'TestParallelBulkDelivery',
+    ]
+
+
+import re
+import smtplib
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.mta.base import flatten
+from mailman.mta.bulk import BulkDelivery
+from mailman.mta.connection import Connection
+from mailman.mta.deliver import deliver
+from mailman.testing.helpers import (
+    LogFileMark, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer, SMTPLayer
+from unittest.mock import patch
+
+
+
+class TestBulkDelivery(unittest.TestCase):
+    """Test the bulk delivery of a message."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+This is a test.
+""")
+        self._recipients = set(
+            'person_{0:02d}@example.com'.format(i) for i in range(100))
+        patcher = patch.object(Connection, 'sendmail', return_value={})
+        self._sendmail = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_flatten_once(self):
+        # The message is flattened to bytes once, and the same bytes are sent
+        # in every chunk.
+        bulk = BulkDelivery(20)
+        with patch('mailman.mta.bulk.flatten', wraps=flatten) as flat, \
+             patch('mailman.mta.base.flatten', side_effect=AssertionError):
+            refused = bulk.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        self.assertEqual(flat.call_count, 1)
+        self.assertEqual(self._sendmail.call_count, 5)
+        msgtexts = set(call[0][2] for call in self._sendmail.call_args_list)
+        self.assertEqual(msgtexts, {flatten(self._msg)})
+        self.assertEqual(bulk.size, len(flatten(self._msg)))
+
+    def test_long_headers_not_refolded(self):
+        # Like msg.as_string(), the bytes keep the headers as they are.
+        self._msg['X-Long'] = ' '.join('word{0}'.format(i) for i in range(30))
+        self.assertEqual(flatten(self._msg),
+                         self._msg.as_string().replace(
+                             '\n', '\r\n').encode('ascii'))
+
+    def test_size_logged_without_flattening_again(self):
+        # The size of the message is logged from the delivery's bytes.
+        del self._msg.original_size
+        mark = LogFileMark('mailman.smtp')
+        with patch('mailman.mta.deliver.flatten',
+                   side_effect=AssertionError):
+            deliver(self._mlist, self._msg,
+                    dict(recipients=self._recipients))
+        self.assertIn('{0} bytes'.format(len(flatten(self._msg))),
+                      mark.read())
+
+
+
+class TestParallelBulkDelivery(unittest.TestCase):
+    """Test delivering the chunks in parallel."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+This is a test.
+""")
+        self._recipients = set(
+            'person_{0:02d}@example.com'.format(i) for i in range(100))
+
+    def test_parallel_delivery(self):
+        # Every chunk is delivered, over up to one connection per thread.
+        bulk = BulkDelivery(20, 4)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        messages = list(SMTPLayer.smtpd.messages)
+        self.assertEqual(len(messages), 5)
+        delivered = set()
+        for message in messages:
+            self.assertEqual(message['message-id'], '<ant>')
+            delivered.update(
+                address.strip()
+                for address in message['x-rcptto'].split(','))
+        self.assertEqual(delivered, self._recipients)
+        self.assertLessEqual(SMTPLayer.smtpd.get_connection_count(), 4)
+
+    def test_refused_recipients_merged(self):
+        # The recipients refused in any chunk are all returned.
+        SMTPLayer.smtpd.err_queue.put(('mail', 450))
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 500))
+        bulk = BulkDelivery(20, 4)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        codes = sorted(code for code, message in refused.values())
+        # A whole chunk refused at MAIL FROM, and one recipient at RCPT TO.
+        self.assertEqual(codes, [450] * 20 + [500])
+        self.assertEqual(len(list(SMTPLayer.smtpd.messages)), 4)
+
+
+
+class TestDeliveryOverSMTP(unittest.TestCase):
+    """Test what is sent to the MTA."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+
+    def test_crlf_line_endings(self):
+        # smtplib leaves the line endings of bytes alone, so the message is
+        # flattened with CRLF line endings.  Otherwise, e.g. the MTA doesn't
+        # undo the dot stuffing of the lines.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+A line.
+.A line starting with a dot.
+""")
+        sent = []
+        send = smtplib.SMTP.send
+        def record(connection, data):
+            sent.append(data)
+            return send(connection, data)
+        with patch.object(smtplib.SMTP, 'send', autospec=True,
+                          side_effect=record):
+            BulkDelivery().deliver(
+                self._mlist, msg, dict(recipients={'bart@example.com'}))
+        data = [data for data in sent
+                if isinstance(data, bytes) and b'<ant>' in data]
+        self.assertEqual(len(data), 1)
+        self.assertIn(b'\r\n\r\nA line.\r\n..A line', data[0])
+        self.assertIsNone(re.search(b'[^\r]\n', data[0]))
+        messages = list(SMTPLayer.smtpd.messages)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].get_payload().splitlines(),
+                         ['A line.', '.A line starting with a dot.'])
@@ -30,10 +30,12 @@ import unittest
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.interfaces.mailinglist import Personalization
+from mailman.model.roster import MemberRoster
 from mailman.mta.deliver import Deliver
 from mailman.testing.helpers import (
     specialized_message_from_string as mfs, subscribe)
 from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
 
 
 
@@ -109,6 +111,22 @@ options  : $user_optionsurl
         member = _msgdata.get('member')
         self.assertEqual(member, self._anne)
 
+    def test_members_looked_up_together(self):
+        # The recipients' memberships are looked up all at once, not one
+        # recipient at a time.
+        msgdata = dict(recipients=['anne@example.org', 'bart@example.org'])
+        agent = DeliverTester()
+        with patch.object(MemberRoster, 'get_member',
+                          side_effect=AssertionError):
+            refused = agent.deliver(self._mlist, self._msg, msgdata)
+        self.assertEqual(len(refused), 0)
+        members = dict((_msgdata['recipient'], _msgdata['member'])
+                       for _mlist, _msg, _msgdata, _recipients in _deliveries)
+        self.assertEqual(members, {
+            'anne@example.org': self._anne,
+            'bart@example.org': None,
+            })
+
     def test_decoration(self):
         msgdata = dict(recipients=['anne@example.org'])
         agent = DeliverTester()
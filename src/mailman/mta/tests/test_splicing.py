@@ -0,0 +1,193 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the splicing of personalized messages."""
+
+__all__ = [
+    'TestSplicing',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.mailinglist import Personalization
+from mailman.mta.base import IndividualDelivery
+from mailman.mta.connection import Connection
+from mailman.mta.deliver import Deliver, SplicingDeliver
+from mailman.mta.splicing import SplicingMixin
+from mailman.testing.helpers import (
+    specialized_message_from_string as mfs, subscribe)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+
+class TestSplicing(unittest.TestCase):
+    """Test the splicing of personalized messages."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._mlist.personalize = Personalization.full
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+This is a test.
+""")
+        self._msgdata = dict(
+            recipients=['bart@example.com', 'cris@example.com'],
+            verp=True)
+        # Set up a personalized footer for decoration.
+        self._template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._template_dir)
+        path = os.path.join(self._template_dir,
+                            'site', 'en', 'member-footer.txt')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            print("""\
+address: $user_address
+name   : $user_name
+list   : $display_name""", file=fp)
+        config.push('templates', """
+        [paths.testing]
+        template_dir: {0}
+        """.format(self._template_dir))
+        self.addCleanup(config.pop, 'templates')
+        self._mlist.footer_uri = 'mailman:///member-footer.txt'
+        patcher = patch.object(Connection, 'sendmail', return_value={})
+        self._sendmail = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _deliver(self, agent):
+        # Return the envelope sender and the bytes sent to each recipient.
+        self._sendmail.reset_mock()
+        refused = agent.deliver(self._mlist, self._msg, self._msgdata)
+        self.assertEqual(refused, {})
+        sent = {}
+        for call in self._sendmail.call_args_list:
+            sender, recipients, msgtext = call[0]
+            self.assertEqual(len(recipients), 1)
+            sent[recipients[0]] = (sender, msgtext)
+        self.assertEqual(len(sent), len(self._msgdata['recipients']))
+        return sent
+
+    def _assert_spliced(self, crafted_count):
+        # The spliced messages are the same as the crafted ones.
+        crafted = self._deliver(Deliver())
+        with patch.object(IndividualDelivery, '_deliver_to_recipient',
+                          autospec=True,
+                          side_effect=IndividualDelivery._deliver_to_recipient
+                          ) as craft:
+            spliced = self._deliver(SplicingDeliver())
+        self.assertEqual(spliced, crafted)
+        self.assertEqual(craft.call_count, crafted_count)
+        return spliced
+
+    def test_splice_non_members(self):
+        # The message is only rendered to make the template, and each
+        # recipient gets their own To header and VERP'd sender.
+        with patch.object(SplicingMixin, '_render', autospec=True,
+                          side_effect=SplicingMixin._render) as render:
+            sent = self._assert_spliced(0)
+        self.assertEqual(render.call_count, 2)
+        sender, msgtext = sent['cris@example.com']
+        self.assertEqual(sender, 'test-bounces+cris=example.com@example.com')
+        self.assertIn(b'\r\nTo: cris@example.com\r\n', msgtext)
+        self.assertEqual(msgtext.split(b'\r\n')[-5:], [
+            b'This is a test.',
+            b'address: $user_address',
+            b'name   : $user_name',
+            b'list   : Test',
+            b'',
+            ])
+
+    def test_splice_duplicate_header(self):
+        # Only the recipients which already got the message get the
+        # X-Mailman-Copy header.
+        self._msgdata['add-dup-header'] = set(['cris@example.com'])
+        sent = self._assert_spliced(0)
+        self.assertNotIn(b'X-Mailman-Copy', sent['bart@example.com'][1])
+        self.assertIn(b'\r\nX-Mailman-Copy: yes\r\n',
+                      sent['cris@example.com'][1])
+
+    def test_splice_members(self):
+        # The member substitutions are spliced into the footer.
+        subscribe(self._mlist, 'Bart', email='bart@example.com')
+        subscribe(self._mlist, 'Cris', email='cris@example.com')
+        sent = self._assert_spliced(0)
+        self.assertEqual(sent['bart@example.com'][1].split(b'\r\n')[-4:], [
+            b'address: bart@example.com',
+            b'name   : Bart Person',
+            b'list   : Test',
+            b'',
+            ])
+
+    def test_non_ascii_name_not_spliced(self):
+        # A name which would change the charset of the footer is not spliced.
+        subscribe(self._mlist, 'Bart', email='bart@example.com')
+        member = subscribe(self._mlist, 'Cris', email='cris@example.com')
+        member.user.display_name = 'Cr\xeds Person'
+        self._assert_spliced(1)
+
+    def test_base64_not_spliced(self):
+        # The decorated body is base64 encoded, so the member substitutions
+        # can't be spliced into it.
+        subscribe(self._mlist, 'Bart', email='bart@example.com')
+        subscribe(self._mlist, 'Cris', email='cris@example.com')
+        self._msg.set_payload('Voil\xe0.\n'.encode('utf-8'), 'utf-8')
+        self._assert_spliced(2)
+
+    def test_quoted_printable_not_spliced(self):
+        # The decorated body of an iso-8859-1 list is quoted-printable
+        # encoded, so e.g. the = in an address must be encoded too, and the
+        # member substitutions can't be spliced into it.
+        self._mlist.preferred_language = 'fr'
+        self._msgdata['recipients'] = [
+            'bart@example.com', 'foo=bar@example.com']
+        subscribe(self._mlist, 'Bart', email='bart@example.com')
+        subscribe(self._mlist, 'Foo', email='foo=bar@example.com')
+        self._msg.set_payload('Voil\xe0.\n'.encode('iso-8859-1'), 'iso-8859-1')
+        sent = self._assert_spliced(2)
+        msgtext = sent['foo=bar@example.com'][1]
+        self.assertIn(b'Content-Transfer-Encoding: quoted-printable\r\n',
+                      msgtext)
+        self.assertIn(b'address: foo=3Dbar@example.com', msgtext)
+
+    def test_base64_non_members(self):
+        # Without member substitutions in the body, only the To header is
+        # spliced.
+        self._msg.set_payload('Voil\xe0.\n'.encode('utf-8'), 'utf-8')
+        sent = self._assert_spliced(0)
+        self.assertIn(b'Content-Transfer-Encoding: base64\r\n',
+                      sent['bart@example.com'][1])
+
+    def test_other_callbacks_not_spliced(self):
+        # Messages changed by unknown callbacks are crafted as usual.
+        agent = SplicingDeliver()
+        agent.callbacks.append(lambda mlist, msg, msgdata: None)
+        with patch('mailman.mta.splicing.flatten') as flatten:
+            self._deliver(agent)
+        self.assertEqual(flatten.call_count, 0)
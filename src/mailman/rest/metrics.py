@@ -0,0 +1,48 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""<api>/metrics."""
+
+__all__ = [
+    'Metrics',
+    ]
+
+
+from mailman.config import config
+from mailman.core import metrics
+from mailman.rest.helpers import okay
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+
+class Metrics:
+    """The metrics of all of Mailman's processes, for Prometheus."""
+
+    def on_get(self, request, response):
+        """<api>/metrics"""
+        # Make sure our own metrics are included.
+        metrics.flush()
+        collected = metrics.collect()
+        collected['mailman_queue_files'] = dict(
+            kind='gauge',
+            help='The number of files in each queue.',
+            samples=[[dict(queue=name), len(switchboard.files)]
+                     for name, switchboard in config.switchboards.items()])
+        response.content_type = CONTENT_TYPE
+        okay(response, metrics.render(collected))
@@ -36,6 +36,7 @@ from mailman.rest.helpers import (
     BadRequest, NotFound, child, etag, no_content, not_found, okay, path_to)
 from mailman.rest.lists import AList, AllLists, Styles
 from mailman.rest.members import AMember, AllMembers, FindMembers
+from mailman.rest.metrics import Metrics
 from mailman.rest.preferences import ReadOnlyPreferences
 from mailman.rest.queues import AQueue, AQueueFile, AllQueues
 from mailman.rest.templates import TemplateFinder
@@ -251,6 +252,13 @@ class TopLevel:
         else:
             return BadRequest(), []
 
+    @child()
+    def metrics(self, request, segments):
+        """/<api>/metrics"""
+        if len(segments) == 0:
+            return Metrics(), []
+        return BadRequest(), []
+
     @child()
     def reserved(self, request, segments):
         """/<api>/reserved/[...]"""
@@ -0,0 +1,75 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the `metrics` resource."""
+
+__all__ = [
+    'TestMetrics',
+    ]
+
+
+import unittest
+
+from base64 import b64encode
+from httplib2 import Http
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.database.transaction import transaction
+from mailman.testing.helpers import call_api, specialized_message_from_string
+from mailman.testing.layers import RESTLayer
+from urllib.error import HTTPError
+
+
+
+class TestMetrics(unittest.TestCase):
+    layer = RESTLayer
+
+    def _get(self, url):
+        basic_auth = '{0}:{1}'.format(
+            config.webservice.admin_user, config.webservice.admin_pass)
+        token = b64encode(basic_auth.encode('utf-8')).decode('ascii')
+        return Http().request(
+            url, 'GET', headers={'Authorization': 'Basic ' + token})
+
+    def test_prometheus_text(self):
+        # The metrics are exposed in the Prometheus text format, including
+        # the number of files in each queue.
+        with transaction():
+            create_list('test@example.com')
+        msg = specialized_message_from_string("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['bad'].enqueue(msg)
+        response, content = self._get('http://localhost:9001/3.0/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response['content-type'],
+                         'text/plain; version=0.0.4; charset=utf-8')
+        lines = content.decode('utf-8').splitlines()
+        self.assertIn('# TYPE mailman_queue_files gauge', lines)
+        self.assertIn('mailman_queue_files{queue="bad"} 1', lines)
+        self.assertIn('mailman_queue_files{queue="in"} 0', lines)
+        # The REST server committed the transaction creating the list.
+        self.assertIn('# TYPE mailman_database_commit_seconds histogram',
+                      lines)
+
+    def test_no_subresources(self):
+        with self.assertRaises(HTTPError) as cm:
+            call_api('http://localhost:9001/3.0/metrics/foo')
+        self.assertEqual(cm.exception.code, 400)
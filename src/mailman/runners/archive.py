@@ -85,6 +85,8 @@ def _should_clobber(msg, msgdata, archiver):
 class ArchiveRunner(Runner):
     """The archive runner."""
 
+    transactional = False
+
     def _dispose(self, mlist, msg, msgdata):
         received_time = msgdata.get('received_time', now(strip_tzinfo=False))
         archiver_set = IListArchiverSet(mlist)
@@ -34,6 +34,7 @@ from io import StringIO
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.runner import Runner
+from mailman.core.switchboard import get_priority
 from mailman.email.message import Message, MultipartDigestMessage
 from mailman.handlers.decorate import decorate
 from mailman.interfaces.member import DeliveryMode, DeliveryStatus
@@ -311,6 +312,8 @@ class RFC1153Digester(Digester):
 class DigestRunner(Runner):
     """The digest runner."""
 
+    transactional = False
+
     def _dispose(self, mlist, msg, msgdata):
         """See `IRunner`."""
         volume = msgdata['volume']
@@ -376,11 +379,16 @@ class DigestRunner(Runner):
                         address, delivery_mode))
         # Send the digests to the virgin queue for final delivery.
         queue = config.switchboards['virgin']
+        digest_kws = {}
+        if get_priority('digest') != 0:
+            digest_kws['priority'] = get_priority('digest')
         queue.enqueue(mime,
                       recipients=mime_recipients,
                       listid=mlist.list_id,
-                      isdigest=True)
+                      isdigest=True,
+                      **digest_kws)
         queue.enqueue(rfc1153,
                       recipients=rfc1153_recipients,
                       listid=mlist.list_id,
-                      isdigest=True)
+                      isdigest=True,
+                      **digest_kws)
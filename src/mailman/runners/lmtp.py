@@ -44,9 +44,11 @@ import smtpd
 import logging
 import asyncore
 
+from contextlib import ExitStack
 from email.utils import parseaddr
 from mailman.config import config
 from mailman.core.runner import Runner
+from mailman.core.switchboard import group_commit
 from mailman.database.transaction import transactional
 from mailman.email.message import Message
 from mailman.interfaces.listmanager import IListManager
@@ -155,6 +157,7 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
     # necessary only to satisfy the API.
 
     is_queue_runner = False
+    transactional = False
 
     def __init__(self, name, slice=None):
         localaddr = config.mta.lmtp_host, int(config.mta.lmtp_port)
@@ -199,6 +202,15 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
         # the message to the appropriate place and record a 250 status for
         # that recipient.  If not, record a failure status for that recipient.
         received_time = now()
+        # With a group commit, the queue files for all the recipients are
+        # flushed to disk together, before any status is returned.  Every
+        # exception is caught in the loop below.
+        batch = ExitStack()
+        if self.group_commit:
+            batch.enter_context(group_commit())
+        # When the message is enqueued more than once, it can be stored once
+        # and shared by all its queue files.
+        sharebody = (self.shared_bodies and len(rcpttos) > 1)
         for to in rcpttos:
             try:
                 to = parseaddr(to)[1].lower()
@@ -241,7 +253,8 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
                 # If we found a valid destination, enqueue the message and add
                 # a success status for this recipient.
                 if queue is not None:
-                    config.switchboards[queue].enqueue(msg, msgdata)
+                    config.switchboards[queue].enqueue(
+                        msg, msgdata, _sharebody=sharebody)
                     slog.debug('%s subaddress: %s, queue: %s',
                                message_id, canonical_subaddress, queue)
                     status.append('250 Ok')
@@ -249,6 +262,11 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
                 slog.exception('Queue detection: %s', msg['message-id'])
                 config.db.abort()
                 status.append(ERR_550)
+        try:
+            batch.close()
+        except Exception:
+            elog.exception('LMTP queue commit: %s', message_id)
+            return CRLF.join(ERR_451 for to in rcpttos)
         # All done; returning this big status string should give the expected
         # response to the LMTP client.
         return CRLF.join(status)
@@ -55,6 +55,8 @@ mcre = re.compile(r"""
 
 
 class NNTPRunner(Runner):
+    transactional = False
+
     def _dispose(self, mlist, msg, msgdata):
         # Get NNTP server connection information.
         host = config.nntp.host.strip()
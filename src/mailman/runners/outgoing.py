@@ -53,6 +53,8 @@ debug_log = logging.getLogger('mailman.debug')
 class OutgoingRunner(Runner):
     """The outgoing runner."""
 
+    transactional = False
+
     def __init__(self, slice=None, numslices=1):
         super(OutgoingRunner, self).__init__(slice, numslices)
         # We look this function up only at startup time.
@@ -38,5 +38,6 @@ class RetryRunner(Runner):
         return False
 
     def _snooze(self, filecnt):
-        # We always want to snooze.
-        time.sleep(self.sleep_float)
+        # We always want to snooze, and for longer when there was nothing to
+        # retry.
+        time.sleep(self._backoff(filecnt))
@@ -0,0 +1,217 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks for Mailman's performance sensitive code paths.
+
+Run a benchmark with e.g.
+
+    $ python -m mailman.testing.benchmark enqueue
+    $ python -m mailman.testing.benchmark runner pipeline --batch 1 50
+    $ python -m mailman.testing.benchmark startup
+
+The benchmarks run in the testing configuration, so they do not touch the
+installation's data.  Use --help for the available benchmarks and options.
+"""
+
+__all__ = [
+    'main',
+    ]
+
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from mailman.config import config
+from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.testing.layers import ConfigLayer
+
+
+MESSAGE = """\
+From: anne@example.com
+To: test@example.com
+Subject: A benchmark message
+Message-ID: <{0}@example.com>
+
+{1}
+"""
+
+# Start the REST API's WSGI application, without serving any requests.
+REST_START = """\
+import sys
+from mailman.core.initialize import initialize
+from mailman.rest.wsgiapp import make_application
+initialize(sys.argv[1])
+make_application()
+"""
+
+
+
+def _message(index, size):
+    return mfs(MESSAGE.format(index, 'x' * size))
+
+
+def _report(label, count, elapsed):
+    print('{0:<24} {1:>8} files in {2:8.3f}s  {3:10.1f} files/sec'.format(
+        label, count, elapsed, count / elapsed))
+
+
+
+def bench_enqueue(args):
+    """Switchboard.enqueue() with and without group commits."""
+    from mailman.core.switchboard import Switchboard, group_commit
+    messages = [_message(i, args.size) for i in range(args.count)]
+    for label, batch_size in (('fsync per file', 1),
+                              ('group commit', args.batch)):
+        queue_directory = tempfile.mkdtemp(dir=args.directory)
+        try:
+            switchboard = Switchboard('benchmark', queue_directory)
+            start = time.time()
+            for i in range(0, len(messages), batch_size):
+                batch = messages[i:i + batch_size]
+                if batch_size == 1:
+                    switchboard.enqueue(batch[0], listid='test.example.com')
+                    continue
+                with group_commit():
+                    for msg in batch:
+                        switchboard.enqueue(msg, listid='test.example.com')
+            _report('{0} ({1})'.format(label, batch_size),
+                    args.count, time.time() - start)
+        finally:
+            shutil.rmtree(queue_directory)
+
+
+
+def bench_runner(args):
+    """Runner throughput with several transaction batch sizes."""
+    from mailman.app.lifecycle import create_list
+    from mailman.runners.pipeline import PipelineRunner
+    from mailman.testing.helpers import make_testable_runner
+    runner_class = dict(pipeline=PipelineRunner)
+    ConfigLayer.testSetUp()
+    try:
+        mlist = create_list('test@example.com')
+        config.db.commit()
+        recipients = set('{0}person@example.com'.format(letter)
+                         for letter in 'abcd')
+        queue = config.switchboards[args.runner]
+        for batch_size in args.batch:
+            for i in range(args.count):
+                queue.enqueue(_message(i, args.size),
+                              listid=mlist.list_id,
+                              recipients=recipients)
+            runner = make_testable_runner(
+                runner_class[args.runner], args.runner)
+            runner.batch_size = batch_size
+            start = time.time()
+            runner.run()
+            _report('{0} (batch {1})'.format(args.runner, batch_size),
+                    args.count, time.time() - start)
+            # Throw away everything the runner produced.
+            for switchboard in config.switchboards.values():
+                for filebase in switchboard.files:
+                    switchboard.dequeue(filebase)
+                    switchboard.finish(filebase)
+    finally:
+        ConfigLayer.testTearDown()
+
+
+
+def bench_startup(args):
+    """Startup time of the mailman command, a runner and the REST API."""
+    mailman = os.path.join(config.BIN_DIR, 'mailman')
+    runner = os.path.join(config.BIN_DIR, 'runner')
+    commands = (
+        ('mailman info',
+         [sys.executable, mailman, '-C', config.filename, 'info']),
+        ('runner start',
+         [sys.executable, runner, '-C', config.filename,
+          '--runner=in', '--once']),
+        ('REST start',
+         [sys.executable, '-c', REST_START, config.filename]),
+        )
+    for label, command in commands:
+        timings = []
+        for i in range(args.count):
+            start = time.time()
+            subprocess.check_call(command, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+            timings.append(time.time() - start)
+        timings.sort()
+        print('{0:<24} best {1:7.3f}s  median {2:7.3f}s'.format(
+            label, timings[0], timings[len(timings) // 2]))
+
+
+
+def main():
+    """Run a benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+    enqueue = subparsers.add_parser('enqueue', help=bench_enqueue.__doc__)
+    enqueue.add_argument(
+        '--count', type=int, default=1000,
+        help='The number of messages to enqueue.')
+    enqueue.add_argument(
+        '--batch', type=int, default=50,
+        help='The number of messages per group commit.')
+    enqueue.add_argument(
+        '--size', type=int, default=2000,
+        help='The size of the message bodies, in bytes.')
+    enqueue.add_argument(
+        '--directory', default=None,
+        help="""The directory to create the queue in.  Use a directory on the
+        disk being measured; the default is inside the temporary testing
+        configuration.""")
+    enqueue.set_defaults(function=bench_enqueue)
+    runner = subparsers.add_parser('runner', help=bench_runner.__doc__)
+    runner.add_argument(
+        'runner', choices=('pipeline',),
+        help='The runner to measure.')
+    runner.add_argument(
+        '--count', type=int, default=500,
+        help='The number of messages to process per batch size.')
+    runner.add_argument(
+        '--batch', type=int, nargs='+', default=[1, 10, 50, 200],
+        help='The batch sizes to measure.')
+    runner.add_argument(
+        '--size', type=int, default=2000,
+        help='The size of the message bodies, in bytes.')
+    runner.set_defaults(function=bench_runner)
+    startup = subparsers.add_parser('startup', help=bench_startup.__doc__)
+    startup.add_argument(
+        '--count', type=int, default=5,
+        help='The number of times to start each program.')
+    startup.set_defaults(function=bench_startup)
+    args = parser.parse_args()
+    if args.benchmark is None:
+        parser.print_help()
+        sys.exit(1)
+    ConfigLayer.setUp()
+    try:
+        if getattr(args, 'directory', False) is None:
+            args.directory = config.QUEUE_DIR
+        args.function(args)
+    finally:
+        ConfigLayer.tearDown()
+
+
+if __name__ == '__main__':
+    main()
@@ -56,6 +56,7 @@ def dump_msgdata(msgdata, *additional_skips):
     # Some stuff we always want to skip, because their values will always be
     # variable data.
     skips.add('received_time')
+    skips.add('stage_times')
     longest = max(len(key) for key in msgdata if key not in skips)
     for key in sorted(msgdata):
         if key in skips:
@@ -57,6 +57,7 @@ from contextlib import contextmanager
 from email import message_from_string
 from httplib2 import Http
 from lazr.config import as_timedelta
+from mailman.app import cache as lookup_cache
 from mailman.bin.master import Loop as Master
 from mailman.config import config
 from mailman.database.transaction import transaction
@@ -107,7 +108,9 @@ def make_testable_runner(runner_class, name=None, predicate=None):
         def _do_periodic(self):
             """Stop when the queue is empty."""
             if predicate is None:
-                self._stop = (len(self.switchboard.files) == 0)
+                # Backup files still to be recovered are in the queue too.
+                self._stop = (len(self.switchboard.files) == 0 and
+                              not self._recovering)
             else:
                 self._stop = predicate(self)
 
@@ -468,6 +471,7 @@ def reset_the_world():
     * Remove all residual queue and digest files
     * Clear the message store
     * Reset the global style manager
+    * Clear the runners' lookup caches
 
     This should be as thorough a reset of the system as necessary to keep
     tests isolated.
@@ -498,6 +502,8 @@ def reset_the_world():
     getUtility(IStyleManager).populate()
     # Remove all dynamic header-match rules.
     config.chains['header-match'].flush()
+    # Clear the runners' lookup caches.
+    lookup_cache.clear()
 
 
 
@@ -0,0 +1,190 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Watch directories for new files using Linux's inotify.
+
+The inotify API is accessed through ctypes, so no third party package is
+required.  On systems without inotify, `DirectoryWatcher` raises an OSError
+when it is instantiated and callers are expected to fall back to polling.
+"""
+
+__all__ = [
+    'DirectoryWatcher',
+    'IN_DELETE',
+    'IN_MOVED_FROM',
+    'IN_MOVED_TO',
+    'IN_Q_OVERFLOW',
+    ]
+
+
+import os
+import time
+import errno
+import ctypes
+import select
+import struct
+import ctypes.util
+
+
+# Constants from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Events which signal that a new file has shown up.
+_ARRIVALS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_Q_OVERFLOW
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT = struct.Struct('iIII')
+_BUFSIZE = 64 * 1024
+
+_libc = None
+
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        path = ctypes.util.find_library('c')
+        if path is None:
+            raise OSError(errno.ENOSYS, 'No C library found')
+        libc = ctypes.CDLL(path, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+    return _libc
+
+
+
+class DirectoryWatcher:
+    """Wait for files to appear in a set of directories."""
+
+    def __init__(self, directories, mask=IN_MOVED_TO, suffix=None):
+        """Start watching the directories.
+
+        :param directories: The directories to watch.
+        :type directories: sequence of strings
+        :param mask: The inotify event mask.  By default, only files renamed
+            into the directory are reported, since that is how queue files
+            are atomically published.
+        :type mask: int
+        :param suffix: If given, only new files with names ending in this
+            suffix wake up the watcher.  Other events are still reported.
+        :type suffix: str
+        :raises OSError: when inotify is not available.
+        """
+        self._fd = None
+        libc = _get_libc()
+        self._suffix = suffix
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._directories = {}
+        try:
+            for directory in directories:
+                wd = libc.inotify_add_watch(
+                    self._fd, os.fsencode(directory), mask)
+                if wd < 0:
+                    error = ctypes.get_errno()
+                    raise OSError(error, os.strerror(error), directory)
+                self._directories[wd] = directory
+        except OSError:
+            self.close()
+            raise
+
+    def fileno(self):
+        """The inotify file descriptor, e.g. for use with `select()`."""
+        return self._fd
+
+    def close(self):
+        """Stop watching."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+    def read_events(self):
+        """Return all the pending events without blocking.
+
+        :return: The list of events as 3-tuples of the form (directory, name,
+            mask).  When the kernel's event queue overflowed, the event's
+            directory and name are both None and the mask contains
+            `IN_Q_OVERFLOW`; callers must then assume they missed events.
+        :rtype: list of 3-tuples
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self._fd, _BUFSIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None, None, mask))
+                else:
+                    events.append((self._directories.get(wd),
+                                   os.fsdecode(name), mask))
+
+    def _interesting(self, events):
+        for directory, name, mask in events:
+            if not mask & _ARRIVALS:
+                continue
+            if name is None or self._suffix is None:
+                return True
+            if name.endswith(self._suffix):
+                return True
+        return False
+
+    def wait(self, timeout):
+        """Wait until a new file shows up, or the timeout expires.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float
+        :return: All the events read while waiting, as described in
+            `read_events()`.  The list is empty when the timeout expired.
+        :rtype: list of 3-tuples
+        """
+        events = []
+        until = time.time() + timeout
+        while True:
+            remaining = until - time.time()
+            if remaining <= 0:
+                break
+            readable, writable, errored = select.select(
+                [self._fd], [], [], remaining)
+            if not readable:
+                break
+            more = self.read_events()
+            events.extend(more)
+            if self._interesting(more):
+                break
+        return events
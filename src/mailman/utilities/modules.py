@@ -18,7 +18,10 @@
 """Package and module utilities."""
 
 __all__ = [
+    'ComponentInfo',
+    'LazyComponents',
     'call_name',
+    'component_manifest',
     'expand_path',
     'find_components',
     'find_name',
@@ -28,10 +31,28 @@ __all__ = [
 
 import os
 import sys
+import json
+import time
 
+from collections import namedtuple
+from collections.abc import MutableMapping
 from pkg_resources import resource_filename, resource_listdir
 
 
+# The component manifests are kept in this file in the __pycache__ directory
+# of the packages, next to the byte code.
+MANIFEST = 'mailman-components.json'
+
+# A directory's modification time only has the granularity of the kernel's
+# clock tick, so a directory modified this many seconds ago or less may still
+# change without its modification time changing.
+RACY_SECONDS = 2
+
+# A component listed in a manifest: the names of its module and of the
+# module attribute it is bound to, and its `name` and docstring, if any.
+ComponentInfo = namedtuple('ComponentInfo', 'module attribute name doc')
+
+
 
 def find_name(dotted_name):
     """Import and return the named object in package space.
@@ -74,21 +95,125 @@ def scan_module(module, interface):
     :return: The sequence of matching components.
     :rtype: objects implementing `interface`
     """
+    for name, component in _scan_names(module, interface):
+        yield component
+
+
+def _scan_names(module, interface):
     missing = object()
     for name in module.__all__:
         component = getattr(module, name, missing)
         assert component is not missing, (
             '%s has bad __all__: %s' % (module, name))
         if interface.implementedBy(component):
-            yield component
+            yield name, component
 
 
 
+def _describe_module(module_name, interface):
+    """Import a module and describe the components it has in its __all__."""
+    __import__(module_name, fromlist='*')
+    module = sys.modules[module_name]
+    if not hasattr(module, '__all__'):
+        return []
+    components = []
+    for attribute, component in _scan_names(module, interface):
+        name = getattr(component, 'name', None)
+        components.append([
+            attribute,
+            (name if isinstance(name, str) else None),
+            component.__doc__,
+            ])
+    return components
+
+
+def _write_manifest(path, manifest):
+    # Like byte code, the manifest is not written when Python is told not to
+    # write byte code, and not having it only makes the next search slower.
+    if sys.dont_write_bytecode:
+        return
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(manifest, fp)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def component_manifest(package, interface):
+    """List the components in a package which conform to an interface.
+
+    This is what `find_components()` would find, but the modules are only
+    imported when there is no manifest for them yet.  The manifest of a
+    package is persisted in its __pycache__ directory.  It is valid as long
+    as the modification time of the package directory doesn't change, which
+    happens when modules are added, removed or replaced.  Otherwise the
+    entries for a module are kept as long as the module's modification time
+    and size do not change, and the modules which changed are imported and
+    scanned again.  A module rewritten in place is only scanned again once
+    the directory changes too.
+
+    :param package: The package path to search.
+    :type package: string
+    :param interface: The interface that the components must conform to.
+    :type interface: `Interface`
+    :return: The components, sorted by module.
+    :rtype: list of `ComponentInfo`
+    """
+    directory = resource_filename(package, '')
+    path = os.path.join(directory, '__pycache__', MANIFEST)
+    try:
+        with open(path, 'r', encoding='utf-8') as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        manifest = {}
+    cached = manifest.get(interface.__identifier__, {})
+    # Stat the directory before listing it, so that a change in between is
+    # noticed next time.
+    mtime_ns = os.stat(directory).st_mtime_ns
+    if time.time() - mtime_ns / 10 ** 9 <= RACY_SECONDS:
+        signature = None
+    else:
+        signature = mtime_ns
+    if signature is not None and cached.get('signature') == signature:
+        modules = cached['modules']
+    else:
+        cached_modules = cached.get('modules', {})
+        modules = {}
+        for filename in resource_listdir(package, ''):
+            basename, extension = os.path.splitext(filename)
+            if extension != '.py':
+                continue
+            stat = os.stat(os.path.join(directory, filename))
+            module_signature = [stat.st_mtime_ns, stat.st_size]
+            entry = cached_modules.get(basename)
+            if entry is None or entry['signature'] != module_signature:
+                module_name = '{0}.{1}'.format(package, basename)
+                entry = dict(
+                    signature=module_signature,
+                    components=_describe_module(module_name, interface))
+            modules[basename] = entry
+        entry = dict(signature=signature, modules=modules)
+        if entry != cached:
+            manifest[interface.__identifier__] = entry
+            _write_manifest(path, manifest)
+    return [ComponentInfo('{0}.{1}'.format(package, basename), *component)
+            for basename in sorted(modules)
+            for component in modules[basename]['components']]
+
+
 def find_components(package, interface):
     """Find components which conform to a given interface.
 
     Search all the modules in a given package, returning an iterator over all
-    objects found that conform to the given interface.
+    objects found that conform to the given interface.  Modules without any
+    such objects are not imported when the package's component manifest
+    lists them.
 
     :param package: The package path to search.
     :type package: string
@@ -97,20 +222,102 @@ def find_components(package, interface):
     :return: The sequence of matching components.
     :rtype: objects implementing `interface`
     """
-    for filename in resource_listdir(package, ''):
-        basename, extension = os.path.splitext(filename)
-        if extension != '.py':
-            continue
-        module_name = '{0}.{1}'.format(package, basename)
-        __import__(module_name, fromlist='*')
-        module = sys.modules[module_name]
-        if not hasattr(module, '__all__'):
-            continue
-        for component in scan_module(module, interface):
-            yield component
+    for info in component_manifest(package, interface):
+        yield find_name('{0}.{1}'.format(info.module, info.attribute))
 
 
 
+class LazyComponents(MutableMapping):
+    """A mapping of names to components which are created on first use.
+
+    The components of a package are registered by the names listed in its
+    component manifest, and their modules are only imported when they are
+    looked up.  Iterating over the names doesn't import anything.
+    """
+
+    def __init__(self):
+        self._components = {}
+        # The names of the components not created yet, and the callables
+        # creating them.
+        self._factories = {}
+
+    def add_package(self, package, interface, make):
+        """Register the components of a package.
+
+        :param package: The package path to search.
+        :type package: string
+        :param interface: The interface that the components must conform to.
+        :type interface: `Interface`
+        :param make: A callable which is passed a component found in the
+            package, e.g. a class, and returns the object to register, or
+            None to skip it.  Components without a name in the manifest are
+            imported and made right away, to find out their names.
+        :type make: callable
+        """
+        for info in component_manifest(package, interface):
+            dotted_name = '{0}.{1}'.format(info.module, info.attribute)
+            if info.name is None:
+                component = make(find_name(dotted_name))
+                if component is None:
+                    continue
+                name = component.name
+            else:
+                name = info.name
+                component = None
+            assert name not in self, (
+                'Duplicate component "{0}" found in {1}'.format(
+                    name, dotted_name))
+            if component is None:
+                self._factories[name] = (make, dotted_name)
+            else:
+                self._components[name] = component
+
+    def __getitem__(self, name):
+        component = self._components.get(name)
+        if component is not None:
+            return component
+        make, dotted_name = self._factories[name]
+        component = make(find_name(dotted_name))
+        if component is None:
+            raise KeyError(name)
+        del self._factories[name]
+        self._components[name] = component
+        return component
+
+    def __setitem__(self, name, component):
+        self._factories.pop(name, None)
+        self._components[name] = component
+
+    def __delitem__(self, name):
+        if name in self._factories:
+            del self._factories[name]
+        else:
+            del self._components[name]
+
+    def __contains__(self, name):
+        return name in self._components or name in self._factories
+
+    def __iter__(self):
+        yield from list(self._components)
+        yield from list(self._factories)
+
+    def __len__(self):
+        return len(self._components) + len(self._factories)
+
+    def clear(self):
+        """Remove all the components, without creating them."""
+        self._components.clear()
+        self._factories.clear()
+
+    def copy(self):
+        """Return a shallow copy."""
+        components = LazyComponents()
+        components._components.update(self._components)
+        components._factories.update(self._factories)
+        return components
+
+
+
 def expand_path(url):
     """Expand a python: path, returning the absolute file system path."""
     # Is the context coming from a file system or Python path?
@@ -0,0 +1,213 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the component manifests."""
+
+__all__ = [
+    'IAnimal',
+    'TestComponentManifest',
+    'TestLazyComponents',
+    'ZooTestCase',
+    ]
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from mailman.utilities.modules import (
+    ComponentInfo, LazyComponents, MANIFEST, component_manifest,
+    find_components)
+from unittest.mock import patch
+from zope.interface import Interface
+
+
+ANIMALS = """\
+from mailman.utilities.tests.test_modules import IAnimal
+from zope.interface import implementer
+
+__all__ = [
+    'Ant',
+    'Bee',
+    ]
+
+
+@implementer(IAnimal)
+class Ant:
+    \"\"\"A small insect.\"\"\"
+    name = 'ant'
+
+
+class Bee:
+    name = 'bee'
+"""
+
+
+
+class IAnimal(Interface):
+    """A test interface."""
+
+
+
+class ZooTestCase(unittest.TestCase):
+    """A test case with a package of animal modules."""
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self._package = os.path.join(self._directory, 'zoo')
+        os.mkdir(self._package)
+        with open(os.path.join(self._package, '__init__.py'), 'w'):
+            pass
+        self._write('animals', ANIMALS)
+        sys.path.insert(0, self._directory)
+        self.addCleanup(sys.path.remove, self._directory)
+        self.addCleanup(self._unimport)
+        self._manifest = os.path.join(self._package, '__pycache__', MANIFEST)
+        # The manifest is written even when the byte code isn't.
+        patcher = patch('sys.dont_write_bytecode', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, basename, text):
+        path = os.path.join(self._package, basename + '.py')
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+    def _unimport(self):
+        for name in list(sys.modules):
+            if name == 'zoo' or name.startswith('zoo.'):
+                del sys.modules[name]
+
+
+
+class TestComponentManifest(ZooTestCase):
+    """Test the component manifests."""
+
+    def test_manifest(self):
+        # The manifest lists the components with their names and docstrings,
+        # and is persisted in the package's __pycache__ directory.
+        self.assertEqual(component_manifest('zoo', IAnimal), [
+            ComponentInfo('zoo.animals', 'Ant', 'ant', 'A small insect.')])
+        with open(self._manifest) as fp:
+            manifest = json.load(fp)
+        self.assertEqual(
+            manifest[IAnimal.__identifier__]['modules']['animals'][
+                'components'],
+            [['Ant', 'ant', 'A small insect.']])
+
+    def test_manifest_skips_imports(self):
+        # Once the manifest is written, the modules are not imported to list
+        # their components, and find_components() only imports the modules
+        # with components.
+        self._write('plants', '__all__ = []\n')
+        component_manifest('zoo', IAnimal)
+        self._unimport()
+        self.assertEqual(len(component_manifest('zoo', IAnimal)), 1)
+        self.assertNotIn('zoo.animals', sys.modules)
+        self.assertEqual([component.name for component
+                          in find_components('zoo', IAnimal)], ['ant'])
+        self.assertIn('zoo.animals', sys.modules)
+        self.assertNotIn('zoo.plants', sys.modules)
+
+    def test_changed_module(self):
+        # Modules which changed since the manifest was written are scanned
+        # again.
+        component_manifest('zoo', IAnimal)
+        self._unimport()
+        self._write('animals', ANIMALS.replace(
+            'class Bee:', '@implementer(IAnimal)\nclass Bee:'))
+        path = os.path.join(self._package, 'animals.py')
+        # Make sure the modification time changes too.
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(
+            [info.name for info in component_manifest('zoo', IAnimal)],
+            ['ant', 'bee'])
+
+    def test_unchanged_directory(self):
+        # As long as the package directory doesn't change, the manifest is
+        # used without looking at the modules.  The first manifest creates
+        # the __pycache__ directory, which changes the package directory.
+        component_manifest('zoo', IAnimal)
+        stat = os.stat(self._package)
+        os.utime(self._package, ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns - 3600 * 10 ** 9))
+        component_manifest('zoo', IAnimal)
+        with patch('mailman.utilities.modules.os.stat',
+                   wraps=os.stat) as stat:
+            self.assertEqual(len(component_manifest('zoo', IAnimal)), 1)
+        self.assertEqual(stat.call_count, 1)
+        # Adding a module changes the directory.
+        self._write('bugs', ANIMALS.replace('Ant', 'Bug').replace(
+            "'ant'", "'bug'"))
+        self.assertEqual(
+            [info.name for info in component_manifest('zoo', IAnimal)],
+            ['ant', 'bug'])
+
+    def test_removed_module(self):
+        # Modules which were removed drop out of the manifest.
+        component_manifest('zoo', IAnimal)
+        os.remove(os.path.join(self._package, 'animals.py'))
+        self.assertEqual(component_manifest('zoo', IAnimal), [])
+
+    def test_unwritable_manifest(self):
+        # When the manifest cannot be written, the components are still
+        # found.
+        with patch('mailman.utilities.modules.json.dump',
+                   side_effect=OSError):
+            self.assertEqual(len(component_manifest('zoo', IAnimal)), 1)
+        self.assertFalse(os.path.exists(self._manifest))
+        self.assertEqual([filename for filename
+                          in os.listdir(os.path.dirname(self._manifest))
+                          if filename.startswith(MANIFEST)], [])
+
+
+
+class TestLazyComponents(ZooTestCase):
+    """Test the mappings of components created on first use."""
+
+    def test_imported_on_lookup(self):
+        # The modules of the components are only imported, and the components
+        # made, when they are looked up.
+        component_manifest('zoo', IAnimal)
+        self._unimport()
+        made = []
+        def make(component_class):
+            made.append(component_class.__name__)
+            return component_class()
+        components = LazyComponents()
+        components.add_package('zoo', IAnimal, make)
+        self.assertEqual(list(components), ['ant'])
+        self.assertIn('ant', components)
+        self.assertEqual(made, [])
+        self.assertNotIn('zoo.animals', sys.modules)
+        ant = components['ant']
+        self.assertEqual(made, ['Ant'])
+        self.assertIs(components['ant'], ant)
+        self.assertEqual(made, ['Ant'])
+
+    def test_skipped(self):
+        # Components which are skipped are not found.
+        components = LazyComponents()
+        components.add_package('zoo', IAnimal, lambda component_class: None)
+        with self.assertRaises(KeyError):
+            components['ant']
+        self.assertIsNone(components.get('ant'))